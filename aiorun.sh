@@ -0,0 +1,4 @@
+#!/bin/sh
+export HOST=$(ip -4 addr show wlan0 | grep -oP '(?<=inet\s)\d+(\.\d+){3}')
+export PORT=8000
+python3 aioserver.py
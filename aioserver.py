@@ -0,0 +1,569 @@
+import asyncio
+import base64
+import functools
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from flask import g
+from pydantic import ValidationError
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+from werkzeug.routing import Rule
+from app import LEADER_ENDPOINTS, app, log_tail_request, verify_password, verify_token
+from archive import archive_etag, archive_last_modified, cached_archive, stream_archive
+from catalog import MapCatalog
+from control import FORWARD_TIMEOUT, HOP_HEADERS, Control
+from events import EventBus
+from fleet import Fleet, aggregate
+from logtail import follow_step
+from metrics import REQUEST_SECONDS, Metrics
+from utils import amr_robot_maps, config
+from validator import ValidateFleetMap, ValidateLogTail, ValidateNavigation, RespWrapper
+from watcher import Watcher
+
+# threads for the Flask routes bridged off the event loop, see create_app
+BRIDGE_THREADS = 32
+# threads for the launch control routes on the leader; they serialize on the launcher lock anyway, and a start
+# that waits on the launch service must not take the bridge's threads with it
+CONTROL_THREADS = 4
+
+
+def json_response(response: RespWrapper, status: int = 200) -> web.Response:
+    # same serialization as Flask's jsonify, so both servers return byte-identical envelopes
+    return web.Response(text=json.dumps(response.dict(), sort_keys=True, separators=(',', ':')) + '\n',
+                        status=status, content_type='application/json')
+
+
+class StreamInput(io.RawIOBase):
+    # wsgi.input that pulls the request body from the event loop as the Flask app reads it, so uploads stream
+    def __init__(self, request: web.Request, loop: asyncio.AbstractEventLoop):
+        super().__init__()
+        self.content = request.content
+        self.loop = loop
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = asyncio.run_coroutine_threadsafe(self.content.read(len(buffer)), self.loop).result()
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def wsgi_environ(request: web.Request, stream: Optional[io.RawIOBase] = None) -> dict:
+    host, _, port = request.host.partition(':')
+    environ = {'REQUEST_METHOD': request.method,
+               'SCRIPT_NAME': '',
+               'PATH_INFO': unquote_to_bytes(request.raw_path.partition('?')[0]).decode('latin-1'),
+               'QUERY_STRING': request.query_string,
+               'SERVER_NAME': host,
+               'SERVER_PORT': port or ('443' if request.secure else '80'),
+               'SERVER_PROTOCOL': f"HTTP/{request.version.major}.{request.version.minor}",
+               'REMOTE_ADDR': request.remote or '',
+               'wsgi.version': (1, 0),
+               'wsgi.url_scheme': request.scheme,
+               'wsgi.input': io.BufferedReader(stream) if stream is not None else io.BytesIO(),
+               'wsgi.input_terminated': request.headers.get('Transfer-Encoding', '').lower() == 'chunked',
+               'wsgi.errors': sys.stderr,
+               'wsgi.multithread': True,
+               'wsgi.multiprocess': False,
+               'wsgi.run_once': False}
+    for key, value in request.headers.items():
+        key = key.upper().replace('-', '_')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+        else:
+            name = f"HTTP_{key}"
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+async def bridge(request: web.Request, executor: Optional[ThreadPoolExecutor] = None) -> web.StreamResponse:
+    loop = asyncio.get_running_loop()
+    executor = executor or request.app['bridge_executor']
+    # the Flask app counts the requests it serves
+    request['bridged'] = True
+    started: List[Tuple[str, list]] = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [(status, headers)]
+        return lambda data: None
+
+    environ = wsgi_environ(request, StreamInput(request, loop))
+    body = await loop.run_in_executor(executor, app, environ, start_response)
+    status, headers = started[0]
+    response = web.StreamResponse(status=int(status.split(' ', 1)[0]), reason=status.partition(' ')[2] or None)
+    for key, value in headers:
+        response.headers.add(key, value)
+    await response.prepare(request)
+    iterator = iter(body)
+    try:
+        # streamed Flask responses (log follow, zip generation) produce their chunks off the loop
+        while True:
+            chunk = await loop.run_in_executor(executor, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                await response.write(chunk)
+    finally:
+        if hasattr(body, 'close'):
+            await loop.run_in_executor(executor, body.close)
+    await response.write_eof()
+    return response
+
+
+async def authenticate(request: web.Request, role: Optional[str] = None) -> Optional[web.Response]:
+    # same checks as the Flask MultiAuth: Basic (cached, DB on a miss) or Bearer; returns an error response or None
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+
+    def verify():
+        with app.app_context():
+            if scheme.lower() == 'basic':
+                try:
+                    username, _, password = base64.b64decode(credentials).decode().partition(':')
+                except ValueError:
+                    return None, []
+                user = verify_password(username, password)
+            elif scheme.lower() == 'bearer':
+                user = verify_token(credentials)
+            else:
+                return None, []
+            return user, g.get('user_roles', [])
+
+    if scheme.lower() == 'basic':
+        user, roles = await asyncio.get_running_loop().run_in_executor(request.app['bridge_executor'], verify)
+    else:
+        user, roles = verify()
+    if user is None:
+        return web.Response(text='Unauthorized Access', status=401,
+                            headers={'WWW-Authenticate': 'Basic realm="Authentication Required"'})
+    if role is not None and role not in roles:
+        return web.Response(text='Forbidden', status=403)
+    return None
+
+
+def flask_rule(request: web.Request) -> Optional[Rule]:
+    try:
+        return app.url_map.bind(request.host).match(request.path, request.method, return_rule=True)[0]
+    except HTTPException:
+        return None
+
+
+async def relay(request: web.Request, stream: bool = False) -> Optional[web.StreamResponse]:
+    # Control.forward on the event loop: the request goes to the leader over its unix socket and the answer is
+    # streamed back, without a thread. None when this worker became the leader and should serve it itself
+    headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_HEADERS}
+    body = await request.read() if request.can_read_body else None
+    # event streams stay open indefinitely and carry their own heartbeat
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=FORWARD_TIMEOUT,
+                                    sock_read=None if stream else FORWARD_TIMEOUT)
+    try:
+        upstream = await request.app['leader_session'].request(request.method, f"http://localhost{request.raw_path}",
+                                                               headers=headers, data=body, timeout=timeout)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        if Control.is_leader():
+            return None
+        response = RespWrapper(error=True, message="launch control is unavailable, retry shortly")
+        denied = json_response(response, 503)
+        denied.headers['Retry-After'] = '1'
+        return denied
+    async with upstream:
+        response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+        for key, value in upstream.headers.items():
+            if key.lower() not in HOP_HEADERS:
+                response.headers.add(key, value)
+        await response.prepare(request)
+        try:
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # the leader went away; event clients reconnect with Last-Event-ID
+            pass
+    await response.write_eof()
+    return response
+
+
+async def dispatch(request: web.Request) -> web.StreamResponse:
+    # the routes not served natively: launch control goes to the leader, everything else runs the Flask app
+    rule = flask_rule(request)
+    if rule is None or rule.endpoint not in LEADER_ENDPOINTS:
+        return await bridge(request)
+    request['route'] = rule.rule
+    if not Control.is_leader():
+        response = await relay(request, rule.endpoint == 'events')
+        if response is not None:
+            return response
+    return await bridge(request, request.app['control_executor'])
+
+
+async def home(request: web.Request) -> web.StreamResponse:
+    denied = await authenticate(request)
+    if denied is not None:
+        return denied
+    response = RespWrapper()
+    response.data = {'launcher': Control.shared_launcher()['state']}
+    return json_response(response)
+
+
+async def stack_state(request: web.Request) -> web.StreamResponse:
+    # served from the state the leader published, so a start holding the launcher lock never stalls the loop
+    denied = await authenticate(request)
+    if denied is not None:
+        return denied
+    stack = request.match_info['stack']
+    launcher = Control.shared_launcher()
+    response = RespWrapper()
+    response.data = {'launcher': launcher['state'],
+                     'pid': launcher['stacks'][stack]['pid'],
+                     'state': launcher['stacks'][stack]['state']}
+    if stack == 'navigation':
+        response.data['map'] = launcher.get('map')
+    return json_response(response)
+
+
+class EventWaiter:
+    # a single future shared by every subscriber; EventBus publishes from threads, so it is swapped on the loop
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        EventBus.subscribe(lambda event: loop.call_soon_threadsafe(self.notify))
+
+    def notify(self) -> None:
+        future, self.future = self.future, self.loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, last_id: int, timeout: float) -> Optional[list]:
+        if EventBus.last_id() <= last_id:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return EventBus.since(last_id)
+
+
+async def events(request: web.Request) -> web.StreamResponse:
+    if not Control.is_leader():
+        response = await relay(request, stream=True)
+        if response is not None:
+            return response
+    denied = await authenticate(request)
+    if denied is not None:
+        return denied
+    waiter: EventWaiter = request.app['event_waiter']
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+    last_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        last_id = None
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                           'X-Accel-Buffering': 'no'})
+    await response.prepare(request)
+    pending = EventBus.since(last_id) if last_id is not None else None
+    while True:
+        if pending is None:
+            last_id = EventBus.last_id()
+            pending = []
+            snapshot = await asyncio.get_running_loop().run_in_executor(request.app['bridge_executor'],
+                                                                        Watcher.shared_snapshot)
+            await response.write(f"event: snapshot\ndata: {json.dumps(snapshot)}\n\n".encode())
+        for event in pending:
+            last_id = event.id
+            await response.write(event.to_sse().encode())
+        pending = await waiter.wait(last_id, heartbeat)
+        if pending == []:
+            await response.write(b": heartbeat\n\n")
+
+
+def follows(request: web.Request) -> bool:
+    try:
+        return bool(ValidateLogTail.parse_obj({'follow': request.query.get('follow', False)}).follow)
+    except ValidationError:
+        return False
+
+
+async def launch_log(request: web.Request) -> web.StreamResponse:
+    # a followed log is polled from the loop, so a follower holds no thread between reads; reads of a log part
+    # run the Flask route
+    if not follows(request):
+        return await bridge(request)
+    denied = await authenticate(request, 'admin')
+    if denied is not None:
+        return denied
+    tail, error = log_tail_request(request.match_info['stack'], request.match_info['stream'], dict(request.query),
+                                   request.headers.get('Last-Event-ID'))
+    if error is not None:
+        return json_response(*error)
+    offset = tail.pop('offset')
+    del tail['follow']
+    loop = asyncio.get_running_loop()
+    poll_interval = app.config['LOG_TAIL_POLL_INTERVAL']
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream; charset=utf-8',
+                                           'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    await response.prepare(request)
+    idle = 0.0
+    while True:
+        event, offset, caught_up = await loop.run_in_executor(request.app['bridge_executor'],
+                                                              functools.partial(follow_step, offset=offset, **tail))
+        if event is not None:
+            idle = 0.0
+            await response.write(event.encode())
+        if caught_up:
+            await asyncio.sleep(poll_interval)
+            idle += poll_interval
+            if idle >= heartbeat:
+                idle = 0.0
+                await response.write(b": heartbeat\n\n")
+
+
+async def request_json(request: web.Request):
+    # like Flask's get_json(silent=True): None unless the body is well-formed JSON
+    if request.content_type != 'application/json' or not request.can_read_body:
+        return None
+    try:
+        return json.loads(await request.read())
+    except ValueError:
+        return None
+
+
+class ArchiveFileResponse(web.FileResponse):
+    # the cached zip under the validators of the map it was built from, the same ones the streamed archive carries
+    def __init__(self, path: str, etag: str, last_modified: datetime, **kwargs):
+        super().__init__(path, **kwargs)
+        self.__etag = etag
+        self.__last_modified = last_modified
+
+    async def prepare(self, request: web.BaseRequest):
+        if 'If-Range' in request.headers and is_resource_modified(wsgi_environ(request), etag=self.__etag,
+                                                                  last_modified=self.__last_modified,
+                                                                  ignore_if_range=False):
+            # a range of an older archive: the whole of the current one is sent instead
+            request = request.clone(headers=CIMultiDict((key, value) for key, value in request.headers.items()
+                                                        if key.lower() not in ('range', 'if-range')))
+        return await super().prepare(request)
+
+    @web.FileResponse.etag.setter
+    def etag(self, value) -> None:
+        web.FileResponse.etag.fset(self, self.__etag)
+
+    @web.FileResponse.last_modified.setter
+    def last_modified(self, value) -> None:
+        web.FileResponse.last_modified.fset(self, self.__last_modified)
+
+
+async def getmap(request: web.Request) -> web.StreamResponse:
+    denied = await authenticate(request, 'admin')
+    if denied is not None:
+        return denied
+    response = RespWrapper()
+    try:
+        if request.method == 'POST':
+            req = await request_json(request)
+        else:
+            req = dict(request.query)
+        content = ValidateNavigation.parse_raw(json.dumps(req))
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return json_response(response, 400)
+    entry = MapCatalog.get(content.map_name)
+    if entry is None:
+        response.error = True
+        response.message = f"map_file '{content.map_name}' doesn't exists"
+        response.data = {'existing_maps': MapCatalog.names()}
+        return json_response(response)
+    etag = archive_etag(entry)
+    last_modified = archive_last_modified(entry)
+    if not is_resource_modified(wsgi_environ(request), etag=etag, last_modified=last_modified):
+        return web.Response(status=304, headers={'ETag': f'"{etag}"'})
+    disposition = f'attachment; filename="{entry.name}.zip"'
+    map_zip = cached_archive(entry)
+    if map_zip is not None:
+        # sendfile straight from the page cache, with Range handling
+        return ArchiveFileResponse(map_zip, etag, last_modified,
+                                   headers={'Content-Type': 'application/zip', 'Content-Disposition': disposition,
+                                            'Cache-Control': 'no-cache'})
+    stream = web.StreamResponse(headers={'Content-Type': 'application/zip', 'Content-Disposition': disposition,
+                                         'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+    stream.last_modified = last_modified
+    await stream.prepare(request)
+    loop = asyncio.get_running_loop()
+    chunks = stream_archive(entry, os.path.join(amr_robot_maps, f"{entry.name}.zip"))
+    while True:
+        chunk = await loop.run_in_executor(request.app['bridge_executor'], next, chunks, None)
+        if chunk is None:
+            break
+        await stream.write(chunk)
+    await stream.write_eof()
+    return stream
+
+
+async def reboot(request: web.Request) -> web.StreamResponse:
+    denied = await authenticate(request, 'admin')
+    if denied is not None:
+        return denied
+    response = RespWrapper()
+    await asyncio.create_subprocess_exec('sudo', 'reboot', 'now')
+    response.message = 'rebooting robot'
+    return json_response(response)
+
+
+def fleet_robots(names: Optional[List[str]]) -> Tuple[list, Optional[web.Response]]:
+    try:
+        return Fleet.select(names), None
+    except KeyError as e:
+        response = RespWrapper()
+        response.error = True
+        response.message = f"robot '{e.args[0]}' isn't in the fleet"
+        response.data = {'robots': list(Fleet.robots())}
+        return [], json_response(response, 404)
+
+
+async def fleet(request: web.Request) -> web.StreamResponse:
+    denied = await authenticate(request)
+    if denied is not None:
+        return denied
+    response = RespWrapper()
+    response.data = {'robots': [robot.to_dict() for robot in Fleet.robots().values()]}
+    return json_response(response)
+
+
+async def fleet_call(request: web.Request) -> web.StreamResponse:
+    # the same request to /api/<path> of every robot (or those in ?robots=a,b), at once
+    denied = await authenticate(request, 'admin')
+    if denied is not None:
+        return denied
+    robots, unknown = fleet_robots([name for name in request.query.get('robots', '').split(',') if name])
+    if unknown is not None:
+        return unknown
+    try:
+        timeout = float(request.query['timeout']) if 'timeout' in request.query else None
+    except ValueError as e:
+        response = RespWrapper()
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': str(e)}
+        return json_response(response, 400)
+    body = await request.read() if request.can_read_body else None
+    results = await Fleet.fan_out(robots, request.method, f"/api/{request.match_info['path']}",
+                                  request.headers.get('Authorization'), timeout,
+                                  params=[(key, value) for key, value in request.query.items()
+                                          if key not in ('robots', 'timeout')],
+                                  data=body, headers={'Content-Type': request.content_type} if body else None)
+    return json_response(*aggregate(results))
+
+
+async def fleet_distribute(request: web.Request) -> web.StreamResponse:
+    denied = await authenticate(request, 'admin')
+    if denied is not None:
+        return denied
+    response = RespWrapper()
+    try:
+        content = ValidateFleetMap.parse_raw(await request.read())
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return json_response(response, 400)
+    robots, unknown = fleet_robots(content.robots)
+    if unknown is None and content.source is not None:
+        source, unknown = fleet_robots([content.source])
+    if unknown is not None:
+        return unknown
+    authorization = request.headers.get('Authorization')
+    timeout = float(config.get('fleet_transfer_timeout', 60))
+    if content.source is not None:
+        # fetched from another robot once, then sent to all of them
+        result, archive = await Fleet.download(source[0], '/api/mapping/getmap', authorization, timeout,
+                                               params={'map_name': content.map_name})
+        if archive is None:
+            response.error = True
+            response.message = f"couldn't get map '{content.map_name}' from '{content.source}'"
+            response.data = {'source': result}
+            return json_response(response, 502)
+    else:
+        entry = MapCatalog.get(content.map_name)
+        if entry is None:
+            response.error = True
+            response.message = f"map_file '{content.map_name}' doesn't exists"
+            response.data = {'existing_maps': MapCatalog.names()}
+            return json_response(response, 404)
+
+        def read_archive() -> bytes:
+            map_zip = cached_archive(entry)
+            if map_zip is None:
+                return b''.join(stream_archive(entry, os.path.join(amr_robot_maps, f"{entry.name}.zip")))
+            with open(map_zip, 'rb') as file:
+                return file.read()
+
+        archive = await asyncio.get_running_loop().run_in_executor(request.app['bridge_executor'], read_archive)
+    results = await Fleet.distribute(robots, archive, f"{content.map_name}.zip", content.overwrite,
+                                     authorization, timeout)
+    return json_response(*aggregate(results))
+
+
+@web.middleware
+async def observe_request(request: web.Request, handler) -> web.StreamResponse:
+    # bridged routes are counted by the Flask app itself; event streams never finish
+    started = time.perf_counter()
+    response = await handler(request)
+    if not request.get('bridged') and request.match_info.handler not in (events, launch_log):
+        # relayed requests under their Flask rule, as Flask's after_request counts them
+        route = request.get('route') or request.match_info.route.resource.canonical
+        Metrics.observe(REQUEST_SECONDS, time.perf_counter() - started, route=route, method=request.method,
+                        status=response.status)
+    return response
+
+
+async def on_startup(aio_app: web.Application) -> None:
+    aio_app['event_waiter'] = EventWaiter(asyncio.get_running_loop())
+    aio_app['leader_session'] = aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=Control.socket_file()),
+                                                      auto_decompress=False)
+    await Fleet.open()
+
+
+async def on_cleanup(aio_app: web.Application) -> None:
+    await Fleet.close()
+    await aio_app['leader_session'].close()
+    aio_app['bridge_executor'].shutdown(wait=False)
+    aio_app['control_executor'].shutdown(wait=False)
+
+
+def create_app() -> web.Application:
+    # status, events, log follow, map downloads and reboot are served natively on the event loop, and launch
+    # control is relayed to the leader from it; every other route runs the Flask app on a thread pool, so both
+    # servers share one implementation and envelope
+    aio_app = web.Application(middlewares=[observe_request])
+    aio_app['bridge_executor'] = ThreadPoolExecutor(max_workers=BRIDGE_THREADS, thread_name_prefix='bridge')
+    aio_app['control_executor'] = ThreadPoolExecutor(max_workers=CONTROL_THREADS, thread_name_prefix='control')
+    aio_app.on_startup.append(on_startup)
+    aio_app.on_cleanup.append(on_cleanup)
+    aio_app.router.add_get('/', home)
+    aio_app.router.add_get('/api/{stack:bringup|mapping|navigation}/state', stack_state)
+    aio_app.router.add_get('/api/events', events)
+    aio_app.router.add_get('/api/logs/{stack}/{stream:output|error}', launch_log)
+    aio_app.router.add_route('GET', '/api/mapping/getmap', getmap)
+    aio_app.router.add_route('POST', '/api/mapping/getmap', getmap)
+    aio_app.router.add_get('/api/robot/reboot', reboot)
+    if Fleet.enabled():
+        # gateway to the robots listed in appconfig 'fleet', see fleet.Fleet
+        aio_app.router.add_get('/api/fleet', fleet)
+        aio_app.router.add_post('/api/fleet/mapping/distribute', fleet_distribute)
+        aio_app.router.add_route('*', '/api/fleet/{path:.+}', fleet_call)
+    aio_app.router.add_route('*', '/{tail:.*}', dispatch)
+    return aio_app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 8000)))
@@ -1,51 +1,176 @@
 import json
 import os
 import glob
-from flask import Flask, jsonify, request, send_from_directory
+import re
+import subprocess
+import threading
+import time
+import zipfile
+from functools import wraps
+from typing import Optional, Tuple
+from flask import Flask, Response, g, jsonify, request, send_file
 from flask_cors import CORS
 from pydantic import ValidationError
-from werkzeug.utils import secure_filename
-from launcher import Launcher, LaunchState
-from validator import ValidateMapping, ValidateNavigation, ValidateUserRegister, ValidateUserDelete, RespWrapper
-from utils import check_file_ex, get_ext_maps, compress_maps, extract_map
-from utils import amr_robot_maps, slam_methods
+from werkzeug.http import is_resource_modified
+from launcher import Launcher, LaunchState, ProcessState
+from launchservice import LaunchService
+from supervisor import Supervisor
+from events import EventBus
+from watcher import Watcher
+from logtail import LOG_LEVELS, read_lines, filter_lines, follow_step
+from logarchive import LogArchive, MARK_LEVELS
+from jobs import JobQueue
+from validator import ValidateMapping, ValidateNavigation, ValidateUserRegister, ValidateUserDelete, ValidateTokenRefresh, \
+    ValidateLogTail, ValidateUploadInit, ValidateSwitchMap, ValidateVirtualWalls, RespWrapper
+from uploads import MapArchiveError, MapExistsError, UploadStore, extract_map_archive
+from utils import amr_robot_maps, config, slam_methods
+from catalog import MapCatalog
+from mapinfo import MapInfo
+from tiles import TileStore
+from resources import ResourceMonitor
+from watchdog import Watchdog
+from metrics import CONTENT_TYPE, REQUEST_SECONDS, Metrics, timed
+from profiler import SamplingProfiler, profile_file
+from mapswitch import InvalidMapError, MapSwitchError, MapSwitcher
+from archive import archive_etag, archive_last_modified, cached_archive, stream_archive
+from credcache import CredentialCache
 from models import db, User, Role
-from flask_httpauth import HTTPBasicAuth
+from sqlalchemy.orm import joinedload
+from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth, MultiAuth
+from tokens import ACCESS_TOKEN, REFRESH_TOKEN, issue_token, decode_token, revoke_user, revoked_at
+from control import Control
 
 app = Flask(__name__)
 CORS(app)
 app.config.from_object('config.DevConfig')
 db.init_app(app)
-auth = HTTPBasicAuth()
+basic_auth = HTTPBasicAuth()
+token_auth = HTTPTokenAuth(scheme='Bearer')
 
 
-@auth.get_user_roles
+class ProfiledAuth(MultiAuth):
+    # the sampling profiler of an X-Profile request starts once the caller is authenticated as an admin, so
+    # nobody else can make the robot sample its requests
+    def login_required(self, f=None, role=None, optional=None):
+        def login_required_internal(view):
+            @wraps(view)
+            def profiled(*args, **kwargs):
+                if config.get('profiling', False) and request.headers.get('X-Profile') and \
+                        'admin' in g.get('user_roles', ()):
+                    g.profiler = SamplingProfiler.current_thread()
+                return view(*args, **kwargs)
+            return MultiAuth.login_required(self, role=role, optional=optional)(profiled)
+
+        if f:
+            return login_required_internal(f)
+        return login_required_internal
+
+
+auth = ProfiledAuth(basic_auth, token_auth)
+credential_cache = CredentialCache(app.config['SECRET_KEY'], app.config['AUTH_CACHE_SIZE'],
+                                   app.config['AUTH_CACHE_TTL'].total_seconds())
+MapCatalog.refresh()
+# endpoints served by the worker that owns the launch stacks, see Control
+LEADER_ENDPOINTS = {'bringup', 'stopbringup', 'startmapping', 'stopmapping', 'savemap', 'job_status',
+                    'startnavigation', 'switch_map', 'stopnavigation', 'launcher_transition', 'launcher_service',
+                    'launcher_watchdog', 'events', 'robot_resources'}
+
+
+def start_services():
+    Watcher.start(app.config['EVENTS_POLL_INTERVAL'])
+    LogArchive.start()
+    ResourceMonitor.start()
+    Watchdog.start()
+    UploadStore.expire(app.config['UPLOAD_TTL'].total_seconds())
+    if config.get('launch_service', True):
+        # warm the launch runtime now rather than on the first start request
+        threading.Thread(target=LaunchService.start, name='launchservice', daemon=True).start()
+
+
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    if 'profiler' in g:
+        response.headers['X-Profile-Id'] = g.profiler.id
+    # the worker that forwarded a request to the leader already counts it, including the hop
+    if 'request_started' in g and not Control.forwarded(request):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        Metrics.observe(REQUEST_SECONDS, time.perf_counter() - g.request_started, route=route, method=request.method,
+                        status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def stop_profiler(error):
+    # runs even when the route raised and after_request was skipped, so no sampler is left behind
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        profiler.save()
+
+
+@app.before_request
+def forward_to_leader():
+    if request.endpoint in LEADER_ENDPOINTS:
+        return Control.forward(request)
+
+
+@basic_auth.get_user_roles
+@token_auth.get_user_roles
 def get_user_roles(username):
+    if 'user_roles' in g:
+        return g.user_roles
     user = User.query.filter_by(username=username).first()
     role = [role.name for role in user.role]
     return role
 
 
-@auth.verify_password
+@basic_auth.verify_password
+@timed('auth.basic')
 def verify_password(username, password):
-    user = User.query.filter_by(username=username).first()
-    if user is not None and user.check_password(password):
-        return user.username
+    # another worker may have deleted the user while this worker still has the password cached
+    roles = credential_cache.get(username, password, revoked_at(username))
+    if roles is None:
+        with Metrics.timer('auth.password_hash'):
+            user = User.query.options(joinedload(User.role)).filter_by(username=username).first()
+            if user is None or not user.check_password(password):
+                return None
+        roles = [role.name for role in user.role]
+        credential_cache.put(username, password, roles)
+    g.user_roles = roles
+    return username
+
+
+@token_auth.verify_token
+@timed('auth.token')
+def verify_token(token):
+    payload = decode_token(app.config['SECRET_KEY'], token, ACCESS_TOKEN)
+    if payload is not None:
+        g.user_roles = payload.get('roles', [])
+        return payload['sub']
+
+
+def token_pair(username, roles):
+    return {'access_token': issue_token(app.config['SECRET_KEY'], username, roles, ACCESS_TOKEN,
+                                        app.config['ACCESS_TOKEN_LIFETIME']),
+            'refresh_token': issue_token(app.config['SECRET_KEY'], username, roles, REFRESH_TOKEN,
+                                         app.config['PERMANENT_SESSION_LIFETIME']),
+            'token_type': 'Bearer',
+            'expires_in': int(app.config['ACCESS_TOKEN_LIFETIME'].total_seconds())}
 
 
 @app.route('/')
 @auth.login_required
 def home():
     response = RespWrapper()
-    response.data = {'launcher': Launcher.state.value}
+    response.data = {'launcher': Control.launcher()['state']}
     return jsonify(response.dict()), 200
 
 
-@app.before_request
-def before_first_request():
-    compress_maps()
-
-
 @app.route('/api/user/register', methods=['POST'])
 @auth.login_required(role='admin')
 def user_register():
@@ -64,6 +189,7 @@ def user_register():
             new_user.set_password(content.password)
             db.session.add(new_user)
             db.session.commit()
+            credential_cache.invalidate(new_user.username)
             response.message = 'new user added'
             response.data = {'username': new_user.username}
             return jsonify(response.dict()), 201
@@ -87,6 +213,8 @@ def delete_user():
             if user is not None:
                 db.session.delete(user)
                 db.session.commit()
+                credential_cache.invalidate(content.username)
+                revoke_user(content.username)
                 response.message = 'deleted user'
             else:
                 response.message = 'no such user'
@@ -103,6 +231,53 @@ def delete_user():
         return jsonify(response.dict()), 400
 
 
+@app.route('/api/auth/token', methods=['POST'])
+@basic_auth.login_required
+def auth_token():
+    response = RespWrapper()
+    response.data = token_pair(basic_auth.current_user(), g.user_roles)
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/auth/refresh', methods=['POST'])
+def auth_refresh():
+    response = RespWrapper()
+    req = request.get_json(silent=True)
+    try:
+        content = ValidateTokenRefresh.parse_raw(json.dumps(req))
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return jsonify(response.dict()), 400
+    payload = decode_token(app.config['SECRET_KEY'], content.refresh_token, REFRESH_TOKEN)
+    user = None
+    if payload is not None:
+        user = User.query.options(joinedload(User.role)).filter_by(username=payload['sub']).first()
+    if user is None:
+        response.error = True
+        response.message = 'invalid or expired refresh token'
+        return jsonify(response.dict()), 401
+    response.data = token_pair(user.username, [role.name for role in user.role])
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/user/authcache', methods=['GET'])
+@auth.login_required(role='admin')
+def auth_cache_stats():
+    response = RespWrapper()
+    response.data = credential_cache.stats()
+    return jsonify(response.dict()), 200
+
+
+def launcher_changed(response: RespWrapper):
+    # the launcher left the state the request was checked against before its stack could be started
+    response.error = True
+    response.message = f"launcher changed to {Launcher.state.value} meanwhile, check its state and retry"
+    response.data = {'launcher': Launcher.state.value}
+    return jsonify(response.dict()), 409
+
+
 @app.route('/api/bringup/start', methods=['POST'])
 @auth.login_required
 def bringup():
@@ -110,7 +285,16 @@ def bringup():
     response.data = {'launcher': Launcher.state.value}
     # response.headers.add('Access-Control-Allow-Origin', '*')
     if Launcher.state == LaunchState.OFF:
-        Launcher.start_bringup()
+        stopping = Launcher.stopping('bringup')
+        if stopping is not None:
+            response.error = True
+            response.message = f"bringup is still stopping, poll '/api/launcher/transition/{stopping.id}'"
+            response.data = {'launcher': Launcher.state.value, 'transition': stopping.to_dict()}
+            return jsonify(response.dict()), 409
+        if not Launcher.try_start_bringup():
+            # another request started (or stopped) bringup in the meantime
+            response.data = {'launcher': Launcher.state.value}
+            return jsonify(response.dict()), 200
         response.data = {'launcher': Launcher.state.value,
                          'pid': Launcher.bringup_pid(),
                          'state': Launcher.bringup_state().value}
@@ -121,18 +305,21 @@ def bringup():
 @app.route('/api/bringup/stop', methods=['POST'])
 @auth.login_required
 def stopbringup():
+    # stacks are torn down in parallel by the supervisor; poll the returned transitions for completion
+    transitions = []
     if Launcher.state == LaunchState.MAPPING:
-        Launcher.stop_mapping()
-        Launcher.stop_bringup()
+        transitions.append(Launcher.stop_mapping())
+        transitions.append(Launcher.stop_bringup())
 
     elif Launcher.state == LaunchState.NAVIGATION:
-        Launcher.stop_navigation()
-        Launcher.stop_bringup()
+        transitions.append(Launcher.stop_navigation())
+        transitions.append(Launcher.stop_bringup())
 
     elif Launcher.state == LaunchState.BRINGUP:
-        Launcher.stop_bringup()
+        transitions.append(Launcher.stop_bringup())
     response = RespWrapper()
-    response.data = {'launcher': Launcher.state.value}
+    response.data = {'launcher': Launcher.state.value,
+                     'transitions': [transition.to_dict() for transition in transitions if transition is not None]}
     # response.headers.add('Access-Control-Allow-Origin', '*')
     return jsonify(response.dict()), 200
 
@@ -159,14 +346,22 @@ def startmapping():
         response.message = "mapping is running you should stop current mapping on '/api/mapping/stop'"
         response.data = {'launcher': Launcher.state.value}
         return jsonify(response.dict()), 400
+
+    stopping = Launcher.stopping('mapping')
+    if stopping is not None:
+        response.error = True
+        response.message = f"mapping is still stopping, poll '/api/launcher/transition/{stopping.id}'"
+        response.data = {'launcher': Launcher.state.value, 'transition': stopping.to_dict()}
+        return jsonify(response.dict()), 409
     try:
         content = ValidateMapping.parse_raw(json.dumps(req))
-        if content.slam_method in slam_methods:
-            Launcher.start_mapping(content.slam_method)
+        if content.slam_method in slam_methods():
+            if not Launcher.try_start_mapping(content.slam_method):
+                return launcher_changed(response)
         else:
             response.error = True
             response.message = "wrong slam method"
-            response.data = {'slam_methods': slam_methods, 'launcher': Launcher.state.value}
+            response.data = {'slam_methods': slam_methods(), 'launcher': Launcher.state.value}
             return jsonify(response.dict()), 400
     except ValidationError as e:
         response.error = True
@@ -183,9 +378,62 @@ def startmapping():
 @auth.login_required(role='admin')
 def stopmapping():
     response = RespWrapper()
+    transitions = []
     if Launcher.state == LaunchState.MAPPING:
-        Launcher.stop_mapping()
-    response.data = {'launcher': Launcher.state.value}
+        transitions.append(Launcher.stop_mapping())
+    response.data = {'launcher': Launcher.state.value,
+                     'transitions': [transition.to_dict() for transition in transitions if transition is not None]}
+    return jsonify(response.dict()), 200
+
+
+def savemap_stages(map_name):
+    map_path = amr_robot_maps + map_name
+
+    @timed('subprocess.map_saver')
+    def map_saver():
+        return subprocess.run(["ros2", "run", "nav2_map_server", "map_saver_cli", "-f", map_path],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              timeout=app.config['SAVEMAP_TIMEOUT']).returncode
+
+    def convert():
+        if not os.path.isfile(map_path + ".pgm"):
+            raise FileNotFoundError(f"map_saver_cli did not write {map_path}.pgm")
+        from mapimage import pgm_to_png
+        pgm_to_png(map_path + ".pgm", map_path + ".png")
+
+    def compact():
+        # instead of convert: crop the unknown margin and keep only the png, see compact_map
+        from mapimage import compact_map
+        compact_map(map_path + ".yaml", int(config.get('map_crop_margin', 5)))
+
+    def register():
+        MapCatalog.invalidate(map_name)
+        if not MapCatalog.exists(map_name):
+            raise FileNotFoundError(f"{map_path}.yaml is not a valid map")
+        # the pyramid is built alongside the job and not waited for: a failed one is logged by TileStore and
+        # only leaves the tile routes answering with its error
+        TileStore.schedule(MapCatalog.get(map_name))
+
+    def compress():
+        # build the download archive now so the first getmap is served from disk with Range support
+        for _ in stream_archive(MapCatalog.get(map_name), map_path + ".zip"):
+            pass
+        MapCatalog.invalidate(map_name)
+
+    image = ('compact', compact) if config.get('savemap_compact', False) else ('convert', convert)
+    return [('map_saver', map_saver), image, ('catalog', register), ('archive', compress)]
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@auth.login_required
+def job_status(job_id):
+    response = RespWrapper()
+    job = JobQueue.get(job_id)
+    if job is None:
+        response.error = True
+        response.message = f"job '{job_id}' doesn't exists"
+        return jsonify(response.dict()), 404
+    response.data = {'job': job.to_dict()}
     return jsonify(response.dict()), 200
 
 
@@ -197,25 +445,25 @@ def savemap():
     if Launcher.state == LaunchState.MAPPING:
         try:
             content = ValidateNavigation.parse_raw(json.dumps(req))
-            existing_maps = [ext_map[0] for ext_map in get_ext_maps()]
-            if content.map_name in existing_maps:
+            job = JobQueue.active('savemap', content.map_name)
+            if job is not None:
+                response.message = f"map {content.map_name} is already being saved, poll '/api/jobs/{job.id}'"
+                response.data = {'launcher': Launcher.state.value, 'job': job.to_dict()}
+                return jsonify(response.dict()), 202
+            if MapCatalog.exists(content.map_name):
                 response.error = True
                 response.message = f"map with name {content.map_name} already exists"
                 return jsonify(response.dict()), 400
-            os.system("ros2 run nav2_map_server map_saver_cli -f" + " " + amr_robot_maps + content.map_name)
-            os.system(
-                "convert" + " " + amr_robot_maps + content.map_name + ".pgm" + " " + amr_robot_maps
-                + content.map_name + ".png")
-            compress_maps()
+            job, _ = JobQueue.submit('savemap', content.map_name, savemap_stages(content.map_name))
 
         except ValidationError as e:
             response.error = True
             response.message = 'wrong request'
             response.data = {'validation error': e.json()}
             return jsonify(response.dict()), 400
-        response.message = f"map saved in {amr_robot_maps + content.map_name}"
-        response.data = {'launcher': Launcher.state.value}
-        return jsonify(response.dict()), 200
+        response.message = f"saving map in {amr_robot_maps + content.map_name}, poll '/api/jobs/{job.id}'"
+        response.data = {'launcher': Launcher.state.value, 'job': job.to_dict()}
+        return jsonify(response.dict()), 202
 
     else:
         response.error = True
@@ -224,20 +472,38 @@ def savemap():
         return jsonify(response.dict()), 400
 
 
-@app.route('/api/mapping/getmap', methods=['POST'])
+@app.route('/api/mapping/getmap', methods=['GET', 'POST'])
 @auth.login_required(role='admin')
 def upload_map():
     response = RespWrapper()
-    req = request.get_json(silent=True)
+    req = request.get_json(silent=True) if request.method == 'POST' else request.args.to_dict()
     try:
         content = ValidateNavigation.parse_raw(json.dumps(req))
-        existing_maps = [ext_map[0] for ext_map in get_ext_maps()]
-        if check_file_ex(content.map_name, 'zip', amr_robot_maps) and content.map_name in existing_maps:
-            return send_from_directory(amr_robot_maps, f"{content.map_name}.zip")
+        entry = MapCatalog.get(content.map_name)
+        if entry is not None:
+            etag = archive_etag(entry)
+            last_modified = archive_last_modified(entry)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                not_modified = Response(status=304)
+                not_modified.set_etag(etag)
+                return not_modified
+            map_zip = cached_archive(entry)
+            if map_zip is not None:
+                # conditional=True also answers Range requests on GET so interrupted downloads can resume
+                return send_file(map_zip, mimetype='application/zip', as_attachment=True,
+                                 download_name=f"{entry.name}.zip", etag=etag, last_modified=last_modified,
+                                 conditional=True)
+            stream = Response(stream_archive(entry, os.path.join(amr_robot_maps, f"{entry.name}.zip")),
+                              mimetype='application/zip')
+            stream.set_etag(etag)
+            stream.last_modified = last_modified
+            stream.headers['Content-Disposition'] = f'attachment; filename="{entry.name}.zip"'
+            stream.headers['Cache-Control'] = 'no-cache'
+            return stream
         else:
             response.error = True
             response.message = f"map_file '{content.map_name}' doesn't exists"
-            response.data = {'existing_maps': existing_maps}
+            response.data = {'existing_maps': MapCatalog.names()}
             return jsonify(response.dict())
 
     except ValidationError as e:
@@ -247,6 +513,132 @@ def upload_map():
         return jsonify(response.dict()), 400
 
 
+@app.route('/api/mapping/info', methods=['GET', 'POST'])
+@auth.login_required(role='admin')
+def map_info():
+    response = RespWrapper()
+    req = request.get_json(silent=True) if request.method == 'POST' else request.args.to_dict()
+    try:
+        content = ValidateNavigation.parse_raw(json.dumps(req))
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return jsonify(response.dict()), 400
+
+    entry = MapCatalog.get(content.map_name)
+    if entry is None:
+        response.error = True
+        response.message = f"map_file '{content.map_name}' doesn't exists"
+        response.data = {'existing_maps': MapCatalog.names()}
+        return jsonify(response.dict()), 404
+    try:
+        response.data = MapInfo.get(entry)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        response.error = True
+        response.message = f"map_file '{content.map_name}' can't be analysed: {e}"
+        return jsonify(response.dict()), 400
+    return jsonify(response.dict()), 200
+
+
+def schedule_tiles(map_names):
+    for map_name in map_names:
+        entry = MapCatalog.get(map_name)
+        if entry is not None:
+            TileStore.schedule(entry)
+
+
+def map_pyramid(map_name):
+    # the current tile pyramid of a map, or the response to send while there is none
+    response = RespWrapper()
+    entry = MapCatalog.get(map_name)
+    if entry is None:
+        response.error = True
+        response.message = f"map_file '{map_name}' doesn't exists"
+        response.data = {'existing_maps': MapCatalog.names()}
+        return None, (jsonify(response.dict()), 404)
+    pyramid = TileStore.pyramid(entry)
+    if pyramid is not None:
+        return pyramid, None
+    error = TileStore.error(entry)
+    if error is not None:
+        response.error = True
+        response.message = f"tiles of '{map_name}' can't be generated: {error}"
+        return None, (jsonify(response.dict()), 400)
+    TileStore.schedule(entry)
+    response.message = f"tiles of '{map_name}' are being generated, retry shortly"
+    return None, (jsonify(response.dict()), 202, {'Retry-After': '2'})
+
+
+@app.route('/api/mapping/tiles/<map_name>', methods=['GET'])
+@auth.login_required(role='admin')
+def map_tiles(map_name):
+    pyramid, pending = map_pyramid(map_name)
+    if pending is not None:
+        return pending
+    response = RespWrapper()
+    response.data = {'map': map_name, **{key: pyramid[key] for key in ('width', 'height', 'tile_size', 'max_zoom')}}
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/mapping/tiles/<map_name>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+@auth.login_required(role='admin')
+def map_tile(map_name, z, x, y):
+    pyramid, pending = map_pyramid(map_name)
+    if pending is not None:
+        return pending
+    tile = os.path.join(TileStore.tiles_dir(map_name), str(z), str(x), f"{y}.png")
+    if not os.path.isfile(tile):
+        response = RespWrapper(error=True, message=f"tile {z}/{x}/{y} is outside of map '{map_name}'")
+        response.data = {'max_zoom': pyramid['max_zoom']}
+        return jsonify(response.dict()), 404
+    return send_file(tile, mimetype='image/png', max_age=int(app.config['TILE_MAX_AGE'].total_seconds()),
+                     conditional=True)
+
+
+@app.route('/api/mapping/thumbnail/<map_name>', methods=['GET'])
+@auth.login_required(role='admin')
+def map_thumbnail(map_name):
+    pyramid, pending = map_pyramid(map_name)
+    if pending is not None:
+        return pending
+    return send_file(os.path.join(TileStore.tiles_dir(map_name), 'thumbnail.png'), mimetype='image/png',
+                     max_age=int(app.config['TILE_MAX_AGE'].total_seconds()), conditional=True)
+
+
+@app.route('/api/mapping/virtual_walls/<map_name>', methods=['GET', 'POST'])
+@auth.login_required(role='admin')
+def virtual_walls(map_name):
+    # numpy is only imported once walls are drawn, not at startup
+    from walls import VirtualWalls, virtual_name
+    response = RespWrapper()
+    entry = MapCatalog.get(map_name)
+    if entry is None or map_name.endswith('_virtual'):
+        response.error = True
+        response.message = f"map_file '{map_name}' doesn't exists"
+        response.data = {'existing_maps': MapCatalog.names()}
+        return jsonify(response.dict()), 404
+    if request.method == 'GET':
+        response.data = {'map': virtual_name(map_name), 'walls': VirtualWalls.get(map_name)}
+        return jsonify(response.dict()), 200
+
+    try:
+        content = ValidateVirtualWalls.parse_raw(json.dumps(request.get_json(silent=True)))
+        result = VirtualWalls.apply(entry, [wall.dict() for wall in content.add], content.remove, content.replace)
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return jsonify(response.dict()), 400
+    except (ValueError, OSError) as e:
+        response.error = True
+        response.message = str(e)
+        return jsonify(response.dict()), 400
+    MapCatalog.invalidate(result['map'])
+    response.data = result
+    return jsonify(response.dict()), 200
+
+
 @app.route('/api/mapping/loadmap', methods=['POST'])
 @auth.login_required(role='admin')
 def downloadmap():
@@ -259,11 +651,24 @@ def downloadmap():
     if map_file:
         if map_file.content_type in ('application/zip', 'application/zip-compressed',
                                      'application/x-zip-compressed', 'application/x-zip'):
-            map_path = os.path.join(os.path.join(amr_robot_maps, secure_filename(map_file.filename)))
-            # TODO check duplicates
-            map_file.save(map_path)
-            extract_map(map_path)
-            response.message = f'map files saved in {map_path}'
+            overwrite = request.form.get('overwrite', 'false').lower() in ('1', 'true', 'yes')
+            try:
+                # extracted straight from the spooled upload, no intermediate copy in the maps directory
+                map_names = extract_map_archive(map_file.stream, MapCatalog.names(), overwrite,
+                                                app.config['UPLOAD_MAX_MEMBER_SIZE'], app.config['UPLOAD_MAX_RATIO'])
+            except MapExistsError as e:
+                response.error = True
+                response.message = f"{e}, send 'overwrite=true' to replace them"
+                response.data = {'existing_maps': MapCatalog.names()}
+                return jsonify(response.dict()), 409
+            except (MapArchiveError, zipfile.BadZipFile) as e:
+                response.error = True
+                response.message = str(e)
+                return jsonify(response.dict()), 400
+            MapCatalog.invalidate()
+            schedule_tiles(map_names)
+            response.message = f"maps {', '.join(map_names)} saved in {amr_robot_maps}"
+            response.data = {'maps': map_names}
             return jsonify(response.dict())
         else:
             response.error = True
@@ -275,6 +680,87 @@ def downloadmap():
         return jsonify(response.dict()), 400
 
 
+@app.route('/api/mapping/upload', methods=['POST'])
+@auth.login_required(role='admin')
+def upload_init():
+    req = request.get_json(silent=True)
+    response = RespWrapper()
+    try:
+        content = ValidateUploadInit.parse_raw(json.dumps(req))
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return jsonify(response.dict()), 400
+    if not 0 < content.size <= app.config['UPLOAD_MAX_SIZE']:
+        response.error = True
+        response.message = f"size must be between 1 and {app.config['UPLOAD_MAX_SIZE']} bytes"
+        return jsonify(response.dict()), 413
+    # stale uploads are cleared whenever a new one begins, not only at start-up
+    UploadStore.expire(app.config['UPLOAD_TTL'].total_seconds())
+    upload = UploadStore.create(content.filename, content.size, content.sha256, content.overwrite)
+    response.message = f"upload chunks with PUT '/api/mapping/upload/{upload.id}?offset=<n>'"
+    response.data = {'upload': upload.to_dict()}
+    return jsonify(response.dict()), 201
+
+
+@app.route('/api/mapping/upload/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@auth.login_required(role='admin')
+def upload_chunk(upload_id):
+    response = RespWrapper()
+    upload = UploadStore.get(upload_id)
+    if upload is None:
+        response.error = True
+        response.message = f"upload '{upload_id}' doesn't exists"
+        return jsonify(response.dict()), 404
+    if request.method == 'DELETE':
+        UploadStore.abort(upload)
+        response.message = f"upload '{upload_id}' aborted"
+        return jsonify(response.dict()), 200
+    if request.method == 'PUT':
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            response.error = True
+            response.message = "query parameter 'offset' is required"
+            return jsonify(response.dict()), 400
+        try:
+            # the body is copied to the staging file as it arrives; nothing is buffered whole
+            upload = UploadStore.write_chunk(upload, offset, request.stream, request.content_length,
+                                             request.headers.get('X-Chunk-SHA256'))
+        except MapArchiveError as e:
+            current = UploadStore.get(upload_id)
+            response.error = True
+            response.message = str(e)
+            response.data = {'upload': current.to_dict() if current is not None else None}
+            return jsonify(response.dict()), 409
+    response.data = {'upload': upload.to_dict()}
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/mapping/upload/<upload_id>/commit', methods=['POST'])
+@auth.login_required(role='admin')
+def upload_commit(upload_id):
+    response = RespWrapper()
+    upload = UploadStore.get(upload_id)
+    if upload is None:
+        response.error = True
+        response.message = f"upload '{upload_id}' doesn't exists"
+        return jsonify(response.dict()), 404
+    try:
+        map_names = UploadStore.commit(upload, MapCatalog.names(), app.config['UPLOAD_MAX_MEMBER_SIZE'],
+                                       app.config['UPLOAD_MAX_RATIO'])
+    except MapArchiveError as e:
+        response.error = True
+        response.message = str(e)
+        response.data = {'upload': upload.to_dict(), 'existing_maps': MapCatalog.names()}
+        return jsonify(response.dict()), 409
+    MapCatalog.invalidate()
+    schedule_tiles(map_names)
+    response.message = f"maps {', '.join(map_names)} saved in {amr_robot_maps}"
+    response.data = {'maps': map_names}
+    return jsonify(response.dict()), 200
+
+
 @app.route('/api/mapping/delete', methods=['DELETE'])
 @auth.login_required(role='admin')
 def delete_map():
@@ -282,17 +768,18 @@ def delete_map():
     req = request.get_json(silent=True)
     try:
         content = ValidateNavigation.parse_raw(json.dumps(req))
-        existing_maps = [ext_map[0] for ext_map in get_ext_maps()]
-        if content.map_name in existing_maps:
+        if MapCatalog.exists(content.map_name):
             files = glob.glob(amr_robot_maps + f"{content.map_name}.*")
             for file in files:
                 os.remove(file)
+            TileStore.remove(content.map_name)
+            MapCatalog.invalidate(content.map_name)
             response.message = f"map {content.map_name} deleted"
             return jsonify(response.dict()), 200
         else:
             response.error = True
             response.message = f"map_file '{content.map_name}' doesn't exists"
-            response.data = {'existing_maps': existing_maps}
+            response.data = {'existing_maps': MapCatalog.names()}
             return jsonify(response.dict())
 
     except ValidationError as e:
@@ -325,22 +812,34 @@ def startnavigation():
         response.data = {'launcher': Launcher.state.value}
         return jsonify(response.dict()), 400
 
+    stopping = Launcher.stopping('navigation')
+    if stopping is not None:
+        response.error = True
+        response.message = f"navigation is still stopping, poll '/api/launcher/transition/{stopping.id}'"
+        response.data = {'launcher': Launcher.state.value, 'transition': stopping.to_dict()}
+        return jsonify(response.dict()), 409
+
     try:
         content = ValidateNavigation.parse_raw(json.dumps(req))
-        existing_maps = [ext_map[0] for ext_map in get_ext_maps()]
-        if content.map_name in existing_maps:
+        if MapCatalog.exists(content.map_name):
             if content.with_virtual_walls:
-                if f"{content.map_name}_virtual" in existing_maps:
-                    Launcher.start_navigation(content.map_name, content.local_planner_type, content.with_virtual_walls)
+                if MapCatalog.exists(f"{content.map_name}_virtual"):
+                    if not Launcher.try_start_navigation(content.map_name, content.local_planner_type,
+                                                         content.with_virtual_walls):
+                        return launcher_changed(response)
                 else:
-                    Launcher.start_navigation(content.map_name, content.local_planner_type)
+                    if not Launcher.try_start_navigation(content.map_name, content.local_planner_type):
+                        return launcher_changed(response)
                     response.message = f"virtual_map '{content.map_name}_virtual' doesn't exists"
+                MapSwitcher.remember(content.map_name)
                 response.data = {'launcher': Launcher.state.value,
                                  'pid': Launcher.navigation_pid(),
                                  'state': Launcher.navigation_state().value}
                 return jsonify(response.dict()), 200
             else:
-                Launcher.start_navigation(content.map_name, content.local_planner_type)
+                if not Launcher.try_start_navigation(content.map_name, content.local_planner_type):
+                    return launcher_changed(response)
+                MapSwitcher.remember(content.map_name)
                 response.data = {'launcher': Launcher.state.value,
                                  'pid': Launcher.navigation_pid(),
                                  'state': Launcher.navigation_state().value}
@@ -349,7 +848,7 @@ def startnavigation():
         else:
             response.error = True
             response.message = f"map_file '{content.map_name}' doesn't exists"
-            response.data = {'existing_maps': existing_maps}
+            response.data = {'existing_maps': MapCatalog.names()}
             return jsonify(response.dict())
 
     except ValidationError as e:
@@ -359,24 +858,228 @@ def startnavigation():
         return jsonify(response.dict()), 400
 
 
+@app.route('/api/navigation/switch_map', methods=['POST'])
+@auth.login_required
+def switch_map():
+    response = RespWrapper()
+    req = request.get_json(silent=True)
+    if Launcher.state != LaunchState.NAVIGATION or Launcher.navigation_state() != ProcessState.RUNNING:
+        response.error = True
+        response.message = "first launch navigation on '/api/navigation/start'"
+        response.data = {'launcher': Launcher.state.value}
+        return jsonify(response.dict()), 400
+
+    try:
+        content = ValidateSwitchMap.parse_raw(json.dumps(req))
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return jsonify(response.dict()), 400
+
+    entry = MapCatalog.get(content.map_name)
+    if entry is None:
+        response.error = True
+        response.message = f"map_file '{content.map_name}' doesn't exists"
+        response.data = {'existing_maps': MapCatalog.names()}
+        return jsonify(response.dict()), 404
+
+    previous = Launcher.navigation_map
+    try:
+        switch = MapSwitcher.switch(entry)
+    except MapSwitchError as e:
+        response.error = True
+        response.message = str(e)
+        response.data = {'launcher': Launcher.state.value, 'map': previous}
+        return jsonify(response.dict()), 400 if isinstance(e, InvalidMapError) else 502
+    Launcher.switched_map(entry.name)
+    response.data = {'launcher': Launcher.state.value,
+                     'pid': Launcher.navigation_pid(),
+                     'previous': previous,
+                     **switch}
+    return jsonify(response.dict()), 200
+
+
 @app.route('/api/navigation/stop', methods=['POST'])
 @auth.login_required
 def stopnavigation():
     response = RespWrapper()
+    transitions = []
     if Launcher.state == LaunchState.NAVIGATION:
-        Launcher.stop_navigation()
-    response.data = {'launcher': Launcher.state.value}
+        transitions.append(Launcher.stop_navigation())
+    response.data = {'launcher': Launcher.state.value,
+                     'transitions': [transition.to_dict() for transition in transitions if transition is not None]}
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/launcher/transition/<transition_id>', methods=['GET'])
+@auth.login_required
+def launcher_transition(transition_id):
+    response = RespWrapper()
+    transition = Supervisor.transition(transition_id)
+    if transition is None:
+        response.error = True
+        response.message = f"transition '{transition_id}' doesn't exists"
+        return jsonify(response.dict()), 404
+    response.data = {'launcher': Launcher.state.value, 'transition': transition.to_dict()}
     return jsonify(response.dict()), 200
 
 
+@app.route('/api/launcher/service', methods=['GET'])
+@auth.login_required
+def launcher_service():
+    response = RespWrapper()
+    response.data = LaunchService.info()
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/launcher/watchdog', methods=['GET'])
+@auth.login_required
+def launcher_watchdog():
+    response = RespWrapper()
+    response.data = Watchdog.report()
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/events', methods=['GET'])
+@auth.login_required
+def events():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+
+    def stream(last_id):
+        pending = EventBus.since(last_id) if last_id is not None else None
+        if pending is None:
+            # new subscriber, or one that fell behind the history: start from the current state
+            last_id = EventBus.last_id()
+            pending = []
+            yield f"event: snapshot\ndata: {json.dumps(Watcher.snapshot())}\n\n"
+        while True:
+            for event in pending:
+                last_id = event.id
+                yield event.to_sse()
+            pending = EventBus.wait(last_id, heartbeat)
+            if pending is None:
+                last_id = EventBus.last_id()
+                pending = []
+                yield f"event: snapshot\ndata: {json.dumps(Watcher.snapshot())}\n\n"
+            elif not pending:
+                yield ": heartbeat\n\n"
+
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        last_event_id = None
+    return Response(stream(last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/logs/<stack>/runs', methods=['GET'])
+@auth.login_required(role='admin')
+def launch_log_runs(stack):
+    response = RespWrapper()
+    if stack not in ('bringup', 'mapping', 'navigation'):
+        response.error = True
+        response.message = "log must be '/api/logs/<bringup|mapping|navigation>/runs'"
+        return jsonify(response.dict()), 404
+    limit = request.args.get('limit', 20, type=int)
+    level = request.args.get('level', 'ERROR').upper()
+    if level not in MARK_LEVELS:
+        response.error = True
+        response.message = f"level must be one of {list(MARK_LEVELS)}"
+        return jsonify(response.dict()), 400
+    min_level = MARK_LEVELS.index(level)
+    runs = LogArchive.runs(stack, max(1, min(limit, 200)))
+    for run in runs:
+        run['marks'] = [mark for mark in run['marks'] if MARK_LEVELS.index(mark['level']) >= min_level]
+    response.data = {'runs': runs}
+    return jsonify(response.dict()), 200
+
+
+def log_tail_request(stack: str, stream: str, args: dict, last_event_id: Optional[str]) -> \
+        Tuple[Optional[dict], Optional[Tuple[RespWrapper, int]]]:
+    # the checked arguments of a log request, or the error response; shared with the asyncio server's log follow
+    response = RespWrapper()
+    if stack not in ('bringup', 'mapping', 'navigation') or stream not in ('output', 'error'):
+        response.error = True
+        response.message = "log must be '/api/logs/<bringup|mapping|navigation>/<output|error>'"
+        return None, (response, 404)
+    try:
+        content = ValidateLogTail.parse_raw(json.dumps(args))
+        level = content.level.upper() if content.level else None
+        if level == 'WARNING':
+            level = 'WARN'
+        if level is not None and level not in LOG_LEVELS:
+            response.error = True
+            response.message = f"level must be one of {list(LOG_LEVELS)}"
+            return None, (response, 400)
+        pattern = re.compile(content.regex) if content.regex else None
+    except ValidationError as e:
+        response.error = True
+        response.message = 'wrong request'
+        response.data = {'validation error': e.json()}
+        return None, (response, 400)
+    except re.error as e:
+        response.error = True
+        response.message = f"wrong regex: {e}"
+        return None, (response, 400)
+
+    log_file = Launcher.log_file(stack, stream)
+    if not os.path.isfile(log_file):
+        response.error = True
+        response.message = f"log '{stack}_{stream}' doesn't exists"
+        return None, (response, 404)
+    max_bytes = min(content.max_bytes or app.config['LOG_TAIL_DEFAULT_BYTES'], app.config['LOG_TAIL_MAX_BYTES'])
+    offset = content.offset if content.offset is not None else -max_bytes
+    if content.follow and last_event_id is not None and last_event_id.isdigit():
+        offset = int(last_event_id)
+    return {'filename': log_file, 'offset': offset, 'max_bytes': max_bytes, 'level': level, 'pattern': pattern,
+            'since': content.since, 'follow': content.follow}, None
+
+
+@app.route('/api/logs/<stack>/<stream>', methods=['GET'])
+@auth.login_required(role='admin')
+def launch_log(stack, stream):
+    tail, error = log_tail_request(stack, stream, request.args.to_dict(), request.headers.get('Last-Event-ID'))
+    if error is not None:
+        return jsonify(error[0].dict()), error[1]
+    response = RespWrapper()
+    follow, offset = tail.pop('follow'), tail.pop('offset')
+    if not follow:
+        chunk = read_lines(tail['filename'], offset, tail['max_bytes'])
+        chunk['lines'] = filter_lines(chunk['lines'], tail['level'], tail['pattern'], tail['since'])
+        response.data = chunk
+        return jsonify(response.dict()), 200
+
+    poll_interval = app.config['LOG_TAIL_POLL_INTERVAL']
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+
+    def stream_log(offset):
+        idle = 0.0
+        while True:
+            event, offset, caught_up = follow_step(offset=offset, **tail)
+            if event is not None:
+                idle = 0.0
+                yield event
+            if caught_up:
+                time.sleep(poll_interval)
+                idle += poll_interval
+                if idle >= heartbeat:
+                    idle = 0.0
+                    yield ": heartbeat\n\n"
+
+    return Response(stream_log(offset), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/api/bringup/state', methods=['GET'])
 @auth.login_required
 def bringup_state():
     response = RespWrapper()
-    state = Launcher.bringup_state().value
-    response.data = {'launcher': Launcher.state.value,
-                     'pid': Launcher.bringup_pid(),
-                     'state': state}
+    launcher = Control.launcher()
+    response.data = {'launcher': launcher['state'],
+                     'pid': launcher['stacks']['bringup']['pid'],
+                     'state': launcher['stacks']['bringup']['state']}
     return jsonify(response.dict()), 200
 
 
@@ -384,10 +1087,11 @@ def bringup_state():
 @auth.login_required
 def navigation_state():
     response = RespWrapper()
-    state = Launcher.navigation_state().value
-    response.data = {'launcher': Launcher.state.value,
-                     'pid': Launcher.navigation_pid(),
-                     'state': state}
+    launcher = Control.launcher()
+    response.data = {'launcher': launcher['state'],
+                     'pid': launcher['stacks']['navigation']['pid'],
+                     'state': launcher['stacks']['navigation']['state'],
+                     'map': launcher.get('map')}
     return jsonify(response.dict()), 200
 
 
@@ -395,13 +1099,43 @@ def navigation_state():
 @auth.login_required
 def mapping_state():
     response = RespWrapper()
-    state = Launcher.mapping_state().value
-    response.data = {'launcher': Launcher.state.value,
-                     'pid': Launcher.mapping_pid(),
-                     'state': state}
+    launcher = Control.launcher()
+    response.data = {'launcher': launcher['state'],
+                     'pid': launcher['stacks']['mapping']['pid'],
+                     'state': launcher['stacks']['mapping']['state']}
+    return jsonify(response.dict()), 200
+
+
+@app.route('/api/robot/resources', methods=['GET'])
+@auth.login_required
+def robot_resources():
+    response = RespWrapper()
+    stack = request.args.get('stack')
+    if stack not in (None, 'bringup', 'mapping', 'navigation'):
+        response.error = True
+        response.message = f"unknown stack '{stack}'"
+        return jsonify(response.dict()), 400
+    history = request.args.get('history', 'false').lower() in ('1', 'true', 'yes')
+    response.data = ResourceMonitor.report(stack, history)
     return jsonify(response.dict()), 200
 
 
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def prometheus_metrics():
+    return Response(Metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+@auth.login_required(role='admin')
+def request_profile(profile_id):
+    file = profile_file(profile_id)
+    if file is None or not os.path.isfile(file):
+        response = RespWrapper(error=True, message=f"profile '{profile_id}' doesn't exist")
+        return jsonify(response.dict()), 404
+    return send_file(file, mimetype='text/plain')
+
+
 @app.route('/api/robot/reboot', methods=['GET'])
 @auth.login_required(role='admin')
 def reboot():
@@ -411,5 +1145,8 @@ def reboot():
     return jsonify(response.dict()), 200
 
 
+Metrics.start()
+Control.start(app, start_services)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000)
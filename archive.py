@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+import zipfile
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+from catalog import MapEntry
+
+CHUNK_SIZE = 64 * 1024
+COMPRESS_LEVEL = 6
+
+
+class _StreamBuffer:
+    # write-only file object that zipfile can target; written bytes are drained by the generator
+    def __init__(self, tee):
+        self.chunks: List[bytes] = []
+        self.tee = tee
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.tee.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def archive_members(entry: MapEntry) -> List[str]:
+    # a compact map's image is its png, listed once
+    return [file for file in dict.fromkeys((entry.yaml, entry.pgm, entry.png))
+            if file is not None and os.path.isfile(file)]
+
+
+def archive_last_modified(entry: MapEntry) -> datetime:
+    return datetime.fromtimestamp(max(entry.mtimes.get(kind, 0.0) for kind in ('yaml', 'pgm', 'png')), tz=timezone.utc)
+
+
+def archive_etag(entry: MapEntry) -> str:
+    digest = hashlib.sha1(entry.name.encode())
+    for kind in ('yaml', 'pgm', 'png'):
+        digest.update(f"{kind}:{entry.sizes.get(kind)}:{entry.mtimes.get(kind)};".encode())
+    return digest.hexdigest()
+
+
+def cached_archive(entry: MapEntry) -> Optional[str]:
+    if entry.zip is not None and entry.mtimes['zip'] >= max(entry.mtimes.get(kind, 0.0) for kind in ('yaml', 'pgm', 'png')):
+        return entry.zip
+    return None
+
+
+def _mtime_ns(file: str) -> Optional[int]:
+    try:
+        return os.stat(file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def stream_archive(entry: MapEntry, map_zip: str) -> Iterator[bytes]:
+    # deflate the bundle chunk by chunk, sending it while a copy is written to map_zip for later (range) requests
+    tmp_zip = os.path.join(os.path.dirname(map_zip),
+                           f'.{os.path.basename(map_zip)}.{os.getpid()}.{threading.get_ident()}.tmp')
+    completed = False
+    try:
+        with open(tmp_zip, 'wb') as tee:
+            buffer = _StreamBuffer(tee)
+            with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=COMPRESS_LEVEL) as archive:
+                stamps = []
+                for member in archive_members(entry):
+                    info = zipfile.ZipInfo.from_file(member, arcname=os.path.basename(member))
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with open(member, 'rb') as src, archive.open(info, mode='w') as dst:
+                        stamps.append((member, os.fstat(src.fileno()).st_mtime_ns))
+                        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                            dst.write(chunk)
+                            if buffer.chunks:
+                                yield buffer.drain()
+            yield buffer.drain()
+        # a member patched while it was read (virtual walls are drawn in place) leaves a mixed archive: it is
+        # sent, but not kept as the cached one
+        completed = all(_mtime_ns(member) == mtime for member, mtime in stamps)
+        if completed:
+            os.replace(tmp_zip, map_zip)
+    finally:
+        if not completed and os.path.exists(tmp_zip):
+            os.remove(tmp_zip)
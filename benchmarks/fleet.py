@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load import (PASSWORD, USER, Client, Recorder, basic, free_port, prepare, print_report, start_server,  # noqa: E402
+                  stop_server)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="time the fleet gateway against local stand-in robots")
+    parser.add_argument('--robots', type=int, default=4, help="stand-in robot APIs")
+    parser.add_argument('--server', choices=('werkzeug', 'aiohttp'), default='werkzeug',
+                        help="server of the stand-in robots; the gateway always runs on aiohttp")
+    parser.add_argument('--maps', type=int, default=2, help="synthetic maps of the gateway")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=50, help="fanned out and one by one state requests")
+    parser.add_argument('--distributions', type=int, default=3, help="map distributions from each source")
+    args = parser.parse_args()
+    args.launch_service, args.launch_startup, args.launch_shutdown, args.save_delay = False, 0.2, 0.1, 0.5
+
+    recorder = Recorder()
+    servers = []
+    with tempfile.TemporaryDirectory(prefix='robot-api-fleet-') as scratch:
+        try:
+            robots, threads = [], []
+
+            def start_robot(index: int) -> None:
+                root = os.path.join(scratch, f"robot{index}")
+                os.makedirs(root)
+                # one map each (synth_0000), the source of a robot to robot distribution
+                env, _ = prepare(root, argparse.Namespace(**{**vars(args), 'maps': 1, 'seed': args.seed + index + 1}))
+                port = free_port()
+                servers.append(start_server(root, args, env, port))
+                robots.append({'name': f"robot{index}", 'url': f"http://127.0.0.1:{port}", 'root': root})
+
+            for index in range(args.robots):
+                threads.append(threading.Thread(target=start_robot, args=(index,)))
+                threads[-1].start()
+            for thread in threads:
+                thread.join()
+            robots.sort(key=lambda robot: robot['name'])
+            if len(robots) != args.robots:
+                raise RuntimeError("stand-in robots didn't come up")
+
+            gateway_root = os.path.join(scratch, 'gateway')
+            os.makedirs(gateway_root)
+            env, maps = prepare(gateway_root, args)
+            appconfig_file = os.path.join(gateway_root, 'appconfig.yaml')
+            with open(appconfig_file) as file:
+                appconfig = yaml.safe_load(file)
+            appconfig['fleet'] = [{'name': robot['name'], 'url': robot['url']} for robot in robots]
+            appconfig['fleet_transfer_timeout'] = 30
+            with open(appconfig_file, 'w') as file:
+                yaml.safe_dump(appconfig, file)
+            port = free_port()
+            servers.append(start_server(gateway_root, argparse.Namespace(**{**vars(args), 'server': 'aiohttp'}),
+                                        env, port))
+            client = Client(port, recorder, 'fleet', basic(USER, PASSWORD))
+            robot_clients = [Client(int(robot['url'].rsplit(':', 1)[1]), recorder, 'fleet', basic(USER, PASSWORD))
+                             for robot in robots]
+            names = [robot['name'] for robot in robots]
+            client.call(None, 'GET', '/api/fleet/bringup/state')
+
+            for _ in range(args.requests):
+                client.call('GET /api/fleet/bringup/state', 'GET', '/api/fleet/bringup/state')
+                # sequential, the way a script with blocking requests queries the fleet
+                started = time.perf_counter()
+                ok = all(robot_client.call(None, 'GET', '/api/bringup/state')[0] == 200
+                         for robot_client in robot_clients)
+                recorder.record('fleet', 'GET /api/bringup/state [one by one]', started, time.perf_counter(), ok)
+
+            for _ in range(args.distributions):
+                client.call('POST /api/fleet/mapping/distribute', 'POST', '/api/fleet/mapping/distribute',
+                            {'map_name': maps[-1], 'robots': names, 'overwrite': True})
+                # robot to robot, the gateway only passes the archive on
+                client.call('POST /api/fleet/mapping/distribute [p2p]', 'POST', '/api/fleet/mapping/distribute',
+                            {'map_name': 'synth_0000', 'source': names[0], 'robots': names[1:], 'overwrite': True})
+        finally:
+            for server in servers:
+                stop_server(server)
+    print_report({'endpoints': recorder.summary()})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+import yaml
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs')
+sys.path.insert(0, BASE_DIR)
+from synthmaps import generate  # noqa: E402
+
+PACKAGE = 'navigationx_robot'
+LAUNCH_FILES = ('bringup_launch.py', 'slam_toolbox.launch.py', 'navigation2.launch.py')
+USER, PASSWORD = 'bench', 'bench-password'
+SCENARIOS = ('read', 'auth', 'users', 'control')
+READY_TIMEOUT = 60.0
+POLL_INTERVAL = 0.05
+# maps the read scenario downloads and analyses; warmed up first, so the numbers are for cached maps
+HOT_MAPS = 4
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def basic(username: str, password: str) -> str:
+    return 'Basic ' + base64.b64encode(f"{username}:{password}".encode()).decode()
+
+
+class Recorder:
+    def __init__(self):
+        # endpoint -> [(started, finished, ok)]
+        self.samples: Dict[str, List[Tuple[float, float, bool]]] = defaultdict(list)
+        self.scenario: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def record(self, scenario: str, endpoint: str, started: float, finished: float, ok: bool) -> None:
+        with self.lock:
+            self.samples[endpoint].append((started, finished, ok))
+            self.scenario[endpoint] = scenario
+
+    def summary(self) -> Dict[str, dict]:
+        endpoints = {}
+        for endpoint, samples in self.samples.items():
+            latencies = [(finished - started) * 1000 for started, finished, _ in samples]
+            span = max(finished for _, finished, _ in samples) - min(started for started, _, _ in samples)
+            endpoints[endpoint] = {'scenario': self.scenario[endpoint],
+                                   'requests': len(samples),
+                                   'errors': sum(1 for _, _, ok in samples if not ok),
+                                   'throughput': len(samples) / span if span > 0 else 0.0,
+                                   'p50_ms': percentile(latencies, 50),
+                                   'p99_ms': percentile(latencies, 99)}
+        return endpoints
+
+
+class Client:
+    # one keep-alive connection per load thread
+    def __init__(self, port: int, recorder: Recorder, scenario: str, authorization: str):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        self.recorder = recorder
+        self.scenario = scenario
+        self.authorization = authorization
+
+    def call(self, endpoint: Optional[str], method: str, path: str, body: Optional[dict] = None,
+             expect: Tuple[int, ...] = (200,), authorization: Optional[str] = None) -> Tuple[Optional[int], bytes]:
+        # endpoint None: not recorded (warm-up and polling)
+        headers = {'Authorization': authorization or self.authorization}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            status, payload = response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            status, payload = None, b''
+        if endpoint is not None:
+            self.recorder.record(self.scenario, endpoint, started, time.perf_counter(), status in expect)
+        return status, payload
+
+    def json(self, *args, **kwargs) -> dict:
+        status, payload = self.call(*args, **kwargs)
+        try:
+            return json.loads(payload) if payload else {}
+        except ValueError:
+            return {}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_database(uri: str) -> None:
+    from flask import Flask
+    from models import db, Role, User
+    app = Flask('benchmark')
+    app.config.update(SQLALCHEMY_DATABASE_URI=uri, SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        user = User(username=USER, role=[Role(name='admin')])
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+
+
+def prepare(root: str, args: argparse.Namespace) -> Tuple[dict, List[str]]:
+    # a scratch robot: synthetic maps, a ROS package with launch files, its own database, run and log directories
+    started = time.perf_counter()
+    maps = generate(os.path.join(root, 'maps'), args.maps, args.seed)
+    print(f"{len(maps)} synthetic maps in {time.perf_counter() - started:.1f}s")
+    home = os.path.join(root, 'home')
+    share = os.path.join(root, 'share', PACKAGE)
+    os.makedirs(os.path.join(share, 'launch'))
+    for launch_file in LAUNCH_FILES:
+        open(os.path.join(share, 'launch', launch_file), 'w').close()
+    # the API resolves package paths through its package cache first, so no ROS install is needed
+    os.makedirs(os.path.join(home, '.cache', 'robot_api'))
+    with open(os.path.join(home, '.cache', 'robot_api', 'ros_packages.json'), 'w') as file:
+        json.dump({'ament_prefix_path': '', 'packages': {PACKAGE: share}}, file)
+    appconfig = {'amr_ros_pkg_name': PACKAGE,
+                 'bringup_launch': LAUNCH_FILES[0],
+                 'slam_launch': LAUNCH_FILES[1],
+                 'navigation_launch': LAUNCH_FILES[2],
+                 'maps_dir': os.path.join(root, 'maps'),
+                 'run_dir': os.path.join(root, 'run'),
+                 'logs_dir': os.path.join(root, 'logs'),
+                 'launch_service': args.launch_service}
+    with open(os.path.join(root, 'appconfig.yaml'), 'w') as file:
+        yaml.safe_dump(appconfig, file)
+    database = f"sqlite:///{os.path.join(root, 'database.sqlite3')}"
+    create_database(database)
+    env = dict(os.environ,
+               ROBOT_API_CONFIG=os.path.join(root, 'appconfig.yaml'),
+               DATABASE_URI=database,
+               SECRET_KEY='benchmark',
+               HOME=home,
+               AMENT_PREFIX_PATH='',
+               PATH=f"{STUBS_DIR}{os.pathsep}{os.environ.get('PATH', '')}",
+               BENCH_LAUNCH_STARTUP=str(args.launch_startup),
+               BENCH_LAUNCH_SHUTDOWN=str(args.launch_shutdown),
+               BENCH_SAVE_DELAY=str(args.save_delay),
+               LAUNCH_SERVICE_RUNTIME='stub',
+               LAUNCH_STUB_STARTUP=str(args.launch_startup),
+               LAUNCH_STUB_SHUTDOWN=str(args.launch_shutdown))
+    return env, maps
+
+
+def start_server(root: str, args: argparse.Namespace, env: dict, port: int) -> subprocess.Popen:
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--worker-class', 'gthread',
+                   '--threads', '8', '--bind', f"127.0.0.1:{port}", 'wsgi:app']
+    elif args.server == 'aiohttp':
+        command = [sys.executable, 'aioserver.py']
+        env = dict(env, HOST='127.0.0.1', PORT=str(port))
+    else:
+        command = [sys.executable, '-c', f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    with open(os.path.join(root, 'server.log'), 'w') as log:
+        server = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                  start_new_session=True)
+    client = Client(port, Recorder(), 'ready', basic(USER, PASSWORD))
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        if client.call(None, 'GET', '/')[0] == 200:
+            return server
+        time.sleep(0.2)
+    stop_server(server)
+    with open(os.path.join(root, 'server.log')) as log:
+        sys.stderr.write(log.read()[-4000:])
+    raise RuntimeError(f"{args.server} server didn't come up")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    for sig, timeout in ((signal.SIGTERM, 10), (signal.SIGKILL, None)):
+        try:
+            os.killpg(server.pid, sig)
+            server.wait(timeout)
+            return
+        except ProcessLookupError:
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def run_threads(count: int, target: Callable[[int], None]) -> None:
+    threads = [threading.Thread(target=target, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def scenario_read(port: int, recorder: Recorder, args: argparse.Namespace, maps: List[str]) -> None:
+    setup = Client(port, recorder, 'read', basic(USER, PASSWORD))
+    bearer = 'Bearer ' + setup.json(None, 'POST', '/api/auth/token').get('data', {}).get('access_token', '')
+    hot = maps[:HOT_MAPS]
+    # (endpoint, path for a random generator, authorization)
+    endpoints = [('GET /', lambda rng: '/', None),
+                 ('GET / [bearer]', lambda rng: '/', bearer),
+                 ('GET /api/bringup/state', lambda rng: '/api/bringup/state', None),
+                 ('GET /api/mapping/getmap', lambda rng: f"/api/mapping/getmap?map_name={rng.choice(hot)}", None),
+                 ('GET /api/mapping/info', lambda rng: f"/api/mapping/info?map_name={rng.choice(hot)}", None),
+                 # answers with the whole map listing
+                 ('GET /api/mapping/getmap [unknown map]', lambda rng: '/api/mapping/getmap?map_name=no_such_map',
+                  None)]
+    for name in hot:
+        setup.call(None, 'GET', f"/api/mapping/getmap?map_name={name}")
+        setup.call(None, 'GET', f"/api/mapping/info?map_name={name}")
+
+    def load(index: int) -> None:
+        rng = random.Random(index)
+        client = Client(port, recorder, 'read', basic(USER, PASSWORD))
+        for request in range(args.requests):
+            endpoint, path, authorization = endpoints[(index + request) % len(endpoints)]
+            client.call(endpoint, 'GET', path(rng), authorization=authorization)
+    run_threads(args.concurrency, load)
+
+
+def scenario_auth(port: int, recorder: Recorder, args: argparse.Namespace, maps: List[str]) -> None:
+    def load(index: int) -> None:
+        client = Client(port, recorder, 'auth', basic(USER, PASSWORD))
+        for _ in range(args.requests // 2):
+            tokens = client.json('POST /api/auth/token', 'POST', '/api/auth/token').get('data') or {}
+            client.call('POST /api/auth/refresh', 'POST', '/api/auth/refresh',
+                        {'refresh_token': tokens.get('refresh_token', '')})
+    run_threads(args.concurrency, load)
+
+
+def scenario_users(port: int, recorder: Recorder, args: argparse.Namespace, maps: List[str]) -> None:
+    # registering hashes the password, and so does the first login of a user (a credential cache miss)
+    client = Client(port, recorder, 'users', basic(USER, PASSWORD))
+    for index in range(args.cycles):
+        username = f"bench_user_{index}"
+        client.call('POST /api/user/register', 'POST', '/api/user/register',
+                    {'username': username, 'password': PASSWORD, 'role': 'admin'}, expect=(201,))
+        client.call('GET / [first login]', 'GET', '/', authorization=basic(username, PASSWORD))
+        client.call('DELETE /api/user/delete', 'DELETE', '/api/user/delete', {'username': username})
+
+
+def wait_until(client: Client, endpoint: str, started: float, path: str, key: str, done: Tuple[str, ...]) -> None:
+    # records from the request that started it until polling sees it finished
+    deadline = time.monotonic() + 120
+    state = None
+    while time.monotonic() < deadline:
+        state = ((client.json(None, 'GET', path).get('data') or {}).get(key) or {}).get('state')
+        if state not in ('QUEUED', 'RUNNING', 'PENDING'):
+            break
+        time.sleep(POLL_INTERVAL)
+    client.recorder.record(client.scenario, endpoint, started, time.perf_counter(), state in done)
+
+
+def stop(client: Client, stack: str) -> None:
+    started = time.perf_counter()
+    reply = client.json(f"POST /api/{stack}/stop", 'POST', f"/api/{stack}/stop")
+    for transition in (reply.get('data') or {}).get('transitions', []):
+        wait_until(client, f"{transition['stack']} stop transition", started,
+                   f"/api/launcher/transition/{transition['id']}", 'transition', ('DONE',))
+
+
+def scenario_control(port: int, recorder: Recorder, args: argparse.Namespace, maps: List[str]) -> None:
+    # the launcher cycle a robot goes through: bringup, mapping, save the map, navigate on it, shut down
+    client = Client(port, recorder, 'control', basic(USER, PASSWORD))
+    for cycle in range(args.cycles):
+        map_name = f"bench_map_{cycle}"
+        client.call('POST /api/bringup/start', 'POST', '/api/bringup/start')
+        client.call('POST /api/mapping/start', 'POST', '/api/mapping/start',
+                    {'slam_method': LAUNCH_FILES[1].partition('.')[0]})
+        started = time.perf_counter()
+        job = (client.json('POST /api/mapping/savemap', 'POST', '/api/mapping/savemap', {'map_name': map_name},
+                           expect=(202,)).get('data') or {}).get('job')
+        if job is not None:
+            wait_until(client, 'savemap job', started, f"/api/jobs/{job['id']}", 'job', ('DONE',))
+        stop(client, 'mapping')
+        client.call('POST /api/navigation/start', 'POST', '/api/navigation/start', {'map_name': map_name})
+        client.call('POST /api/navigation/switch_map', 'POST', '/api/navigation/switch_map', {'map_name': maps[0]})
+        stop(client, 'navigation')
+        stop(client, 'bringup')
+        client.call('DELETE /api/mapping/delete', 'DELETE', '/api/mapping/delete', {'map_name': map_name})
+
+
+def compare(report: dict, baseline: dict, tolerance: float, slack_ms: float) -> List[str]:
+    # a percentile regresses when it exceeds the baseline by the relative tolerance plus an absolute slack,
+    # which keeps sub-millisecond endpoints from failing on noise
+    failures = []
+    scenarios = set(report['config']['scenarios'])
+    for endpoint, base in baseline['endpoints'].items():
+        if base['scenario'] not in scenarios:
+            continue
+        current = report['endpoints'].get(endpoint)
+        if current is None:
+            failures.append(f"{endpoint}: not measured")
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            limit = base[key] * (1 + tolerance) + slack_ms
+            if current[key] > limit:
+                failures.append(f"{endpoint}: {key} {current[key]:.1f} > {limit:.1f} (baseline {base[key]:.1f})")
+        if current['errors'] > base['errors']:
+            failures.append(f"{endpoint}: {current['errors']} errors (baseline {base['errors']})")
+    return failures
+
+
+def print_report(report: dict) -> None:
+    print(f"{'endpoint':<40} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for endpoint, result in report['endpoints'].items():
+        print(f"{endpoint:<40} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>8.1f} "
+              f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="load test the API against stub ROS tools and synthetic maps")
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'aiohttp'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help="gunicorn workers")
+    parser.add_argument('--maps', type=int, default=100, help="synthetic maps (10-1000)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma separated, of {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100, help="requests per thread in the read and auth scenarios")
+    parser.add_argument('--cycles', type=int, default=3, help="launcher and user cycles")
+    parser.add_argument('--launch-startup', type=float, default=0.5, help="stub launch start-up delay (seconds)")
+    parser.add_argument('--launch-shutdown', type=float, default=0.2, help="stub launch shutdown delay (seconds)")
+    parser.add_argument('--save-delay', type=float, default=1.0, help="stub map_saver_cli delay (seconds)")
+    parser.add_argument('--launch-service', action='store_true', help="start stacks through the launch service")
+    parser.add_argument('--output', help="write the report as json")
+    parser.add_argument('--baseline', help="fail when a percentile regressed against this report")
+    parser.add_argument('--write-baseline', help="write the report as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed relative regression")
+    parser.add_argument('--slack-ms', type=float, default=5.0, help="allowed absolute regression (milliseconds)")
+    args = parser.parse_args()
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(sorted(unknown))}")
+
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory(prefix='robot_api_bench_') as root:
+        env, maps = prepare(root, args)
+        port = free_port()
+        server = start_server(root, args, env, port)
+        try:
+            for scenario in scenarios:
+                started = time.perf_counter()
+                globals()[f"scenario_{scenario}"](port, recorder, args, maps)
+                print(f"{scenario}: {time.perf_counter() - started:.1f}s")
+        finally:
+            stop_server(server)
+    report = {'config': {'server': args.server, 'workers': args.workers, 'maps': args.maps,
+                         'scenarios': scenarios, 'concurrency': args.concurrency, 'requests': args.requests,
+                         'cycles': args.cycles, 'launch_service': args.launch_service},
+              'endpoints': recorder.summary()}
+    print_report(report)
+    for file in (args.output, args.write_baseline):
+        if file:
+            with open(file, 'w') as out:
+                json.dump(report, out, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline['config'] != report['config']:
+            print(f"baseline was recorded with {baseline['config']}", file=sys.stderr)
+        failures = compare(report, baseline, args.tolerance, args.slack_ms)
+        for failure in failures:
+            print(f"regression: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# third-party imports every worker pays regardless of our own code; the guard is on time spent beyond them
+DEPENDENCIES = 'import flask, flask_sqlalchemy, flask_httpauth, flask_cors, yaml, jwt; from pydantic import BaseModel'
+
+
+def import_time(statement: str, env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], cwd=BASE_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="cold start time of the API: interpreter start plus import")
+    parser.add_argument('--module', default='wsgi')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-overhead', type=float, default=0.3,
+                        help="fail when importing the app takes this much longer than its dependencies (seconds)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        # a fresh HOME starts without the on-disk ROS package cache
+        env = dict(os.environ, HOME=home)
+        cold = import_time(f"import {args.module}", env)
+        warm = [import_time(f"import {args.module}", env) for _ in range(args.runs)]
+        floor = [import_time(DEPENDENCIES, env) for _ in range(args.runs)]
+    median = statistics.median(warm)
+    overhead = median - statistics.median(floor)
+    print(f"{args.module}: cold {cold:.3f}s, warm median {median:.3f}s, max {max(warm):.3f}s, "
+          f"dependencies {statistics.median(floor):.3f}s, overhead {overhead:.3f}s ({args.runs} runs)")
+    if overhead > args.max_overhead:
+        print(f"startup regression: overhead {overhead:.3f}s > {args.max_overhead:.3f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
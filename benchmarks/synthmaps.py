@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import sys
+from typing import List
+import numpy as np
+import yaml
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BASE_DIR)
+# (width, height, weight): mostly rooms and floors, a few whole buildings
+SIZES = ((200, 200, 60), (600, 400, 30), (1200, 1000, 9), (2500, 2500, 1))
+FREE, UNKNOWN, OCCUPIED = 254, 205, 0
+
+
+def write_map(map_path: str, width: int, height: int, seed: int = 0, png: bool = True) -> None:
+    # a free area with walls around it and a few obstacles, inside an unknown margin, like map_saver_cli writes
+    rng = random.Random(seed)
+    image = np.full((height, width), UNKNOWN, dtype=np.uint8)
+    top, left = rng.randint(2, height // 8), rng.randint(2, width // 8)
+    bottom, right = height - rng.randint(2, height // 8), width - rng.randint(2, width // 8)
+    image[top:bottom, left:right] = OCCUPIED
+    image[top + 2:bottom - 2, left + 2:right - 2] = FREE
+    for _ in range(rng.randint(3, 12)):
+        row, col = rng.randint(top, bottom - 10), rng.randint(left, right - 10)
+        image[row:row + rng.randint(3, 10), col:col + rng.randint(3, 10)] = OCCUPIED
+    with open(f"{map_path}.pgm", 'wb') as file:
+        file.write(b'P5\n%d %d\n255\n' % (width, height))
+        file.write(image.tobytes())
+    with open(f"{map_path}.yaml", 'w') as file:
+        yaml.safe_dump({'image': f"{os.path.basename(map_path)}.pgm", 'mode': 'trinary', 'resolution': 0.05,
+                        'origin': [-width * 0.025, -height * 0.025, 0.0], 'negate': 0, 'occupied_thresh': 0.65,
+                        'free_thresh': 0.196}, file, sort_keys=False, default_flow_style=None)
+    if png:
+        from mapimage import write_png
+        write_png(image, f"{map_path}.png")
+
+
+def generate(maps_dir: str, count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    os.makedirs(maps_dir, exist_ok=True)
+    names = []
+    for index in range(count):
+        width, height, _ = rng.choices(SIZES, weights=[size[2] for size in SIZES])[0]
+        name = f"synth_{index:04d}"
+        write_map(os.path.join(maps_dir, name), width, height, seed=seed * 100003 + index)
+        names.append(name)
+    return names
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="write a reproducible set of synthetic maps")
+    parser.add_argument('maps_dir')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    names = generate(args.maps_dir, args.count, args.seed)
+    print(f"{len(names)} maps in {args.maps_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+from utils import amr_robot_maps, read_map_descr
+from events import EventBus
+from metrics import timed
+
+
+class MapEntry(NamedTuple):
+    name: str
+    yaml: str
+    # the image the yaml references: the pgm, or the png itself for compact maps
+    pgm: str
+    png: str
+    zip: Optional[str]
+    sizes: Dict[str, int]
+    mtimes: Dict[str, float]
+    meta: dict
+
+
+class MapCatalog:
+    # map name -> entry, rebuilt incrementally whenever the maps directory changes
+    __entries: Dict[str, MapEntry] = {}
+    # yaml path -> (mtime_ns, size, parsed descriptor), so unchanged yaml files are never re-parsed
+    __descr: Dict[str, Tuple[int, int, Optional[dict]]] = {}
+    __dir_mtime: Optional[int] = None
+    __dirty: bool = True
+    __lock = threading.RLock()
+    # pgm files whose png is being made; entries have no png until it's there
+    __converting: Set[str] = set()
+    __converter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+
+    @classmethod
+    @timed('catalog.refresh')
+    def refresh(cls, force: bool = False) -> None:
+        with cls.__lock:
+            try:
+                dir_mtime = os.stat(amr_robot_maps).st_mtime_ns
+            except FileNotFoundError:
+                cls.__entries, cls.__descr, cls.__dir_mtime = {}, {}, None
+                return
+            if not force and not cls.__dirty and dir_mtime == cls.__dir_mtime:
+                return
+            cls.__dir_mtime = dir_mtime
+            cls.__dirty = False
+            cls.__rebuild()
+
+    @classmethod
+    def invalidate(cls, map_name: Optional[str] = None) -> None:
+        with cls.__lock:
+            if map_name is not None:
+                entry = cls.__entries.pop(map_name, None)
+                cls.__descr.pop(entry.yaml if entry else path.join(amr_robot_maps, f'{map_name}.yaml'), None)
+            cls.__dirty = True
+
+    @classmethod
+    def names(cls) -> List[str]:
+        cls.refresh()
+        return list(cls.__entries.keys())
+
+    @classmethod
+    def entries(cls) -> List[MapEntry]:
+        cls.refresh()
+        return list(cls.__entries.values())
+
+    @classmethod
+    def get(cls, map_name: str) -> Optional[MapEntry]:
+        cls.refresh()
+        entry = cls.__entries.get(map_name)
+        if entry is not None and not cls.__is_fresh(entry):
+            cls.invalidate(map_name)
+            cls.refresh()
+            entry = cls.__entries.get(map_name)
+        return entry
+
+    @classmethod
+    def exists(cls, map_name: str) -> bool:
+        return cls.get(map_name) is not None
+
+    @classmethod
+    def __is_fresh(cls, entry: MapEntry) -> bool:
+        for kind, file in (('yaml', entry.yaml), ('pgm', entry.pgm), ('png', entry.png), ('zip', entry.zip)):
+            try:
+                mtime = os.stat(file).st_mtime if file else None
+            except FileNotFoundError:
+                mtime = None
+            if mtime != entry.mtimes.get(kind):
+                return False
+        return True
+
+    @classmethod
+    def __convert(cls, pairs: List[Tuple[str, str]]) -> None:
+        # numpy and Pillow are only imported once a map needs converting, not at startup
+        from mapimage import convert_maps
+        try:
+            results = convert_maps(pairs)
+        finally:
+            with cls.__lock:
+                cls.__converting.difference_update(map_pgm for map_pgm, _ in pairs)
+        # the next refresh adds the new pngs to their entries; a failed one is tried again when the maps change
+        if any(error is None for _, _, error in results):
+            cls.invalidate()
+
+    @classmethod
+    @timed('catalog.rebuild')
+    def __rebuild(cls) -> None:
+        stats = {}
+        with os.scandir(amr_robot_maps) as it:
+            for dir_entry in it:
+                if dir_entry.is_file():
+                    stats[dir_entry.name] = dir_entry.stat()
+
+        found = []
+        descr = {}
+        for filename, stat in stats.items():
+            if not filename.endswith('.yaml'):
+                continue
+            map_yaml = path.join(amr_robot_maps, filename)
+            cached = cls.__descr.get(map_yaml)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                map_descr = cached[2]
+            else:
+                try:
+                    map_descr = read_map_descr(map_yaml)
+                except Exception:
+                    map_descr = None
+            descr[map_yaml] = (stat.st_mtime_ns, stat.st_size, map_descr)
+            if map_descr is None:
+                continue
+            map_pgm = path.join(amr_robot_maps, path.basename(map_descr['image']))
+            if path.basename(map_pgm) in stats:
+                found.append((filename.partition('.')[0], map_yaml, map_pgm, map_descr))
+
+        missing_png = [(map_pgm, path.splitext(map_pgm)[0] + '.png') for _, _, map_pgm, _ in found
+                       if path.basename(path.splitext(map_pgm)[0] + '.png') not in stats
+                       and map_pgm not in cls.__converting]
+        if missing_png:
+            # a bulk import is converted in the background instead of under the lock every request waits on
+            cls.__converting.update(map_pgm for map_pgm, _ in missing_png)
+            cls.__converter.submit(cls.__convert, missing_png)
+
+        entries = {}
+        for map_name, map_yaml, map_pgm, map_descr in found:
+            map_png = path.splitext(map_pgm)[0] + '.png'
+            map_zip = path.join(amr_robot_maps, f'{map_name}.zip')
+            files = {'yaml': map_yaml, 'pgm': map_pgm, 'png': map_png, 'zip': map_zip}
+            file_stats = {kind: stats.get(path.basename(file)) for kind, file in files.items()}
+            entries[map_name] = MapEntry(
+                name=map_name,
+                yaml=map_yaml,
+                pgm=map_pgm,
+                png=map_png,
+                zip=map_zip if file_stats['zip'] is not None else None,
+                sizes={kind: st.st_size for kind, st in file_stats.items() if st is not None},
+                mtimes={kind: st.st_mtime for kind, st in file_stats.items() if st is not None},
+                meta=map_descr)
+        added = [name for name in entries if name not in cls.__entries]
+        removed = [name for name in cls.__entries if name not in entries]
+        changed = [name for name, entry in entries.items()
+                   if name in cls.__entries and entry.mtimes != cls.__entries[name].mtimes]
+        cls.__entries = entries
+        cls.__descr = descr
+        if added or removed or changed:
+            EventBus.publish('maps', {'added': added, 'removed': removed, 'changed': changed})
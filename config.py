@@ -9,10 +9,26 @@ load_dotenv(path.join(basedir, ".env"))
 class Config:
     SECRET_KEY = environ.get("SECRET_KEY")
     PERMANENT_SESSION_LIFETIME = timedelta(hours=1.0)
+    ACCESS_TOKEN_LIFETIME = timedelta(minutes=15)
+    EVENTS_POLL_INTERVAL = 0.5
+    EVENTS_HEARTBEAT = 15.0
+    LOG_TAIL_DEFAULT_BYTES = 64 * 1024
+    LOG_TAIL_MAX_BYTES = 1024 * 1024
+    LOG_TAIL_POLL_INTERVAL = 0.5
+    SAVEMAP_TIMEOUT = 120
+    UPLOAD_MAX_SIZE = 256 * 1024 * 1024
+    UPLOAD_MAX_MEMBER_SIZE = 512 * 1024 * 1024
+    # occupancy grids are mostly one grey value and deflate far better than usual files
+    UPLOAD_MAX_RATIO = 2000.0
+    UPLOAD_TTL = timedelta(hours=24)
+    # tiles are revalidated with their ETag once this expires, so a rebuilt map shows up within it
+    TILE_MAX_AGE = timedelta(minutes=5)
     # SESSION_PERMANENT = False
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + path.join(basedir, 'database.sqlite3')
+    SQLALCHEMY_DATABASE_URI = environ.get("DATABASE_URI", "sqlite:///" + path.join(basedir, 'database.sqlite3'))
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    AUTH_CACHE_SIZE = 256
+    AUTH_CACHE_TTL = timedelta(minutes=5)
 
 class ProdConfig(Config):
     FLASK_ENV = 'production'
@@ -0,0 +1,140 @@
+import fcntl
+import http.client
+import logging
+import os
+import socket
+import threading
+from typing import Callable, Optional, Union
+from flask import Flask, Request, Response, jsonify
+from werkzeug.serving import make_server
+from launcher import Launcher, LaunchState, ProcessState
+from metrics import Metrics
+from shared import SharedState, run_dir
+from validator import RespWrapper
+
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailer',
+               'transfer-encoding', 'upgrade', 'content-length'}
+FORWARD_TIMEOUT = 60.0
+STREAM_CHUNK = 8192
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Control:
+    # with several worker processes exactly one of them, the leader, owns the launch stacks; the others forward
+    # process control to it over a local unix socket and serve read-only state from the shared state file
+    __lock_file = None
+    __leader = False
+    __app: Optional[Flask] = None
+    __on_elected: Optional[Callable[[], None]] = None
+
+    @staticmethod
+    def socket_file() -> str:
+        return os.path.join(run_dir(), 'leader.sock')
+
+    @classmethod
+    def start(cls, app: Flask, on_elected: Callable[[], None]) -> None:
+        cls.__app = app
+        cls.__on_elected = on_elected
+        os.makedirs(run_dir(), exist_ok=True)
+        cls.__lock_file = open(os.path.join(run_dir(), 'leader.lock'), 'a')
+        try:
+            fcntl.flock(cls.__lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # the lock is released when the leader process exits, whichever way it exits
+            threading.Thread(target=cls.__wait_for_lock, name='leader-election', daemon=True).start()
+            return
+        cls.__promote()
+
+    @classmethod
+    def is_leader(cls) -> bool:
+        return cls.__leader
+
+    @classmethod
+    def launcher(cls) -> dict:
+        if cls.__leader:
+            return Launcher.snapshot()
+        return cls.shared_launcher()
+
+    @staticmethod
+    def shared_launcher() -> dict:
+        # the state the leader last published, read without the launcher lock or a process poll; the watcher's
+        # poll publishes stacks that exited, so it is at most one poll interval behind
+        launcher = SharedState.read().get('launcher')
+        if launcher is None:
+            return {'state': LaunchState.OFF.value,
+                    'stacks': {stack: {'state': ProcessState.NONE.value, 'pid': None, 'run_id': None, 'stopping': None}
+                               for stack in ('bringup', 'mapping', 'navigation')},
+                    'map': None}
+        return launcher
+
+    @staticmethod
+    def forwarded(request: Request) -> bool:
+        # werkzeug reports clients of the leader's unix socket as '<local>'
+        return Control.is_leader() and request.remote_addr == '<local>'
+
+    @classmethod
+    def forward(cls, request: Request) -> Optional[Union[Response, tuple]]:
+        # returns None when this worker is (or just became) the leader and should handle the request itself
+        if cls.__leader:
+            return None
+        connection = UnixHTTPConnection(cls.socket_file(), timeout=FORWARD_TIMEOUT)
+        headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_HEADERS}
+        try:
+            with Metrics.timer('control.forward'):
+                connection.request(request.method, request.full_path if request.query_string else request.path,
+                                   body=request.get_data(), headers=headers)
+                # the connection drops its reference once the leader answers with 'Connection: close'
+                sock = connection.sock
+                upstream = connection.getresponse()
+        except (ConnectionError, FileNotFoundError, socket.timeout):
+            connection.close()
+            if cls.__leader:
+                return None
+            response = RespWrapper(error=True, message="launch control is unavailable, retry shortly")
+            return jsonify(response.dict()), 503, {'Retry-After': '1'}
+        response_headers = [(key, value) for key, value in upstream.getheaders() if key.lower() not in HOP_HEADERS]
+        if upstream.getheader('Content-Type', '').startswith('text/event-stream'):
+            # event streams stay open indefinitely and carry their own heartbeat
+            sock.settimeout(None)
+
+            def relay():
+                try:
+                    while True:
+                        chunk = upstream.read1(STREAM_CHUNK)
+                        if not chunk:
+                            break
+                        yield chunk
+                except (http.client.HTTPException, OSError):
+                    # the leader went away; the client reconnects with Last-Event-ID
+                    pass
+                finally:
+                    connection.close()
+            return Response(relay(), status=upstream.status, headers=response_headers)
+        body = upstream.read()
+        connection.close()
+        return Response(body, status=upstream.status, headers=response_headers)
+
+    @classmethod
+    def __wait_for_lock(cls) -> None:
+        fcntl.flock(cls.__lock_file, fcntl.LOCK_EX)
+        logging.getLogger(__name__).warning("leader exited, worker %d takes over launch control", os.getpid())
+        cls.__promote()
+
+    @classmethod
+    def __promote(cls) -> None:
+        Launcher.adopt(SharedState.read().get('launcher'))
+        server = make_server(f"unix://{cls.socket_file()}", 0, cls.__app, threaded=True)
+        threading.Thread(target=server.serve_forever, name='leader-server', daemon=True).start()
+        SharedState.update(lambda state: state.update({'leader': os.getpid()}))
+        cls.__leader = True
+        cls.__on_elected()
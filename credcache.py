@@ -0,0 +1,84 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+
+class CredentialCache:
+    # bounded LRU of verified (username, password) pairs; only an HMAC of the pair is kept, never the password
+    def __init__(self, secret: Union[str, bytes, None] = None, maxsize: int = 256, ttl: float = 300.0):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self.__secret = secret or os.urandom(32)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (monotonic expiry, username, roles, wall time it was cached)
+        self.__entries: 'OrderedDict[bytes, Tuple[float, str, List[str], float]]' = OrderedDict()
+        self.__keys: Dict[str, Set[bytes]] = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __key(self, username: str, password: str) -> bytes:
+        return hmac.new(self.__secret, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def __drop(self, key: bytes) -> None:
+        _, username, _, _ = self.__entries.pop(key)
+        keys = self.__keys.get(username)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.__keys[username]
+
+    def get(self, username: str, password: str, revoked: Optional[float] = None) -> Optional[List[str]]:
+        # revoked: when the user was revoked (time.time()), an entry cached before then is dropped
+        if self.maxsize <= 0:
+            return None
+        key = self.__key(username, password)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or (revoked is not None and entry[3] <= revoked):
+                if entry is not None:
+                    self.__drop(key)
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, username: str, password: str, roles: List[str]) -> None:
+        if self.maxsize <= 0:
+            return
+        key = self.__key(username, password)
+        with self.__lock:
+            if key in self.__entries:
+                self.__drop(key)
+            self.__entries[key] = (time.monotonic() + self.ttl, username, list(roles), time.time())
+            self.__keys.setdefault(username, set()).add(key)
+            while len(self.__entries) > self.maxsize:
+                self.__drop(next(iter(self.__entries)))
+                self.evictions += 1
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        with self.__lock:
+            if username is None:
+                self.__entries.clear()
+                self.__keys.clear()
+                return
+            for key in list(self.__keys.get(username, ())):
+                self.__drop(key)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.__entries),
+                    'maxsize': self.maxsize,
+                    'ttl': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_ratio': self.hits / lookups if lookups else None}
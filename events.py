@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, List, NamedTuple, Optional
+
+MAX_EVENTS = 1000
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    data: dict
+    time: float
+
+    def to_sse(self) -> str:
+        payload = json.dumps({'type': self.type, 'time': self.time, 'data': self.data})
+        return f"id: {self.id}\nevent: {self.type}\ndata: {payload}\n\n"
+
+
+class EventBus:
+    # bounded in-memory history; every subscriber waits on the same condition, so one publish fans out to all
+    __events: Deque[Event] = deque(maxlen=MAX_EVENTS)
+    __last_id = 0
+    __condition = threading.Condition()
+    __subscribers: List[Callable[[Event], None]] = []
+
+    @classmethod
+    def publish(cls, event_type: str, data: dict) -> Event:
+        with cls.__condition:
+            cls.__last_id += 1
+            event = Event(cls.__last_id, event_type, data, time.time())
+            cls.__events.append(event)
+            cls.__condition.notify_all()
+            subscribers = list(cls.__subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber(event)
+            except RuntimeError:
+                # e.g. an event loop that has already been closed
+                pass
+        return event
+
+    @classmethod
+    def subscribe(cls, callback: Callable[[Event], None]) -> None:
+        # for waiters that can't block on the condition, such as coroutines; called from the publishing thread
+        with cls.__condition:
+            cls.__subscribers.append(callback)
+
+    @classmethod
+    def last_id(cls) -> int:
+        return cls.__last_id
+
+    @classmethod
+    def since(cls, last_id: int) -> Optional[List[Event]]:
+        # None means the requested id fell out of the history and the subscriber needs a fresh snapshot
+        with cls.__condition:
+            if last_id > cls.__last_id:
+                # an id from another process's history, e.g. from before a leader failover
+                return None
+            if not cls.__events or last_id == cls.__last_id:
+                return []
+            first_id = cls.__events[0].id
+            if last_id < first_id - 1:
+                return None
+            return list(cls.__events)[last_id - first_id + 1:]
+
+    @classmethod
+    def wait(cls, last_id: int, timeout: float) -> Optional[List[Event]]:
+        with cls.__condition:
+            cls.__condition.wait_for(lambda: cls.__last_id > last_id, timeout=timeout)
+            return cls.since(last_id)
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from metrics import STAGE_SECONDS, Metrics
+from utils import config
+from validator import RespWrapper
+
+# bytes per PUT when distributing a map archive
+CHUNK_SIZE = 1 << 20
+# times an upload picks up again from the offset a robot reports, after a failed or rejected chunk
+MAX_RESUMES = 3
+# characters of a non-json error body kept in a result
+MAX_MESSAGE = 200
+
+
+class Robot:
+    def __init__(self, name: str, url: str, username: Optional[str] = None, password: Optional[str] = None,
+                 token: Optional[str] = None, timeout: Optional[float] = None):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.token = token
+        self.timeout = float(timeout if timeout is not None else config.get('fleet_timeout', 5.0))
+
+    def authorization(self, caller: Optional[str]) -> Optional[str]:
+        # the robot's own credentials when configured, otherwise those the gateway was called with
+        if self.token is not None:
+            return f"Bearer {self.token}"
+        if self.username is not None:
+            return aiohttp.BasicAuth(self.username, self.password or '').encode()
+        return caller
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'url': self.url, 'timeout': self.timeout,
+                'credentials': self.token is not None or self.username is not None}
+
+
+class Fleet:
+    # gateway to the APIs of other robots (appconfig 'fleet'): a pool of keep-alive connections per robot, and
+    # requests fanned out to all of them at once with a timeout per robot, so one slow or unreachable robot only
+    # costs its own timeout. The sessions live on the event loop of the aiohttp server, see aioserver.create_app
+    __robots: Optional[Dict[str, Robot]] = None
+    __sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    @classmethod
+    def robots(cls) -> Dict[str, Robot]:
+        if cls.__robots is None:
+            cls.__robots = {entry['name']: Robot(**entry) for entry in config.get('fleet') or []}
+        return cls.__robots
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(cls.robots())
+
+    @classmethod
+    def select(cls, names: Optional[List[str]]) -> List[Robot]:
+        # every robot of the fleet when no names are given; KeyError for a name that isn't in it
+        if not names:
+            return list(cls.robots().values())
+        return [cls.robots()[name] for name in dict.fromkeys(names)]
+
+    @classmethod
+    async def open(cls) -> None:
+        connections = int(config.get('fleet_connections', 4))
+        keepalive = float(config.get('fleet_keepalive', 60))
+        for name in cls.robots():
+            if name not in cls.__sessions:
+                connector = aiohttp.TCPConnector(limit=connections, keepalive_timeout=keepalive)
+                cls.__sessions[name] = aiohttp.ClientSession(connector=connector)
+
+    @classmethod
+    async def close(cls) -> None:
+        sessions, cls.__sessions = cls.__sessions, {}
+        await asyncio.gather(*(session.close() for session in sessions.values()))
+
+    @classmethod
+    async def request(cls, robot: Robot, method: str, path: str, authorization: Optional[str] = None,
+                      timeout: Optional[float] = None, **kwargs) -> dict:
+        return (await cls.__send(robot, method, path, authorization, timeout, **kwargs))[0]
+
+    @classmethod
+    async def fan_out(cls, robots: List[Robot], method: str, path: str, authorization: Optional[str] = None,
+                      timeout: Optional[float] = None, **kwargs) -> Dict[str, dict]:
+        results = await asyncio.gather(*(cls.request(robot, method, path, authorization, timeout, **kwargs)
+                                         for robot in robots))
+        return {robot.name: result for robot, result in zip(robots, results)}
+
+    @classmethod
+    async def download(cls, robot: Robot, path: str, authorization: Optional[str] = None,
+                       timeout: Optional[float] = None, **kwargs) -> Tuple[dict, Optional[bytes]]:
+        # the body of a successful non-json response, e.g. a map archive from /api/mapping/getmap
+        result, body = await cls.__send(robot, 'GET', path, authorization, timeout, **kwargs)
+        return result, body if not result['error'] and result['data'] is None else None
+
+    @classmethod
+    async def distribute(cls, robots: List[Robot], archive: bytes, filename: str, overwrite: bool = False,
+                         authorization: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, dict]:
+        # uploads one archive to every robot at once through their resumable upload, see /api/mapping/upload.
+        # Chunks are hashed once for all robots: offset -> (chunk, sha256)
+        chunks = {offset: (archive[offset:offset + CHUNK_SIZE],
+                           hashlib.sha256(archive[offset:offset + CHUNK_SIZE]).hexdigest())
+                  for offset in range(0, len(archive), CHUNK_SIZE)}
+        init = {'filename': filename, 'size': len(archive), 'sha256': hashlib.sha256(archive).hexdigest(),
+                'overwrite': overwrite}
+        results = await asyncio.gather(*(cls.__upload(robot, archive, chunks, init, authorization, timeout)
+                                         for robot in robots))
+        return {robot.name: result for robot, result in zip(robots, results)}
+
+    @classmethod
+    async def __upload(cls, robot: Robot, archive: bytes, chunks: Dict[int, Tuple[bytes, str]], init: dict,
+                       authorization: Optional[str], timeout: Optional[float]) -> dict:
+        started = time.perf_counter()
+        result = await cls.request(robot, 'POST', '/api/mapping/upload', authorization, timeout, json=init)
+        if result['error']:
+            return result
+        path = f"/api/mapping/upload/{result['data']['upload']['id']}"
+        received, resumes = 0, 0
+        while received < len(archive):
+            if received in chunks:
+                chunk, sha256 = chunks[received]
+            else:
+                # resuming inside a chunk: send the rest of it
+                chunk = archive[received:(received // CHUNK_SIZE + 1) * CHUNK_SIZE]
+                sha256 = hashlib.sha256(chunk).hexdigest()
+            result = await cls.request(robot, 'PUT', path, authorization, timeout, params={'offset': str(received)},
+                                       data=chunk, headers={'Content-Type': 'application/octet-stream',
+                                                            'X-Chunk-SHA256': sha256})
+            if not result['error']:
+                received = result['data']['upload']['received']
+                continue
+            state = await cls.request(robot, 'GET', path, authorization, timeout) if resumes < MAX_RESUMES else None
+            if state is None or state['error']:
+                await cls.request(robot, 'DELETE', path, authorization, timeout)
+                result['elapsed'] = time.perf_counter() - started
+                return result
+            # a timed out chunk may still have been stored; continue from what the robot has
+            resumes += 1
+            received = state['data']['upload']['received']
+        result = await cls.request(robot, 'POST', f"{path}/commit", authorization, timeout)
+        result['elapsed'] = time.perf_counter() - started
+        return result
+
+    @classmethod
+    async def __send(cls, robot: Robot, method: str, path: str, authorization: Optional[str],
+                     timeout: Optional[float], headers: Optional[dict] = None,
+                     **kwargs) -> Tuple[dict, Optional[bytes]]:
+        headers = dict(headers or {})
+        if robot.authorization(authorization) is not None:
+            headers['Authorization'] = robot.authorization(authorization)
+        timeout = timeout if timeout is not None else robot.timeout
+        result = {'status': None, 'elapsed': None, 'error': True, 'message': None, 'data': None}
+        body = None
+        started = time.perf_counter()
+        try:
+            async with cls.__sessions[robot.name].request(method, robot.url + path, headers=headers,
+                                                          timeout=aiohttp.ClientTimeout(total=timeout),
+                                                          **kwargs) as response:
+                result['status'] = response.status
+                body = await response.read()
+                content_type = response.content_type
+        except asyncio.TimeoutError:
+            result['message'] = f"no response within {timeout}s"
+        except aiohttp.ClientError as e:
+            result['message'] = str(e) or type(e).__name__
+        else:
+            result['error'] = response.status >= 400
+            if content_type == 'application/json':
+                try:
+                    envelope = json.loads(body)
+                except ValueError:
+                    envelope = None
+                if isinstance(envelope, dict) and {'error', 'message', 'data'} <= envelope.keys():
+                    result.update(error=result['error'] or bool(envelope['error']), message=envelope['message'],
+                                  data=envelope['data'])
+                else:
+                    result['data'] = envelope
+            elif result['error']:
+                result['message'] = body.decode(errors='replace')[:MAX_MESSAGE]
+        result['elapsed'] = time.perf_counter() - started
+        Metrics.observe(STAGE_SECONDS, result['elapsed'], stage='fleet.request')
+        return result, body
+
+
+def aggregate(results: Dict[str, dict]) -> Tuple[RespWrapper, int]:
+    # one envelope for the results of many robots; 502 only when none of them succeeded
+    response = RespWrapper()
+    failed = sorted(name for name, result in results.items() if result['error'])
+    response.data = {'robots': results, 'failed': failed}
+    if failed:
+        response.error = True
+        response.message = f"{len(failed)} of {len(results)} robots failed"
+    return response, 502 if results and len(failed) == len(results) else 200
@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from typing import Any, Callable, List, Optional, Tuple
+from events import EventBus
+
+MAX_JOBS = 100
+
+
+class JobState(Enum):
+    def _generate_next_value_(self: str, start: int, count: int, last_values: List[Any]) -> Any:
+        return self
+
+    QUEUED = auto()
+    RUNNING = auto()
+    DONE = auto()
+    FAILED = auto()
+
+
+# a stage returns a process exit code (or None when it has none); anything but 0/None fails the job
+Stage = Tuple[str, Callable[[], Optional[int]]]
+
+
+class Job:
+    def __init__(self, kind: str, key: str, stages: List[Stage]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.state = JobState.QUEUED
+        self.stages = [{'name': name, 'started': None, 'duration': None, 'returncode': None, 'error': None}
+                       for name, _ in stages]
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def active(self) -> bool:
+        return self.state in (JobState.QUEUED, JobState.RUNNING)
+
+    def to_dict(self) -> dict:
+        return {'id': self.id,
+                'kind': self.kind,
+                'key': self.key,
+                'state': self.state.value,
+                'stages': [dict(stage) for stage in self.stages],
+                'created': self.created,
+                'finished': self.finished,
+                'error': self.error}
+
+
+class JobQueue:
+    __executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jobs')
+    __jobs: 'OrderedDict[str, Job]' = OrderedDict()
+    __lock = threading.Lock()
+
+    @classmethod
+    def submit(cls, kind: str, key: str, stages: List[Stage]) -> Tuple[Job, bool]:
+        # a job of the same kind and key that is still queued or running is returned instead of a duplicate
+        with cls.__lock:
+            for job in cls.__jobs.values():
+                if job.kind == kind and job.key == key and job.active():
+                    return job, False
+            job = Job(kind, key, stages)
+            cls.__jobs[job.id] = job
+            while len(cls.__jobs) > MAX_JOBS and not next(iter(cls.__jobs.values())).active():
+                cls.__jobs.popitem(last=False)
+        cls.__executor.submit(cls.__run, job, stages)
+        return job, True
+
+    @classmethod
+    def get(cls, job_id: str) -> Optional[Job]:
+        with cls.__lock:
+            return cls.__jobs.get(job_id)
+
+    @classmethod
+    def active(cls, kind: str, key: str) -> Optional[Job]:
+        with cls.__lock:
+            for job in cls.__jobs.values():
+                if job.kind == kind and job.key == key and job.active():
+                    return job
+        return None
+
+    @classmethod
+    def __run(cls, job: Job, stages: List[Stage]) -> None:
+        job.state = JobState.RUNNING
+        EventBus.publish('job', job.to_dict())
+        for stage, (_, run) in zip(job.stages, stages):
+            stage['started'] = time.time()
+            started = time.perf_counter()
+            try:
+                stage['returncode'] = run()
+            except Exception as e:
+                stage['error'] = str(e)
+            stage['duration'] = time.perf_counter() - started
+            if stage['error'] is not None or stage['returncode'] not in (None, 0):
+                job.error = stage['error'] or f"stage '{stage['name']}' exited with {stage['returncode']}"
+                job.state = JobState.FAILED
+                break
+        else:
+            job.state = JobState.DONE
+        job.finished = time.time()
+        EventBus.publish('job', job.to_dict())
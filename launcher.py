@@ -1,8 +1,17 @@
-import signal
+import os
 import subprocess
+import threading
+import time
 from enum import Enum, auto
-from typing import Any, List, Union, Optional
-from utils import username, config
+from typing import Any, Callable, Dict, List, Union, Optional
+from utils import amr_robot_maps, config
+from supervisor import AdoptedProcess, Process, Supervisor, Transition, process_alive
+from events import EventBus
+from launchservice import LaunchService
+from logarchive import LogArchive, LogRun, logs_dir
+from metrics import TRANSITION_SECONDS, Metrics, timed
+from shared import SharedState
+from watchdog import Watchdog
 
 
 class LaunchState(Enum):
@@ -24,104 +33,323 @@ class ProcessState(Enum):
     NONE = auto()
 
 class Launcher:
-    __process_bringup: Union[subprocess.Popen, None] = None
-    __process_mapping: Union[subprocess.Popen, None] = None
-    __process_navigation: Union[subprocess.Popen, None] = None
+    __process_bringup: Union[Process, None] = None
+    __process_mapping: Union[Process, None] = None
+    __process_navigation: Union[Process, None] = None
     state = LaunchState.OFF
+    navigation_map: Optional[str] = None
+    # stack -> the arguments of its start_* call, so the watchdog can start it again
+    __arguments: Dict[str, list] = {}
+    # stack -> pid of its latest start, so a watchdog restart can tell that it was started again meanwhile
+    __started: Dict[str, int] = {}
+    __lock = threading.RLock()
+
+    @staticmethod
+    def log_file(stack: str, stream: str) -> str:
+        return os.path.join(logs_dir(), f"{stack}_{stream}.log")
 
     @classmethod
     def start_bringup(cls):
-        with open(f"/home/{username}/.logs/bringup_output.log", "w") as out, \
-                open(f"/home/{username}/.logs/bringup_error.log", "w") as err:
-            cls.__process_bringup = subprocess.Popen(["ros2", "launch", config["amr_ros_pkg_name"], config["bringup_launch"]],
-                                                     stdout=out, stderr=err)
-        cls.state = LaunchState.BRINGUP
+        with cls.__lock:
+            run = LogArchive.new_run('bringup')
+            cls.__process_bringup = cls.__launch(run, config["bringup_launch"])
+            LogArchive.started(run, cls.__process_bringup.pid)
+            cls.__arguments['bringup'] = []
+            cls.__started['bringup'] = cls.__process_bringup.pid
+            Watchdog.watch('bringup', cls.__process_bringup)
+            cls.state = LaunchState.BRINGUP
+            EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'bringup', 'action': 'start',
+                                          'pid': cls.__process_bringup.pid})
+            cls.share()
 
     @classmethod
     def start_mapping(cls, slam_method):
-        with open(f"/home/{username}/.logs/mapping_output.log", "w") as out, \
-                open(f"/home/{username}/.logs/mapping_error.log", "w") as err:
-            cls.__process_mapping = subprocess.Popen(["ros2", "launch", config["amr_ros_pkg_name"], config["slam_launch"]],
-                                                     stdout=out, stderr=err)
-        cls.state = LaunchState.MAPPING
+        with cls.__lock:
+            run = LogArchive.new_run('mapping')
+            cls.__process_mapping = cls.__launch(run, config["slam_launch"])
+            LogArchive.started(run, cls.__process_mapping.pid)
+            cls.__arguments['mapping'] = [slam_method]
+            cls.__started['mapping'] = cls.__process_mapping.pid
+            Watchdog.watch('mapping', cls.__process_mapping)
+            cls.state = LaunchState.MAPPING
+            EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'mapping', 'action': 'start',
+                                          'pid': cls.__process_mapping.pid})
+            cls.share()
 
     @classmethod
     def start_navigation(cls, map_name, local_planner_type, with_virtual_walls=False):
-        with open(f"/home/{username}/.logs/navigation_output.log", "w") as out, \
-                open(f"/home/{username}/.logs/navigation_error.log", "w") as err:
-            cls.__process_navigation = subprocess.Popen(["ros2", "launch", config["amr_ros_pkg_name"], config["navigation_launch"],
-                                                         "map:=/home/nvidia/maps/" + map_name + ".yaml" ,
-                                                        #  "local_planner_type:=" + local_planner_type,
-                                                        #  "with_virtual_walls:=" + str(with_virtual_walls).lower()
-                                                        ],
-                                                        stdout=out, stderr=err)
-        cls.state = LaunchState.NAVIGATION
-
-    @classmethod
-    def stop_bringup(cls):
-        if cls.__process_bringup is not None:
-            cls.__process_bringup.send_signal(signal.SIGINT)
-            cls.__process_bringup.wait()
-            cls.state = LaunchState.OFF
+        with cls.__lock:
+            run = LogArchive.new_run('navigation')
+            cls.__process_navigation = cls.__launch(run, config["navigation_launch"],
+                                                    ["map:=" + amr_robot_maps + map_name + ".yaml",
+                                                    #  "local_planner_type:=" + local_planner_type,
+                                                    #  "with_virtual_walls:=" + str(with_virtual_walls).lower()
+                                                     ])
+            LogArchive.started(run, cls.__process_navigation.pid)
+            cls.__arguments['navigation'] = [map_name, local_planner_type, with_virtual_walls]
+            cls.__started['navigation'] = cls.__process_navigation.pid
+            Watchdog.watch('navigation', cls.__process_navigation)
+            cls.state = LaunchState.NAVIGATION
+            cls.navigation_map = map_name
+            EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'navigation', 'action': 'start',
+                                          'pid': cls.__process_navigation.pid})
+            cls.share()
 
     @classmethod
-    def stop_mapping(cls):
-        if cls.__process_mapping is not None:
-            cls.__process_mapping.send_signal(signal.SIGINT)
-            cls.__process_mapping.wait()
-            cls.state = LaunchState.BRINGUP
+    def try_start_bringup(cls) -> bool:
+        # the state check and the spawn under one lock, so concurrent start requests start a single stack
+        with cls.__lock:
+            if cls.state != LaunchState.OFF or Supervisor.pending('bringup') is not None:
+                return False
+            cls.start_bringup()
+            return True
 
     @classmethod
-    def stop_navigation(cls):
-        if cls.__process_navigation is not None:
-            cls.__process_navigation.send_signal(signal.SIGINT)
-            cls.__process_navigation.wait()
-            cls.state = LaunchState.BRINGUP
+    def try_start_mapping(cls, slam_method) -> bool:
+        with cls.__lock:
+            if cls.state != LaunchState.BRINGUP or Supervisor.pending('mapping') is not None:
+                return False
+            cls.start_mapping(slam_method)
+            return True
 
     @classmethod
-    def bringup_state(cls) -> ProcessState:
-        if cls.__process_bringup is not None:
-            if cls.__process_bringup.poll() is None:
-                return ProcessState.RUNNING
+    def try_start_navigation(cls, map_name, local_planner_type, with_virtual_walls=False) -> bool:
+        with cls.__lock:
+            if cls.state != LaunchState.BRINGUP or Supervisor.pending('navigation') is not None:
+                return False
+            cls.start_navigation(map_name, local_planner_type, with_virtual_walls)
+            return True
+
+    @classmethod
+    def __launch(cls, run: LogRun, launch_file: str, arguments: Optional[List[str]] = None) -> Process:
+        started = time.perf_counter()
+        process = cls.__spawn(run, launch_file, arguments or [])
+        Metrics.observe(TRANSITION_SECONDS, time.perf_counter() - started, stack=run.stack, action='start')
+        return process
+
+    @classmethod
+    def __spawn(cls, run: LogRun, launch_file: str, arguments: List[str]) -> Process:
+        if config.get('launch_service', True):
+            # the pre-warmed launch service skips interpreter start-up and the launch/ROS imports
+            process = LaunchService.launch(run.stack, config["amr_ros_pkg_name"], launch_file, arguments,
+                                           run.live_file('output'), run.live_file('error'))
+            if process is not None:
+                return process
+        with open(run.live_file('output'), "a") as out, \
+                open(run.live_file('error'), "a") as err, Metrics.timer('subprocess.ros2_launch'):
+            return subprocess.Popen(["ros2", "launch", config["amr_ros_pkg_name"], launch_file, *arguments],
+                                    stdout=out, stderr=err, start_new_session=True)
+
+    @classmethod
+    def stop_bringup(cls, exited: bool = False) -> Optional[Transition]:
+        with cls.__lock:
+            if cls.__process_bringup is not None:
+                if not exited:
+                    Watchdog.unwatch('bringup')
+                run = LogArchive.current('bringup')
+                transition = Supervisor.stop('bringup', cls.__process_bringup, cls.__on_stopped(run))
+                cls.__process_bringup = None
+                cls.state = LaunchState.OFF
+                EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'bringup', 'action': 'stop',
+                                              'pid': transition.pid, 'transition': transition.id})
+                cls.share()
+                return transition
+            return None
+
+    @classmethod
+    def stop_mapping(cls, exited: bool = False) -> Optional[Transition]:
+        with cls.__lock:
+            if cls.__process_mapping is not None:
+                if not exited:
+                    Watchdog.unwatch('mapping')
+                run = LogArchive.current('mapping')
+                transition = Supervisor.stop('mapping', cls.__process_mapping, cls.__on_stopped(run))
+                cls.__process_mapping = None
+                # bringup may have exited before it
+                cls.state = LaunchState.BRINGUP if cls.__process_bringup is not None else LaunchState.OFF
+                EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'mapping', 'action': 'stop',
+                                              'pid': transition.pid, 'transition': transition.id})
+                cls.share()
+                return transition
+            return None
+
+    @classmethod
+    def stop_navigation(cls, exited: bool = False) -> Optional[Transition]:
+        with cls.__lock:
+            if cls.__process_navigation is not None:
+                if not exited:
+                    Watchdog.unwatch('navigation')
+                run = LogArchive.current('navigation')
+                transition = Supervisor.stop('navigation', cls.__process_navigation, cls.__on_stopped(run))
+                cls.__process_navigation = None
+                cls.navigation_map = None
+                # bringup may have exited before it
+                cls.state = LaunchState.BRINGUP if cls.__process_bringup is not None else LaunchState.OFF
+                EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'navigation', 'action': 'stop',
+                                              'pid': transition.pid, 'transition': transition.id})
+                cls.share()
+                return transition
+            return None
+
+    @classmethod
+    def switched_map(cls, map_name: str) -> None:
+        with cls.__lock:
+            cls.navigation_map = map_name
+            if 'navigation' in cls.__arguments:
+                cls.__arguments['navigation'][0] = map_name
+            EventBus.publish('launcher', {'launcher': cls.state.value, 'stack': 'navigation', 'action': 'switch_map',
+                                          'pid': cls.navigation_pid(), 'map': map_name})
+        cls.share()
+
+    @classmethod
+    def stopping(cls, stack: str) -> Optional[Transition]:
+        return Supervisor.pending(stack)
+
+    @classmethod
+    def __on_stopped(cls, run: Optional[LogRun]) -> Callable[[Transition], None]:
+        def done(transition: Transition) -> None:
+            Metrics.observe(TRANSITION_SECONDS, transition.finished - transition.started, stack=transition.stack,
+                            action='stop')
+            LogArchive.finish_run(run, transition.returncode)
+            cls.share()
+        return done
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        with cls.__lock:
+            processes = {'bringup': (cls.bringup_state(), cls.bringup_pid()),
+                         'mapping': (cls.mapping_state(), cls.mapping_pid()),
+                         'navigation': (cls.navigation_state(), cls.navigation_pid())}
+            stacks = {}
+            for stack, (state, pid) in processes.items():
+                run = LogArchive.current(stack)
+                stopping = Supervisor.pending(stack)
+                stacks[stack] = {'state': state.value,
+                                 'pid': pid,
+                                 'run_id': run.run_id if run is not None else None,
+                                 'stopping': stopping.pid if stopping is not None else None}
+            return {'state': cls.state.value, 'stacks': stacks, 'map': cls.navigation_map,
+                    'arguments': cls.__arguments}
+
+    @classmethod
+    @timed('launcher.share')
+    def share(cls) -> None:
+        # publish the state for worker processes that don't own the launch stacks
+        snapshot = cls.snapshot()
+        SharedState.update(lambda state: state.update({'launcher': snapshot}))
+
+    @classmethod
+    def adopt(cls, snapshot: Optional[dict]) -> None:
+        # a new leader takes over the stacks left running by the previous one and finishes its interrupted stops
+        if not snapshot:
+            return
+        with cls.__lock:
+            processes = {}
+            for stack, process in snapshot.get('stacks', {}).items():
+                run = LogArchive.resume(stack, process['run_id']) if process.get('run_id') else None
+                if process.get('stopping') and process_alive(process['stopping']):
+                    Supervisor.stop(stack, AdoptedProcess(process['stopping']), cls.__on_stopped(run))
+                if process.get('pid') and process['state'] == ProcessState.RUNNING.value \
+                        and process_alive(process['pid']):
+                    processes[stack] = AdoptedProcess(process['pid'])
+            cls.__process_bringup = processes.get('bringup')
+            cls.__process_mapping = processes.get('mapping')
+            cls.__process_navigation = processes.get('navigation')
+            cls.navigation_map = snapshot.get('map') if cls.__process_navigation is not None else None
+            cls.__arguments = snapshot.get('arguments', {})
+            for stack, process in processes.items():
+                cls.__started[stack] = process.pid
+                Watchdog.watch(stack, process)
+            if cls.__process_navigation is not None:
+                cls.state = LaunchState.NAVIGATION
+            elif cls.__process_mapping is not None:
+                cls.state = LaunchState.MAPPING
+            elif cls.__process_bringup is not None:
+                cls.state = LaunchState.BRINGUP
             else:
-                if cls.__process_bringup.returncode == 0:
-                    cls.stop_bringup()
-                    return ProcessState.STOPPED
+                cls.state = LaunchState.OFF
+        cls.share()
+
+    @classmethod
+    def bringup_state(cls) -> ProcessState:
+        with cls.__lock:
+            if cls.__process_bringup is not None:
+                if cls.__process_bringup.poll() is None:
+                    return ProcessState.RUNNING
                 else:
-                    cls.stop_bringup()
-                    return ProcessState.ERROR
-        else:
-            return ProcessState.NONE
+                    pid, returncode = cls.__process_bringup.pid, cls.__process_bringup.returncode
+                    cls.stop_bringup(exited=True)
+                    Watchdog.exited('bringup', pid, returncode)
+                    return ProcessState.STOPPED if returncode == 0 else ProcessState.ERROR
+            else:
+                return ProcessState.NONE
 
     @classmethod
     def mapping_state(cls) -> ProcessState:
-        if cls.__process_mapping is not None:
-            if cls.__process_mapping.poll() is None:
-                return ProcessState.RUNNING
-            else:
-                if cls.__process_mapping.returncode == 0:
-                    cls.stop_mapping()
-                    return ProcessState.STOPPED
+        with cls.__lock:
+            if cls.__process_mapping is not None:
+                if cls.__process_mapping.poll() is None:
+                    return ProcessState.RUNNING
                 else:
-                    cls.stop_mapping()
-                    return ProcessState.ERROR
-        else:
-            return ProcessState.NONE
+                    pid, returncode = cls.__process_mapping.pid, cls.__process_mapping.returncode
+                    cls.stop_mapping(exited=True)
+                    Watchdog.exited('mapping', pid, returncode)
+                    return ProcessState.STOPPED if returncode == 0 else ProcessState.ERROR
+            else:
+                return ProcessState.NONE
 
     @classmethod
     def navigation_state(cls) -> ProcessState:
-        if cls.__process_navigation is not None:
-            if cls.__process_navigation.poll() is None:
-                return ProcessState.RUNNING
-            else:
-                if cls.__process_navigation.returncode == 0:
-                    cls.stop_navigation()
-                    return ProcessState.STOPPED
+        with cls.__lock:
+            if cls.__process_navigation is not None:
+                if cls.__process_navigation.poll() is None:
+                    return ProcessState.RUNNING
                 else:
-                    cls.stop_navigation()
-                    return ProcessState.ERROR
-        else:
-            return ProcessState.NONE
+                    pid, returncode = cls.__process_navigation.pid, cls.__process_navigation.returncode
+                    cls.stop_navigation(exited=True)
+                    Watchdog.exited('navigation', pid, returncode)
+                    return ProcessState.STOPPED if returncode == 0 else ProcessState.ERROR
+            else:
+                return ProcessState.NONE
+
+    @classmethod
+    def process_state(cls, stack: str) -> ProcessState:
+        return {'bringup': cls.bringup_state, 'mapping': cls.mapping_state,
+                'navigation': cls.navigation_state}[stack]()
+
+    @classmethod
+    def is_current(cls, stack: str, process) -> bool:
+        with cls.__lock:
+            return {'bringup': cls.__process_bringup, 'mapping': cls.__process_mapping,
+                    'navigation': cls.__process_navigation}[stack] is process
+
+    @classmethod
+    def restart(cls, stack: str, pid: int) -> Optional[int]:
+        # starts a stack that exited as pid again, with the arguments it was last started with; None while the
+        # launcher isn't ready for it
+        with cls.__lock:
+            if cls.__started.get(stack) != pid:
+                raise ValueError(f"{stack} was started again after pid {pid} exited")
+            if cls.process_state(stack) != ProcessState.NONE or Supervisor.pending(stack) is not None:
+                return None
+            if stack != 'bringup':
+                other = 'navigation' if stack == 'mapping' else 'mapping'
+                if cls.bringup_state() != ProcessState.RUNNING or cls.process_state(other) != ProcessState.NONE:
+                    return None
+            if stack not in cls.__arguments:
+                raise ValueError(f"{stack} was never started")
+            getattr(cls, f"start_{stack}")(*cls.__arguments[stack])
+            # restarting bringup under a running mapping or navigation must not hide them
+            if cls.__process_navigation is not None:
+                cls.state = LaunchState.NAVIGATION
+            elif cls.__process_mapping is not None:
+                cls.state = LaunchState.MAPPING
+            cls.share()
+            return cls.process_pid(stack)
+
+    @classmethod
+    def process_pid(cls, stack: str) -> Optional[int]:
+        return {'bringup': cls.bringup_pid, 'mapping': cls.mapping_pid, 'navigation': cls.navigation_pid}[stack]()
 
     @classmethod
     def bringup_pid(cls) -> Optional[int]:
@@ -0,0 +1,283 @@
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from supervisor import AdoptedProcess
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+READY_TIMEOUT = 60.0
+# the helper answers from memory; one that doesn't within this is hung and gets replaced
+CALL_TIMEOUT = 10.0
+REAP_INTERVAL = 0.2
+MAX_LAUNCHES = 50
+
+
+# ---- helper process: keeps the launch runtime imported and forks one child per launch description ----
+
+def load_runtime() -> Optional[str]:
+    # everything a launch needs is imported once here, so each forked launch starts warm
+    if os.environ.get('LAUNCH_SERVICE_RUNTIME') == 'stub':
+        return 'stub'
+    try:
+        import launch.actions  # noqa: F401
+        import launch.event_handlers  # noqa: F401
+        import launch.launch_description_sources  # noqa: F401
+        import launch_ros.actions  # noqa: F401
+        import ros2launch.api  # noqa: F401
+    except ImportError:
+        return None
+    return 'ros2launch'
+
+
+def _run_ros2launch(request: dict, report: Callable[..., None]) -> int:
+    from launch import LaunchDescription, LaunchService as RosLaunchService
+    from launch.actions import IncludeLaunchDescription, RegisterEventHandler
+    from launch.event_handlers import OnProcessStart
+    from launch.launch_description_sources import AnyLaunchDescriptionSource
+    from ros2launch.api import get_share_file_path_from_package
+
+    path = get_share_file_path_from_package(package_name=request['package'], file_name=request['launch_file'])
+    arguments = [tuple(argument.split(':=', 1)) for argument in request['arguments']]
+    first_node = []
+
+    def on_start(event, context):
+        if not first_node:
+            first_node.append(time.time())
+            report(first_node=first_node[0])
+
+    service = RosLaunchService()
+    service.include_launch_description(LaunchDescription([
+        RegisterEventHandler(OnProcessStart(on_start=on_start)),
+        IncludeLaunchDescription(AnyLaunchDescriptionSource(path), launch_arguments=arguments)]))
+    report(loaded=time.time())
+    return service.run()
+
+
+def _run_stub(request: dict, report: Callable[..., None]) -> int:
+    # stand-in for a launch when ROS isn't installed: logs like ros2 launch and runs until interrupted
+    startup = float(os.environ.get('LAUNCH_STUB_STARTUP', '0.2'))
+    shutdown = float(os.environ.get('LAUNCH_STUB_SHUTDOWN', '0.1'))
+    print(f"[INFO] [{time.time():f}] [launch]: stub launch {request['package']} {request['launch_file']} "
+          f"{' '.join(request['arguments'])}", flush=True)
+    report(loaded=time.time())
+    time.sleep(startup)
+    print(f"[INFO] [{time.time():f}] [launch]: process started with pid [{os.getpid()}]", flush=True)
+    report(first_node=time.time())
+    try:
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        time.sleep(shutdown)
+        print(f"[INFO] [{time.time():f}] [launch]: process has finished cleanly", flush=True)
+        return 0
+
+
+def _child(runtime: str, request: dict, report_fd: int, inherited: List[int]) -> None:
+    code = 1
+    try:
+        # same isolation as 'ros2 launch' started with start_new_session: the pid is the process group to signal
+        os.setsid()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for fd in inherited:
+            os.close(fd)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.close(null)
+        for fd, filename in ((1, request['stdout']), (2, request['stderr'])):
+            log = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.dup2(log, fd)
+            os.close(log)
+
+        def report(**values):
+            os.write(report_fd, (json.dumps(values) + '\n').encode())
+
+        code = _run_ros2launch(request, report) if runtime == 'ros2launch' else _run_stub(request, report)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve() -> None:
+    runtime = load_runtime()
+    launches: 'OrderedDict[int, dict]' = OrderedDict()
+    reports: Dict[int, int] = {}
+
+    def respond(message: dict) -> None:
+        sys.stdout.write(json.dumps(message) + '\n')
+        sys.stdout.flush()
+
+    def start(request: dict) -> dict:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            _child(runtime, request, write_fd, list(reports))
+        os.close(write_fd)
+        reports[read_fd] = pid
+        launches[pid] = {'name': request.get('name'), 'pid': pid, 'package': request['package'],
+                         'launch_file': request['launch_file'], 'arguments': request['arguments'],
+                         'requested': request.get('requested'), 'forked': time.time(), 'loaded': None,
+                         'first_node': None, 'returncode': None, 'exited': None}
+        while len(launches) > MAX_LAUNCHES and next(iter(launches.values()))['exited'] is not None:
+            launches.popitem(last=False)
+        return {'pid': pid, 'service': os.getpid()}
+
+    def reap() -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in launches:
+                launches[pid].update(returncode=os.waitstatus_to_exitcode(status), exited=time.time())
+
+    respond({'ready': True, 'runtime': runtime, 'pid': os.getpid()})
+    if runtime is None:
+        return
+    pending = b''
+    while True:
+        readable, _, _ = select.select([0, *reports], [], [], REAP_INTERVAL)
+        for fd in readable:
+            data = os.read(fd, 65536)
+            if fd == 0:
+                if not data:
+                    # the API went away; launches keep running in their own sessions and get adopted
+                    return
+                pending += data
+                while b'\n' in pending:
+                    line, pending = pending.split(b'\n', 1)
+                    request = json.loads(line)
+                    if request['op'] == 'start':
+                        respond(start(request))
+                    elif request['op'] == 'status':
+                        # unknown: not forked here, or dropped from the table, which only ever drops exited launches
+                        respond(launches.get(request['pid'], {'pid': request['pid'], 'unknown': True,
+                                                              'service': os.getpid()}))
+                    else:
+                        respond({'runtime': runtime, 'pid': os.getpid(), 'launches': list(launches.values())})
+            elif data:
+                for line in data.splitlines():
+                    launches[reports[fd]].update(json.loads(line))
+            else:
+                os.close(fd)
+                del reports[fd]
+        reap()
+
+
+# ---- API side ----
+
+class ServiceProcess(AdoptedProcess):
+    # a launch forked by the launch service: the service reaps it, so the exit status is asked from there
+    def __init__(self, pid: int, service: int):
+        super().__init__(pid)
+        self.service = service
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            status = LaunchService.status(self.pid)
+            if status is None or (status.get('unknown') and status['service'] != self.service):
+                # the helper that forked it is gone and the launch was handed to init
+                return super().poll()
+            # a launch its own helper no longer knows has exited, its status is lost
+            self.returncode = -1 if status.get('unknown') else status.get('returncode')
+        return self.returncode
+
+
+class LaunchService:
+    __process: Optional[subprocess.Popen] = None
+    __runtime: Optional[str] = None
+    __unavailable = False
+    __lock = threading.Lock()
+
+    @classmethod
+    def start(cls) -> Optional[str]:
+        with cls.__lock:
+            return cls.__ensure()
+
+    @classmethod
+    def launch(cls, name: str, package: str, launch_file: str, arguments: List[str], stdout: str,
+               stderr: str) -> Optional[ServiceProcess]:
+        # None means no warm runtime is available and the caller should run the ros2 launch CLI itself
+        reply = cls.__call({'op': 'start', 'name': name, 'package': package, 'launch_file': launch_file,
+                            'arguments': list(arguments), 'stdout': stdout, 'stderr': stderr,
+                            'requested': time.time()})
+        if reply is None:
+            return None
+        return ServiceProcess(reply['pid'], reply['service'])
+
+    @classmethod
+    def status(cls, pid: int) -> Optional[dict]:
+        return cls.__call({'op': 'status', 'pid': pid}, start=False)
+
+    @classmethod
+    def info(cls) -> dict:
+        reply = cls.__call({'op': 'info'}, start=False)
+        if reply is None:
+            return {'runtime': None, 'pid': None, 'launches': []}
+        for launch in reply['launches']:
+            launch['time_to_first_node'] = launch['first_node'] - launch['requested'] \
+                if launch['first_node'] is not None and launch['requested'] is not None else None
+        return reply
+
+    @classmethod
+    def __ensure(cls) -> Optional[str]:
+        if cls.__process is not None and cls.__process.poll() is None:
+            return cls.__runtime
+        if cls.__unavailable:
+            return None
+        cls.__process = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, 'launchservice.py')],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=BASE_DIR,
+                                         start_new_session=True)
+        ready = cls.__read(READY_TIMEOUT)
+        cls.__runtime = ready.get('runtime') if ready is not None else None
+        if cls.__runtime is None:
+            # no launch runtime importable: don't pay a failed helper start on every launch
+            cls.__unavailable = True
+            cls.__process.kill()
+            cls.__process.wait()
+            cls.__process = None
+        return cls.__runtime
+
+    @classmethod
+    def __read(cls, timeout: Optional[float] = None) -> Optional[dict]:
+        readable, _, _ = select.select([cls.__process.stdout], [], [], timeout)
+        line = cls.__process.stdout.readline() if readable else b''
+        return json.loads(line) if line else None
+
+    @classmethod
+    def __call(cls, request: dict, start: bool = True) -> Optional[dict]:
+        with cls.__lock:
+            if start:
+                cls.__ensure()
+            if cls.__process is None or cls.__process.poll() is not None:
+                return None
+            try:
+                cls.__process.stdin.write((json.dumps(request) + '\n').encode())
+                cls.__process.stdin.flush()
+                reply = cls.__read(CALL_TIMEOUT)
+            except (BrokenPipeError, ValueError):
+                reply = None
+            if reply is None:
+                # dead or hung: its launches run on in their own sessions, and a fresh helper takes the next ones
+                cls.__process.kill()
+                cls.__process.wait()
+                cls.__process = None
+                threading.Thread(target=cls.start, name='launchservice', daemon=True).start()
+            return reply
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,250 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from utils import username, config
+from logtail import line_level, line_stamp
+
+LOG_STREAMS = ('output', 'error')
+SCAN_CHUNK = 1024 * 1024
+MAX_MARKS = 10000
+MARK_TEXT = 300
+MARK_LEVELS = ('WARN', 'ERROR', 'FATAL')
+
+
+def logs_dir() -> str:
+    return config.get('logs_dir', f"/home/{username}/.logs")
+
+
+class LogRun:
+    # one launch of a stack: live files, rotated segments and an index of WARN/ERROR lines
+    def __init__(self, stack: str, run_id: str):
+        self.stack = stack
+        self.run_id = run_id
+        self.path = os.path.join(logs_dir(), stack, run_id)
+        self.index = {'stack': stack,
+                      'run_id': run_id,
+                      'started': time.time(),
+                      'stopped': None,
+                      'returncode': None,
+                      'pid': None,
+                      'segments': [],
+                      'marks': [],
+                      'marks_dropped': 0,
+                      'bytes': {stream: 0 for stream in LOG_STREAMS}}
+        # bytes already copied into rotated segments and bytes of the live file already indexed
+        self.base = {stream: 0 for stream in LOG_STREAMS}
+        self.scanned = {stream: 0 for stream in LOG_STREAMS}
+
+    def live_file(self, stream: str) -> str:
+        return os.path.join(self.path, f"{stream}.log")
+
+    def index_file(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def save_index(self) -> None:
+        tmp_file = self.index_file() + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(self.index, file)
+        os.replace(tmp_file, self.index_file())
+
+
+class LogArchive:
+    __runs: Dict[str, LogRun] = {}
+    __lock = threading.RLock()
+    __thread: Optional[threading.Thread] = None
+    __compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='logarchive')
+
+    @classmethod
+    def start(cls, interval: float = 5.0) -> None:
+        if cls.__thread is not None and cls.__thread.is_alive():
+            return
+        cls.__thread = threading.Thread(target=cls.__run, args=(interval,), name='logarchive', daemon=True)
+        cls.__thread.start()
+
+    @classmethod
+    def new_run(cls, stack: str) -> LogRun:
+        run = LogRun(stack, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+        os.makedirs(run.path, exist_ok=True)
+        for stream in LOG_STREAMS:
+            open(run.live_file(stream), 'a').close()
+            # keep the historical '<stack>_<stream>.log' path pointing at the current run
+            link = os.path.join(logs_dir(), f"{stack}_{stream}.log")
+            tmp_link = link + '.tmp'
+            if os.path.lexists(tmp_link):
+                os.remove(tmp_link)
+            os.symlink(run.live_file(stream), tmp_link)
+            os.replace(tmp_link, link)
+        run.save_index()
+        with cls.__lock:
+            previous = cls.__runs.get(stack)
+            cls.__runs[stack] = run
+        if previous is not None:
+            cls.finish_run(previous)
+        cls.__compressor.submit(cls.__prune, stack)
+        return run
+
+    @classmethod
+    def current(cls, stack: str) -> Optional[LogRun]:
+        with cls.__lock:
+            return cls.__runs.get(stack)
+
+    @classmethod
+    def resume(cls, stack: str, run_id: str) -> Optional[LogRun]:
+        # take over a run that another worker started, continuing its index where that worker left it
+        run = LogRun(stack, run_id)
+        try:
+            with open(run.index_file()) as file:
+                run.index = json.load(file)
+        except (OSError, ValueError):
+            return None
+        for stream in LOG_STREAMS:
+            run.base[stream] = max((segment['end'] for segment in run.index['segments']
+                                    if segment['stream'] == stream), default=0)
+            run.scanned[stream] = run.index['bytes'][stream] - run.base[stream]
+        with cls.__lock:
+            cls.__runs[stack] = run
+        return run
+
+    @classmethod
+    def started(cls, run: LogRun, pid: int) -> None:
+        with cls.__lock:
+            run.index['pid'] = pid
+            run.save_index()
+
+    @classmethod
+    def finish_run(cls, run: Optional[LogRun], returncode: Optional[int] = None) -> None:
+        if run is None:
+            return
+        with cls.__lock:
+            if run.index['stopped'] is None:
+                run.index['stopped'] = time.time()
+                run.index['returncode'] = returncode
+            for stream in LOG_STREAMS:
+                cls.__scan(run, stream)
+            run.save_index()
+            if cls.__runs.get(run.stack) is run:
+                return
+        # the run is no longer current: fold its live files into compressed segments
+        for stream in LOG_STREAMS:
+            cls.__rotate(run, stream, final=True)
+
+    @classmethod
+    def runs(cls, stack: str, limit: int = 20) -> List[dict]:
+        stack_dir = os.path.join(logs_dir(), stack)
+        if not os.path.isdir(stack_dir):
+            return []
+        run_ids = sorted(os.listdir(stack_dir), reverse=True)[:limit]
+        indexes = []
+        for run_id in run_ids:
+            try:
+                with open(os.path.join(stack_dir, run_id, 'index.json')) as file:
+                    indexes.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return indexes
+
+    @classmethod
+    def __run(cls, interval: float) -> None:
+        while True:
+            try:
+                rotate_bytes = int(config.get('log_rotate_bytes', 50 * 1024 * 1024))
+                with cls.__lock:
+                    runs = list(cls.__runs.values())
+                for run in runs:
+                    with cls.__lock:
+                        for stream in LOG_STREAMS:
+                            cls.__scan(run, stream)
+                            if os.path.getsize(run.live_file(stream)) >= rotate_bytes:
+                                cls.__rotate(run, stream)
+                        run.save_index()
+            except Exception:
+                logging.getLogger(__name__).exception("log archive pass failed")
+            time.sleep(interval)
+
+    @classmethod
+    def __scan(cls, run: LogRun, stream: str) -> None:
+        # index WARN/ERROR lines appended since the last pass; only complete lines are consumed
+        live_file = run.live_file(stream)
+        if not os.path.isfile(live_file):
+            return
+        with open(live_file, 'rb') as file:
+            file.seek(run.scanned[stream])
+            while True:
+                data = file.read(SCAN_CHUNK)
+                end = data.rfind(b'\n') + 1
+                if end == 0:
+                    if len(data) < SCAN_CHUNK:
+                        break
+                    # a single line longer than a chunk is indexed in pieces
+                    end = len(data)
+                offset = run.base[stream] + run.scanned[stream]
+                for raw_line in data[:end].splitlines(keepends=True):
+                    line = raw_line.decode('utf-8', errors='replace')
+                    level = line_level(line)
+                    if level in MARK_LEVELS:
+                        if len(run.index['marks']) < MAX_MARKS:
+                            run.index['marks'].append({'stream': stream, 'offset': offset, 'level': level,
+                                                       'stamp': line_stamp(line),
+                                                       'text': line.rstrip()[:MARK_TEXT]})
+                        else:
+                            run.index['marks_dropped'] += 1
+                    offset += len(raw_line)
+                run.scanned[stream] += end
+                file.seek(run.scanned[stream])
+        run.index['bytes'][stream] = run.base[stream] + run.scanned[stream]
+
+    @classmethod
+    def __rotate(cls, run: LogRun, stream: str, final: bool = False) -> None:
+        # copytruncate: the launch process keeps its O_APPEND descriptor, so the live file is copied then emptied
+        live_file = run.live_file(stream)
+        if not os.path.isfile(live_file):
+            return
+        with cls.__lock:
+            cls.__scan(run, stream)
+            number = sum(1 for segment in run.index['segments'] if segment['stream'] == stream) + 1
+            segment_file = os.path.join(run.path, f"{stream}.{number}.log")
+            with open(live_file, 'rb') as src, open(segment_file, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+                copied = dst.tell()
+            if final:
+                os.remove(live_file)
+            else:
+                os.truncate(live_file, 0)
+            if copied == 0:
+                os.remove(segment_file)
+                return
+            segment = {'stream': stream, 'file': os.path.basename(segment_file),
+                       'start': run.base[stream], 'end': run.base[stream] + copied}
+            run.index['segments'].append(segment)
+            run.base[stream] += copied
+            run.scanned[stream] = 0
+            run.index['bytes'][stream] = run.base[stream]
+            run.save_index()
+        cls.__compressor.submit(cls.__compress, run, segment)
+
+    @classmethod
+    def __compress(cls, run: LogRun, segment: dict) -> None:
+        segment_file = os.path.join(run.path, segment['file'])
+        with open(segment_file, 'rb') as src, gzip.open(segment_file + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        with cls.__lock:
+            segment['file'] += '.gz'
+            run.save_index()
+        os.remove(segment_file)
+
+    @classmethod
+    def __prune(cls, stack: str) -> None:
+        max_runs = int(config.get('log_max_runs', 50))
+        stack_dir = os.path.join(logs_dir(), stack)
+        with cls.__lock:
+            current = cls.__runs.get(stack)
+        for run_id in sorted(os.listdir(stack_dir), reverse=True)[max_runs:]:
+            if current is None or run_id != current.run_id:
+                shutil.rmtree(os.path.join(stack_dir, run_id), ignore_errors=True)
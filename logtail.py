@@ -0,0 +1,82 @@
+import json
+import os
+import re
+from typing import List, Optional, Pattern, Tuple
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARN', 'ERROR', 'FATAL')
+LEVEL_PATTERN = re.compile(r'\[(DEBUG|INFO|WARN|WARNING|ERROR|FATAL)\]')
+STAMP_PATTERN = re.compile(r'\[(\d{9,}\.\d+)\]')
+
+
+def line_level(line: str) -> Optional[str]:
+    match = LEVEL_PATTERN.search(line)
+    if match is None:
+        return None
+    return 'WARN' if match.group(1) == 'WARNING' else match.group(1)
+
+
+def line_stamp(line: str) -> Optional[float]:
+    match = STAMP_PATTERN.search(line)
+    return float(match.group(1)) if match is not None else None
+
+
+def filter_lines(lines: List[str], level: Optional[str] = None, pattern: Optional[Pattern] = None,
+                 since: Optional[float] = None) -> List[str]:
+    min_level = LOG_LEVELS.index(level) if level is not None else None
+    selected = []
+    for line in lines:
+        if min_level is not None:
+            current = line_level(line)
+            if current is None or LOG_LEVELS.index(current) < min_level:
+                continue
+        if since is not None:
+            stamp = line_stamp(line)
+            if stamp is not None and stamp < since:
+                continue
+        if pattern is not None and pattern.search(line) is None:
+            continue
+        selected.append(line)
+    return selected
+
+
+def read_lines(filename: str, offset: int, max_bytes: int) -> dict:
+    # reads at most max_bytes starting at offset (negative: from the end) and stops at the last full line
+    with open(filename, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        reset = False
+        if offset < 0:
+            offset = max(0, size + offset)
+            if offset > 0:
+                file.seek(offset - 1)
+                # skip the partial line we landed in
+                skipped = file.readline()
+                offset += len(skipped) - 1
+        elif offset > size:
+            # the file was truncated or replaced since the client's cursor was handed out
+            offset = 0
+            reset = True
+        file.seek(offset)
+        data = file.read(max_bytes)
+    end = data.rfind(b'\n') + 1
+    if end == 0 and len(data) == max_bytes:
+        # a single line longer than the cap; hand it out in pieces
+        end = len(data)
+    data = data[:end]
+    return {'offset': offset,
+            'next_offset': offset + len(data),
+            'size': size,
+            'reset': reset,
+            'lines': data.decode('utf-8', errors='replace').splitlines()}
+
+
+def follow_step(filename: str, offset: int, max_bytes: int, level: Optional[str] = None,
+                pattern: Optional[Pattern] = None, since: Optional[float] = None) -> Tuple[Optional[str], int, bool]:
+    # one read of a followed log: the server-sent event of the new lines (None without any), the next offset and
+    # whether the end of the file was reached; a backlog is drained max_bytes at a time without pausing
+    chunk = read_lines(filename, offset, max_bytes)
+    lines = filter_lines(chunk['lines'], level, pattern, since)
+    event = None
+    if lines or chunk['reset']:
+        chunk['lines'] = lines
+        event = f"id: {chunk['next_offset']}\nevent: log\ndata: {json.dumps(chunk)}\n\n"
+    return event, chunk['next_offset'], chunk['next_offset'] - chunk['offset'] < max_bytes // 2
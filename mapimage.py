@@ -0,0 +1,281 @@
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+import numpy as np
+import yaml
+from PIL import Image
+
+HEADER_CHUNK = 4096
+ANALYZE_ROWS = 1024
+HISTOGRAM_BINS = 10
+MAX_HEADER = 1 << 20
+_SEP = rb'(?:\s|#[^\n]*\n)+'
+# magic, width, height, maxval, then exactly one whitespace character before the raster
+PGM_HEADER = re.compile(rb'(P[25])' + _SEP + rb'(\d+)' + _SEP + rb'(\d+)' + _SEP + rb'(\d+)\s')
+
+
+class PgmHeader(NamedTuple):
+    magic: bytes
+    width: int
+    height: int
+    maxval: int
+    offset: int
+
+
+def read_pgm_header(filename: str) -> PgmHeader:
+    with open(filename, 'rb') as file:
+        data = file.read(HEADER_CHUNK)
+        match = PGM_HEADER.match(data)
+        # comment lines can push the header past the first chunk
+        while match is None and len(data) < MAX_HEADER:
+            chunk = file.read(HEADER_CHUNK)
+            if not chunk:
+                break
+            data += chunk
+            match = PGM_HEADER.match(data)
+    if match is None:
+        raise ValueError(f"{filename}: not a P2/P5 pgm file")
+    width, height, maxval = (int(group) for group in match.group(2, 3, 4))
+    if not 0 < maxval < 65536:
+        raise ValueError(f"{filename}: invalid maxval {maxval}")
+    return PgmHeader(match.group(1), width, height, maxval, match.end())
+
+
+def read_pgm(filename: str) -> Tuple[np.ndarray, int]:
+    header = read_pgm_header(filename)
+    count = header.width * header.height
+    if header.magic == b'P5':
+        dtype = np.dtype('>u2') if header.maxval > 255 else np.dtype('u1')
+        image = np.fromfile(filename, dtype=dtype, count=count, offset=header.offset)
+    else:
+        with open(filename, 'rb') as file:
+            file.seek(header.offset)
+            raster = re.sub(rb'#[^\n]*', b'', file.read())
+        image = np.array(raster.split()[:count], dtype=np.uint32)
+    if image.size != count:
+        raise ValueError(f"{filename}: truncated pgm raster")
+    return image.reshape(header.height, header.width), header.maxval
+
+
+def read_png(filename: str) -> Tuple[np.ndarray, int]:
+    with Image.open(filename) as png:
+        if png.mode in ('I;16', 'I;16B', 'I'):
+            return np.asarray(png, dtype=np.uint16), 65535
+        # colour images are read the way the map server reads them, as the mean of their channels
+        return np.asarray(png if png.mode == 'L' else png.convert('L')), 255
+
+
+def read_map_image(filename: str) -> Tuple[np.ndarray, int]:
+    # compact maps reference their png directly instead of a pgm
+    return read_pgm(filename) if filename.endswith('.pgm') else read_png(filename)
+
+
+def open_map_image(filename: str) -> Tuple[np.ndarray, int]:
+    # binary pgm rasters are mapped rather than read, so analysing a large map doesn't copy it into memory
+    if not filename.endswith('.pgm'):
+        return read_png(filename)
+    header = read_pgm_header(filename)
+    if header.magic != b'P5':
+        return read_pgm(filename)
+    dtype = np.dtype('>u2') if header.maxval > 255 else np.dtype('u1')
+    if os.path.getsize(filename) - header.offset < header.width * header.height * dtype.itemsize:
+        raise ValueError(f"{filename}: truncated pgm raster")
+    image = np.memmap(filename, dtype=dtype, mode='r', offset=header.offset, shape=(header.height, header.width))
+    return image, header.maxval
+
+
+def occupancy(maxval: int, meta: dict) -> np.ndarray:
+    # occupancy probability of every pixel value, as nav2's map_server derives it
+    values = np.arange(maxval + 1, dtype=np.float64)
+    return values / maxval if meta.get('negate', 0) else (maxval - values) / maxval
+
+
+def analyze_map(map_pgm: str, meta: dict) -> dict:
+    image, maxval = open_map_image(map_pgm)
+    height, width = image.shape
+    resolution = float(meta['resolution'])
+    origin = [float(value) for value in meta.get('origin', [0.0, 0.0, 0.0])]
+    probability = occupancy(maxval, meta)
+    occupied = probability > float(meta.get('occupied_thresh', 0.65))
+    free = probability < float(meta.get('free_thresh', 0.196))
+    known = occupied | free
+
+    # one pass over the raster: a value histogram, plus which rows and columns hold known cells
+    counts = np.zeros(maxval + 1, dtype=np.int64)
+    known_rows = np.zeros(height, dtype=bool)
+    known_cols = np.zeros(width, dtype=bool)
+    for row in range(0, height, ANALYZE_ROWS):
+        block = np.asarray(image[row:row + ANALYZE_ROWS])
+        counts += np.bincount(block.ravel(), minlength=maxval + 1)
+        mask = known[block]
+        known_rows[row:row + ANALYZE_ROWS] = mask.any(axis=1)
+        known_cols |= mask.any(axis=0)
+
+    bins = np.minimum((probability * HISTOGRAM_BINS).astype(np.int64), HISTOGRAM_BINS - 1)
+    histogram = np.bincount(bins, weights=counts, minlength=HISTOGRAM_BINS).astype(np.int64)
+    bounding_box = None
+    if known_rows.any():
+        rows = np.flatnonzero(known_rows)
+        cols = np.flatnonzero(known_cols)
+        top, bottom, left, right = int(rows[0]), int(rows[-1]), int(cols[0]), int(cols[-1])
+        # image row 0 is the top of the map, the origin is its bottom-left corner
+        bounding_box = {'cells': {'top': top, 'bottom': bottom, 'left': left, 'right': right},
+                        'min_x': origin[0] + left * resolution,
+                        'max_x': origin[0] + (right + 1) * resolution,
+                        'min_y': origin[1] + (height - 1 - bottom) * resolution,
+                        'max_y': origin[1] + (height - top) * resolution}
+    return {'resolution': resolution,
+            'origin': origin,
+            'width': width,
+            'height': height,
+            'width_m': width * resolution,
+            'height_m': height * resolution,
+            'cells': {'free': int(counts[free].sum()),
+                      'occupied': int(counts[occupied].sum()),
+                      'unknown': int(counts[~known].sum())},
+            'bounding_box': bounding_box,
+            'histogram': {'bins': HISTOGRAM_BINS, 'counts': histogram.tolist()}}
+
+
+def to_png_depth(image: np.ndarray, maxval: int) -> np.ndarray:
+    # same scaling ImageMagick applies: 8-bit output up to maxval 255, 16-bit above it
+    if maxval == 255:
+        return image.astype(np.uint8, copy=False)
+    if maxval == 65535:
+        return image.astype(np.uint16)
+    depth_max = 255 if maxval < 256 else 65535
+    scaled = (image.astype(np.uint64) * depth_max + maxval // 2) // maxval
+    return scaled.astype(np.uint8 if depth_max == 255 else np.uint16)
+
+
+def write_png(image: np.ndarray, filename: str) -> None:
+    if image.dtype == np.uint16:
+        png = Image.frombytes('I;16', (image.shape[1], image.shape[0]), image.astype('<u2').tobytes())
+    else:
+        png = Image.fromarray(image)
+    tmp_filename = os.path.join(os.path.dirname(filename), f'.{os.path.basename(filename)}.tmp')
+    try:
+        png.save(tmp_filename, format='PNG')
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def pgm_to_png(map_pgm: str, map_png: str) -> None:
+    image, maxval = read_pgm(map_pgm)
+    write_png(to_png_depth(image, maxval), map_png)
+
+
+def crop_unknown(image: np.ndarray, maxval: int, meta: dict, margin: int) -> Tuple[np.ndarray, List[float]]:
+    # drop the all-unknown rows and columns around the known area, keeping `margin` cells, and move the origin
+    # (the bottom-left corner) with the crop so every kept cell stays at the same map coordinates
+    probability = occupancy(maxval, meta)
+    known = (probability > float(meta.get('occupied_thresh', 0.65))) | \
+        (probability < float(meta.get('free_thresh', 0.196)))
+    mask = known[image]
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    origin = [float(value) for value in meta['origin']]
+    if rows.size == 0:
+        return image, origin
+    height, width = image.shape
+    top, bottom = max(int(rows[0]) - margin, 0), min(int(rows[-1]) + margin, height - 1)
+    left, right = max(int(cols[0]) - margin, 0), min(int(cols[-1]) + margin, width - 1)
+    resolution = float(meta['resolution'])
+    origin[0] = round(origin[0] + left * resolution, 9)
+    origin[1] = round(origin[1] + (height - 1 - bottom) * resolution, 9)
+    return image[top:bottom + 1, left:right + 1], origin
+
+
+def compact_map(map_yaml: str, margin: int) -> dict:
+    # rewrite a map as its cropped png plus a yaml referencing it; the map server reads png directly, so the
+    # pgm is dropped and the zip is derived from these two files when downloaded
+    with open(map_yaml) as file:
+        meta = yaml.load(file, Loader=yaml.FullLoader)
+    map_dir = os.path.dirname(map_yaml)
+    map_image = os.path.join(map_dir, os.path.basename(meta['image']))
+    map_png = os.path.splitext(map_yaml)[0] + '.png'
+    image, maxval = read_map_image(map_image)
+    cropped, origin = crop_unknown(image, maxval, meta, margin)
+    if maxval not in (255, 65535):
+        # png stores 8 or 16 bit, so the thresholds are applied to the scaled values the same way
+        cropped = to_png_depth(cropped, maxval)
+    write_png(cropped.astype(np.uint16 if maxval > 255 else np.uint8, copy=False), map_png)
+    meta['image'] = os.path.basename(map_png)
+    meta['origin'] = origin
+    tmp_yaml = os.path.join(map_dir, f'.{os.path.basename(map_yaml)}.tmp')
+    with open(tmp_yaml, 'w') as file:
+        yaml.safe_dump(meta, file, sort_keys=False, default_flow_style=None)
+    os.replace(tmp_yaml, map_yaml)
+    if map_image != map_png:
+        os.remove(map_image)
+    return {'size': list(image.shape), 'cropped': list(cropped.shape), 'origin': origin}
+
+
+def downsample(image: np.ndarray) -> np.ndarray:
+    # 2x2 block mean; an odd last row or column is repeated
+    height, width = image.shape
+    if height % 2 or width % 2:
+        image = np.pad(image, ((0, height % 2), (0, width % 2)), mode='edge')
+    blocks = image.reshape(image.shape[0] // 2, 2, image.shape[1] // 2, 2).astype(np.uint16)
+    return ((blocks.sum(axis=(1, 3)) + 2) // 4).astype(np.uint8)
+
+
+def write_tiles(image: np.ndarray, level_dir: str, tile_size: int) -> None:
+    # <level_dir>/<x>/<y>.png; edge tiles are padded with transparent pixels to the full tile size
+    height, width = image.shape
+    for x in range(math.ceil(width / tile_size)):
+        os.makedirs(os.path.join(level_dir, str(x)), exist_ok=True)
+        for y in range(math.ceil(height / tile_size)):
+            tile = image[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+            pixels = np.zeros((tile_size, tile_size, 2), dtype=np.uint8)
+            pixels[:tile.shape[0], :tile.shape[1], 0] = tile
+            pixels[:tile.shape[0], :tile.shape[1], 1] = 255
+            Image.fromarray(pixels, 'LA').save(os.path.join(level_dir, str(x), f'{y}.png'), format='PNG')
+
+
+def build_pyramid(map_pgm: str, out_dir: str, tile_size: int) -> dict:
+    # zoom 0 fits the whole map in one tile, max_zoom is the map at full resolution
+    image, maxval = read_map_image(map_pgm)
+    image = to_png_depth(image, maxval)
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    height, width = image.shape
+    max_zoom = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+    for zoom in range(max_zoom, -1, -1):
+        write_tiles(image, os.path.join(out_dir, str(zoom)), tile_size)
+        if zoom > 0:
+            image = downsample(image)
+    write_png(image, os.path.join(out_dir, 'thumbnail.png'))
+    return {'width': width, 'height': height, 'tile_size': tile_size, 'max_zoom': max_zoom}
+
+
+def _convert(map_pgm: str, map_png: str) -> Optional[str]:
+    try:
+        pgm_to_png(map_pgm, map_png)
+    except (OSError, ValueError) as e:
+        return str(e)
+    return None
+
+
+def convert_maps(pairs: Iterable[Tuple[str, str]], max_workers: Optional[int] = None) -> List[Tuple[str, str, Optional[str]]]:
+    pairs = list(pairs)
+    if len(pairs) <= 1:
+        return [(map_pgm, map_png, _convert(map_pgm, map_png)) for map_pgm, map_png in pairs]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(pairs))
+    results = []
+    # keep at most two pending conversions per worker so a bulk import never queues every map at once
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for map_pgm, map_png in pairs:
+            if len(pending) >= max_workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append((*pending.pop(future), future.result()))
+            pending[executor.submit(_convert, map_pgm, map_png)] = (map_pgm, map_png)
+        for future in wait(pending).done:
+            results.append((*pending.pop(future), future.result()))
+    return results
@@ -0,0 +1,52 @@
+import hashlib
+import threading
+from typing import Dict, Tuple
+from catalog import MapEntry
+
+HASH_CHUNK = 1024 * 1024
+
+
+def content_hash(entry: MapEntry) -> str:
+    digest = hashlib.sha256()
+    for file in (entry.yaml, entry.pgm):
+        with open(file, 'rb') as source:
+            while True:
+                chunk = source.read(HASH_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class MapInfo:
+    # analysis results keyed on the content hash of yaml + pgm, so a renamed or re-uploaded identical map is not
+    # analysed again; unchanged files (same mtimes and sizes) skip hashing too
+    __hashes: Dict[Tuple[str, tuple], str] = {}
+    __results: Dict[str, dict] = {}
+    __lock = threading.Lock()
+
+    @classmethod
+    def get(cls, entry: MapEntry) -> dict:
+        stamp = (entry.mtimes.get('yaml'), entry.mtimes.get('pgm'), entry.sizes.get('yaml'), entry.sizes.get('pgm'))
+        with cls.__lock:
+            digest = cls.__hashes.get((entry.name, stamp))
+            if digest is not None and digest in cls.__results:
+                return {'map': entry.name, 'hash': digest, **cls.__results[digest]}
+        digest = content_hash(entry)
+        with cls.__lock:
+            result = cls.__results.get(digest)
+        if result is None:
+            # numpy is only imported once a map is analysed, not at startup
+            from mapimage import analyze_map
+            result = analyze_map(entry.pgm, entry.meta)
+        with cls.__lock:
+            for key in [key for key in cls.__hashes if key[0] == entry.name]:
+                del cls.__hashes[key]
+            cls.__hashes[(entry.name, stamp)] = digest
+            cls.__results[digest] = result
+            # drop results no map refers to any more
+            live = set(cls.__hashes.values())
+            for stale in [stale for stale in cls.__results if stale not in live]:
+                del cls.__results[stale]
+        return {'map': entry.name, 'hash': digest, **result}
@@ -0,0 +1,174 @@
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from numbers import Number
+from typing import Dict, List, Optional, Tuple
+from catalog import MapCatalog, MapEntry
+from metrics import timed
+from shared import SharedState
+from utils import config
+
+# nav2_msgs/srv/LoadMap result codes
+LOAD_MAP_RESULTS = {0: 'SUCCESS', 1: 'MAP_DOES_NOT_EXIST', 2: 'INVALID_MAP_METADATA', 3: 'INVALID_MAP_DATA',
+                    255: 'UNDEFINED_FAILURE'}
+MAP_HISTORY = 10
+
+
+class MapSwitchError(RuntimeError):
+    pass
+
+
+class InvalidMapError(MapSwitchError):
+    pass
+
+
+def validate_map(entry: MapEntry) -> Optional[str]:
+    # the checks nav2's map_server does on load, so a bad map is refused before navigation loses its map
+    meta = entry.meta
+    for key in ('image', 'resolution', 'origin', 'negate', 'occupied_thresh', 'free_thresh'):
+        if key not in meta:
+            return f"'{key}' is missing from {os.path.basename(entry.yaml)}"
+    if not isinstance(meta['resolution'], Number) or meta['resolution'] <= 0:
+        return "'resolution' must be a positive number"
+    if not isinstance(meta['origin'], list) or len(meta['origin']) != 3 \
+            or not all(isinstance(value, Number) for value in meta['origin']):
+        return "'origin' must be [x, y, yaw]"
+    if not os.access(entry.pgm, os.R_OK):
+        return f"image '{os.path.basename(entry.pgm)}' isn't readable"
+    return None
+
+
+class RclpyLoader:
+    # a persistent node and service client, so a switch costs one service round trip
+    def __init__(self, service: str):
+        import rclpy
+        from rclpy.signals import SignalHandlerOptions
+        from nav2_msgs.srv import LoadMap
+        if not rclpy.ok():
+            rclpy.init(signal_handler_options=SignalHandlerOptions.NO)
+        self.rclpy = rclpy
+        self.request_type = LoadMap.Request
+        self.node = rclpy.create_node(f"robot_api_map_switch_{os.getpid()}")
+        self.client = self.node.create_client(LoadMap, service)
+
+    def load(self, map_url: str, timeout: float) -> int:
+        if not self.client.wait_for_service(timeout_sec=timeout):
+            raise MapSwitchError("map server load_map service isn't available")
+        request = self.request_type()
+        request.map_url = map_url
+        future = self.client.call_async(request)
+        self.rclpy.spin_until_future_complete(self.node, future, timeout_sec=timeout)
+        if not future.done():
+            raise MapSwitchError("map server didn't answer in time")
+        return future.result().result
+
+
+class CliLoader:
+    # 'ros2 service call' when rclpy isn't importable by the API's interpreter
+    def __init__(self, service: str):
+        self.service = service
+
+    @timed('subprocess.load_map')
+    def load(self, map_url: str, timeout: float) -> int:
+        try:
+            completed = subprocess.run(["ros2", "service", "call", self.service, "nav2_msgs/srv/LoadMap",
+                                        f"{{map_url: '{map_url}'}}"], capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise MapSwitchError("map server didn't answer in time")
+        # the response echoes the whole occupancy grid before the result code
+        match = re.search(rb"result=(\d+)\)\s*$", completed.stdout)
+        if completed.returncode != 0 or match is None:
+            raise MapSwitchError("map server load_map service call failed")
+        return int(match.group(1))
+
+
+class MapSwitcher:
+    # swaps the map of the running navigation stack through the map server's load_map service and keeps the
+    # maps most likely to be switched to next validated and in the page cache
+    __loader = None
+    __lock = threading.Lock()
+    # map name -> (mtimes validated, error)
+    __preloaded: 'OrderedDict[str, Tuple[Dict[str, float], Optional[str]]]' = OrderedDict()
+    __preloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mappreload')
+
+    @classmethod
+    def switch(cls, entry: MapEntry) -> dict:
+        started = time.monotonic()
+        preloaded = cls.__preloaded.get(entry.name)
+        if preloaded is not None and preloaded[0] == entry.mtimes:
+            error = preloaded[1]
+        else:
+            preloaded = None
+            error = validate_map(entry)
+        if error is not None:
+            raise InvalidMapError(f"map '{entry.name}' is invalid: {error}")
+        validated = time.monotonic()
+        timeout = float(config.get('map_switch_timeout', 30))
+        with cls.__lock:
+            if cls.__loader is None:
+                cls.__loader = cls.__create_loader()
+            result = cls.__loader.load(entry.yaml, timeout)
+        loaded = time.monotonic()
+        if result != 0:
+            raise MapSwitchError(f"map server refused '{entry.name}': {LOAD_MAP_RESULTS.get(result, result)}")
+        cls.remember(entry.name)
+        return {'map': entry.name,
+                'preloaded': preloaded is not None,
+                'latency': loaded - started,
+                'validate_latency': validated - started,
+                'load_latency': loaded - validated}
+
+    @classmethod
+    def remember(cls, map_name: str) -> None:
+        # maps navigated on recently are the likely next ones; the history is shared with the other workers
+        def change(state: dict) -> None:
+            history = [name for name in state.get('map_history', []) if name != map_name]
+            state['map_history'] = [map_name, *history][:MAP_HISTORY]
+        SharedState.update(change)
+        cls.__preloader.submit(cls.__preload, map_name)
+
+    @classmethod
+    def likely_next(cls, current: Optional[str]) -> List[str]:
+        count = int(config.get('map_preload_count', 3))
+        entries = {entry.name: entry for entry in MapCatalog.entries() if not entry.name.endswith('_virtual')}
+        recent = [name for name in SharedState.read().get('map_history', []) if name in entries]
+        newest = sorted(entries, key=lambda name: entries[name].mtimes.get('yaml', 0), reverse=True)
+        names = []
+        for name in recent + newest:
+            if name != current and name not in names:
+                names.append(name)
+        return names[:count]
+
+    @classmethod
+    def __preload(cls, current: str) -> None:
+        try:
+            names = cls.likely_next(current)
+            for name in names:
+                entry = MapCatalog.get(name)
+                if entry is None:
+                    continue
+                cached = cls.__preloaded.get(name)
+                if cached is not None and cached[0] == entry.mtimes:
+                    continue
+                error = validate_map(entry)
+                if error is None:
+                    with open(entry.pgm, 'rb') as file:
+                        os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                cls.__preloaded[name] = (entry.mtimes, error)
+            for name in [name for name in cls.__preloaded if name not in names]:
+                del cls.__preloaded[name]
+        except Exception:
+            logging.getLogger(__name__).exception("map preload failed")
+
+    @classmethod
+    def __create_loader(cls):
+        service = config.get('map_load_service', '/map_server/load_map')
+        try:
+            return RclpyLoader(service)
+        except ImportError:
+            return CliLoader(service)
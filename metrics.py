@@ -0,0 +1,194 @@
+import atexit
+import bisect
+import fcntl
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+from shared import run_dir
+from supervisor import process_alive
+from utils import config
+
+REQUEST_SECONDS = 'robot_api_request_duration_seconds'
+STAGE_SECONDS = 'robot_api_stage_duration_seconds'
+TRANSITION_SECONDS = 'robot_api_launcher_transition_seconds'
+WATCHDOG_DOWNTIME_SECONDS = 'robot_api_watchdog_downtime_seconds'
+# histogram name -> (help, bucket upper bounds); +Inf is implicit
+FAMILIES = {
+    REQUEST_SECONDS: ("Time to produce a response, by route",
+                      (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)),
+    STAGE_SECONDS: ("Time spent in the map catalog, authentication, launch control and subprocess calls",
+                    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0,
+                     30.0)),
+    TRANSITION_SECONDS: ("Launch stack start (until running) and stop (until exited) durations",
+                         (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)),
+    WATCHDOG_DOWNTIME_SECONDS: ("Time from a stack exiting on its own until the watchdog restarted it",
+                                (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)),
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+EXITED = 'exited.json'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def metrics_dir() -> str:
+    return os.path.join(run_dir(), 'metrics')
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def timed(stage: str) -> Callable:
+    def decorate(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                Metrics.observe(STAGE_SECONDS, time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorate
+
+
+class Metrics:
+    # in-process histograms, cheap enough for every request: a bisect and a counter increment under a lock. Each
+    # worker writes its series to <run_dir>/metrics/<pid>.json every few seconds and /metrics sums the files of all
+    # workers; series of workers that exited are folded into exited.json so the counters never go backwards
+    # (name, labels) -> [per-bucket counts including +Inf, sum]
+    __series: Dict[Tuple[str, Labels], list] = {}
+    __changed = False
+    __thread = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def observe(cls, name: str, value: float, **labels: str) -> None:
+        bounds = FAMILIES[name][1]
+        index = bisect.bisect_left(bounds, value)
+        key = (name, tuple(sorted((label, str(text)) for label, text in labels.items())))
+        with cls.__lock:
+            series = cls.__series.get(key)
+            if series is None:
+                series = cls.__series[key] = [[0] * (len(bounds) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+            cls.__changed = True
+
+    @classmethod
+    @contextmanager
+    def timer(cls, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(STAGE_SECONDS, time.perf_counter() - started, stage=stage)
+
+    @classmethod
+    def start(cls) -> None:
+        if cls.__thread is not None and cls.__thread.is_alive():
+            return
+        os.makedirs(metrics_dir(), exist_ok=True)
+        # a previous process with our pid left its series behind
+        cls.__retire(os.getpid())
+        cls.__thread = threading.Thread(target=cls.__run, name='metrics', daemon=True)
+        cls.__thread.start()
+        atexit.register(cls.flush)
+
+    @classmethod
+    def flush(cls) -> None:
+        with cls.__lock:
+            if not cls.__changed:
+                return
+            rows = cls.__rows()
+            cls.__changed = False
+        file = os.path.join(metrics_dir(), f"{os.getpid()}.json")
+        with open(f"{file}.tmp", 'w') as out:
+            json.dump(rows, out)
+        os.replace(f"{file}.tmp", file)
+
+    @classmethod
+    def render(cls) -> str:
+        merged: Dict[Tuple[str, Labels], list] = {}
+        with cls.__lock:
+            cls.__merge(merged, cls.__rows())
+        for filename in os.listdir(metrics_dir()):
+            pid = filename[:-len('.json')]
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if not process_alive(int(pid)):
+                cls.__retire(int(pid))
+                continue
+            cls.__merge(merged, cls.__read(os.path.join(metrics_dir(), filename)))
+        cls.__merge(merged, cls.__read(os.path.join(metrics_dir(), EXITED)))
+
+        lines = []
+        for name, (description, bounds) in FAMILIES.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for (_, labels), (counts, total) in sorted(item for item in merged.items() if item[0][0] == name):
+                text = ','.join(f'{label}="{escape(value)}"' for label, value in labels)
+                cumulative = 0
+                for bound, count in zip(bounds + (math.inf,), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else repr(bound)
+                    lines.append(f'{name}_bucket{{{text}{"," if text else ""}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{text}}} {total!r}")
+                lines.append(f"{name}_count{{{text}}} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def __rows(cls) -> list:
+        return [[name, list(labels), list(counts), total] for (name, labels), (counts, total) in cls.__series.items()]
+
+    @staticmethod
+    def __read(file: str) -> list:
+        try:
+            with open(file) as source:
+                return json.load(source)
+        except (OSError, ValueError):
+            return []
+
+    @staticmethod
+    def __merge(merged: Dict[Tuple[str, Labels], list], rows: List[list]) -> None:
+        for name, labels, counts, total in rows:
+            # series written with other buckets by an older version are dropped
+            if name not in FAMILIES or len(counts) != len(FAMILIES[name][1]) + 1:
+                continue
+            key = (name, tuple(tuple(label) for label in labels))
+            series = merged.setdefault(key, [[0] * len(counts), 0.0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+
+    @classmethod
+    def __retire(cls, pid: int) -> None:
+        file = os.path.join(metrics_dir(), f"{pid}.json")
+        with open(os.path.join(metrics_dir(), 'metrics.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(file):
+                    return
+                merged: Dict[Tuple[str, Labels], list] = {}
+                cls.__merge(merged, cls.__read(os.path.join(metrics_dir(), EXITED)))
+                cls.__merge(merged, cls.__read(file))
+                exited = os.path.join(metrics_dir(), EXITED)
+                with open(f"{exited}.tmp", 'w') as out:
+                    json.dump([[name, list(labels), counts, total]
+                               for (name, labels), (counts, total) in merged.items()], out)
+                os.replace(f"{exited}.tmp", exited)
+                os.remove(file)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @classmethod
+    def __run(cls) -> None:
+        interval = float(config.get('metrics_flush_interval', 5.0))
+        while True:
+            time.sleep(interval)
+            try:
+                cls.flush()
+            except OSError:
+                pass
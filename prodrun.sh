@@ -1,6 +1,7 @@
 #!/bin/sh
-export FLASK_APP=app.py
-export FLASK_ENV='development'
-export FLASK_RUN_HOST=$(ip -4 addr show wlan0 | grep -oP '(?<=inet\s)\d+(\.\d+){3}')
-export FLASK_RUN_PORT=8000
-flask run
+export HOST=$(ip -4 addr show wlan0 | grep -oP '(?<=inet\s)\d+(\.\d+){3}')
+export PORT=8000
+export WORKERS=${WORKERS:-4}
+# one worker is elected to own the launch stacks, the others forward process control to it (see control.py);
+# do not use --preload, election has to happen in each worker
+gunicorn --workers $WORKERS --worker-class gthread --threads 8 --bind $HOST:$PORT wsgi:app
@@ -0,0 +1,70 @@
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+from shared import run_dir
+from utils import config
+
+MAX_PROFILES = 50
+MAX_DEPTH = 128
+
+
+def profiles_dir() -> str:
+    return os.path.join(run_dir(), 'profiles')
+
+
+def profile_file(profile_id: str) -> Optional[str]:
+    if not re.fullmatch(r'[0-9a-f]{12}', profile_id):
+        return None
+    return os.path.join(profiles_dir(), f"{profile_id}.txt")
+
+
+class SamplingProfiler:
+    # samples the stack of one request thread from a side thread every profile_interval seconds, so the request
+    # itself runs unmodified; the result is in collapsed stack format (flamegraph.pl, speedscope)
+    def __init__(self, thread_id: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.thread_id = thread_id
+        self.interval = float(config.get('profile_interval', 0.005))
+        self.max_seconds = float(config.get('profile_max_seconds', 30))
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name='profiler', daemon=True)
+
+    @classmethod
+    def current_thread(cls) -> 'SamplingProfiler':
+        profiler = cls(threading.get_ident())
+        profiler.thread.start()
+        return profiler
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def save(self) -> str:
+        os.makedirs(profiles_dir(), exist_ok=True)
+        file = profile_file(self.id)
+        with open(f"{file}.tmp", 'w') as out:
+            out.writelines(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+        os.replace(f"{file}.tmp", file)
+        profiles = sorted((entry for entry in os.scandir(profiles_dir()) if entry.name.endswith('.txt')),
+                          key=lambda entry: entry.stat().st_mtime)
+        for entry in profiles[:-MAX_PROFILES]:
+            os.remove(entry.path)
+        return self.id
+
+    def __run(self) -> None:
+        deadline = time.monotonic() + self.max_seconds
+        while not self.stopped.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
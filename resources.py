@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+from launcher import Launcher
+from utils import config
+
+RING_SIZE = 300
+MAX_SERIES = 256
+FIELDS = ('cpu', 'rss', 'threads', 'read_rate', 'write_rate')
+PERCENTILES = (50, 95, 99)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class Ring:
+    # the last RING_SIZE samples of one series in a preallocated array, constant memory however long it runs
+    def __init__(self, size: int = RING_SIZE):
+        self.size = size
+        self.stride = len(FIELDS) + 1
+        self.data = array('d', bytes(8 * size * self.stride))
+        self.count = 0
+
+    def append(self, stamp: float, values: Tuple[float, ...]) -> None:
+        start = (self.count % self.size) * self.stride
+        self.data[start] = stamp
+        self.data[start + 1:start + self.stride] = array('d', values)
+        self.count += 1
+
+    def rows(self) -> List[Tuple[float, ...]]:
+        first = max(self.count - self.size, 0)
+        return [tuple(self.data[(index % self.size) * self.stride:(index % self.size + 1) * self.stride])
+                for index in range(first, self.count)]
+
+    def latest(self) -> Tuple[float, ...]:
+        start = ((self.count - 1) % self.size) * self.stride
+        return tuple(self.data[start:start + self.stride])
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def read_stat(pid: int) -> Optional[Tuple[str, float, int, int, int]]:
+    # comm, cpu seconds, threads, rss bytes, start time
+    try:
+        with open(f"/proc/{pid}/stat", 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    comm = data[data.index(b'(') + 1:data.rindex(b')')].decode(errors='replace')
+    fields = data[data.rindex(b')') + 2:].split()
+    return (comm, (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[17]), int(fields[21]) * PAGE_SIZE,
+            int(fields[19]))
+
+
+def read_io(pid: int) -> Tuple[int, int]:
+    try:
+        with open(f"/proc/{pid}/io", 'rb') as file:
+            io = dict(line.split(b':', 1) for line in file.read().splitlines())
+        return int(io[b'read_bytes']), int(io[b'write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def children(pid: int) -> List[int]:
+    # the kernel's per-thread child lists, so only the launch's own tree is read
+    pids = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as file:
+                pids.extend(int(child) for child in file.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def process_tree(root: int) -> List[int]:
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children(pid))
+    return pids
+
+
+def node_name(pid: int, comm: str) -> str:
+    # ROS nodes get their name from the launch file as a '__node:=' remapping
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as file:
+            arguments = file.read().split(b'\0')
+    except OSError:
+        return comm
+    for argument in arguments:
+        if argument.startswith(b'__node:='):
+            return argument[8:].decode(errors='replace')
+    return comm
+
+
+class ResourceMonitor:
+    # one background sampler walking the process tree of every running stack through /proc
+    __thread: Optional[threading.Thread] = None
+    __series: Dict[str, Ring] = {}
+    # series key -> (pid, stack, node name)
+    __owners: Dict[str, Tuple[int, str, str]] = {}
+    # (pid, start time) -> (name, last sample time, cpu seconds, read bytes, write bytes)
+    __previous: Dict[Tuple[int, int], Tuple[str, float, float, int, int]] = {}
+    __overhead = 0.0
+    __interval = 2.0
+    __lock = threading.Lock()
+
+    @classmethod
+    def start(cls) -> None:
+        if cls.__thread is not None and cls.__thread.is_alive():
+            return
+        cls.__interval = float(config.get('resources_interval', 2.0))
+        cls.__thread = threading.Thread(target=cls.__run, name='resources', daemon=True)
+        cls.__thread.start()
+
+    @classmethod
+    def report(cls, stack: Optional[str] = None, history: bool = False) -> dict:
+        stacks = {}
+        with cls.__lock:
+            series = [(key, cls.__owners[key], ring.rows()) for key, ring in cls.__series.items()
+                      if stack is None or cls.__owners[key][1] == stack]
+            overhead = cls.__overhead
+        for key, (pid, owner, name), rows in series:
+            if not rows:
+                continue
+            latest = rows[-1]
+            node = {'pid': pid,
+                    'updated': latest[0],
+                    'latest': dict(zip(FIELDS, latest[1:])),
+                    'percentiles': {field: {f"p{q}": percentile([row[index + 1] for row in rows], q)
+                                            for q in PERCENTILES}
+                                    for index, field in enumerate(FIELDS)},
+                    'samples': len(rows)}
+            if history:
+                node['history'] = {'time': [row[0] for row in rows],
+                                   **{field: [row[index + 1] for row in rows] for index, field in enumerate(FIELDS)}}
+            stacks.setdefault(owner, {})[name] = node
+        return {'interval': cls.__interval, 'overhead_percent': overhead, 'stacks': stacks}
+
+    @classmethod
+    def __run(cls) -> None:
+        while True:
+            started = time.monotonic()
+            cpu_started = time.thread_time()
+            try:
+                cls.__sample({'bringup': Launcher.bringup_pid(), 'mapping': Launcher.mapping_pid(),
+                              'navigation': Launcher.navigation_pid()})
+            except Exception:
+                logging.getLogger(__name__).exception("resource sample failed")
+            elapsed = time.monotonic() - started
+            time.sleep(max(cls.__interval - elapsed, 0.0))
+            # share of one core the sampler itself used over the last period
+            cls.__overhead = (time.thread_time() - cpu_started) / (time.monotonic() - started) * 100
+
+    @classmethod
+    def __sample(cls, roots: Dict[str, Optional[int]]) -> None:
+        now = time.time()
+        current = {}
+        seen = set()
+        for stack, root in roots.items():
+            if root is None:
+                continue
+            for pid in process_tree(root):
+                stat = read_stat(pid)
+                if stat is None:
+                    continue
+                comm, cpu_seconds, threads, rss, start_time = stat
+                read_bytes, write_bytes = read_io(pid)
+                previous = cls.__previous.get((pid, start_time))
+                name = previous[0] if previous is not None else node_name(pid, comm)
+                current[(pid, start_time)] = (name, now, cpu_seconds, read_bytes, write_bytes)
+                if previous is None:
+                    continue
+                period = now - previous[1]
+                values = ((cpu_seconds - previous[2]) / period * 100, rss, threads,
+                          (read_bytes - previous[3]) / period, (write_bytes - previous[4]) / period)
+                key = f"{stack}/{name}"
+                if key in seen:
+                    # several live processes share a node name: keep them apart by pid
+                    name = f"{name}:{pid}"
+                    key = f"{stack}/{name}"
+                seen.add(key)
+                with cls.__lock:
+                    if key not in cls.__series:
+                        cls.__series[key] = Ring()
+                    # a respawned node continues its series
+                    cls.__owners[key] = (pid, stack, name)
+                    cls.__series[key].append(now, values)
+        cls.__previous = current
+        with cls.__lock:
+            # keep at most MAX_SERIES series, dropping the ones that stopped reporting the longest ago
+            if len(cls.__series) > MAX_SERIES:
+                for key in sorted(cls.__series, key=lambda key: cls.__series[key].latest()[0])[:-MAX_SERIES]:
+                    del cls.__series[key]
+                    del cls.__owners[key]
@@ -0,0 +1,59 @@
+import fcntl
+import json
+import os
+import threading
+from typing import Callable, Optional, Tuple
+from utils import config
+
+
+def run_dir() -> str:
+    return config.get('run_dir', '/tmp/robot_api')
+
+
+class SharedState:
+    # one small json document shared by every worker process; writers serialize on an flock and replace the file
+    # atomically, readers only re-parse it when it changed
+    __cache: Tuple[Optional[tuple], dict] = (None, {})
+    __lock = threading.Lock()
+
+    @staticmethod
+    def state_file() -> str:
+        return os.path.join(run_dir(), 'state.json')
+
+    @classmethod
+    def read(cls) -> dict:
+        try:
+            stat = os.stat(cls.state_file())
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with cls.__lock:
+            if cls.__cache[0] == key:
+                return cls.__cache[1]
+        try:
+            with open(cls.state_file()) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        with cls.__lock:
+            cls.__cache = (key, state)
+        return state
+
+    @classmethod
+    def update(cls, change: Callable[[dict], None]) -> None:
+        os.makedirs(run_dir(), exist_ok=True)
+        with open(os.path.join(run_dir(), 'state.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(cls.state_file()) as file:
+                        state = json.load(file)
+                except (OSError, ValueError):
+                    state = {}
+                change(state)
+                tmp_file = f"{cls.state_file()}.{os.getpid()}.tmp"
+                with open(tmp_file, 'w') as file:
+                    json.dump(state, file)
+                os.replace(tmp_file, cls.state_file())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
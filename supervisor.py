@@ -0,0 +1,175 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from typing import Any, Callable, List, Optional, Union
+from utils import config
+from events import EventBus
+
+MAX_TRANSITIONS = 100
+
+
+class TransitionState(Enum):
+    def _generate_next_value_(self: str, start: int, count: int, last_values: List[Any]) -> Any:
+        return self
+
+    PENDING = auto()
+    DONE = auto()
+    FAILED = auto()
+
+
+class Transition:
+    def __init__(self, stack: str, action: str, pid: Optional[int]):
+        self.id = uuid.uuid4().hex
+        self.stack = stack
+        self.action = action
+        self.pid = pid
+        self.state = TransitionState.PENDING
+        self.signals: List[str] = []
+        self.returncode: Optional[int] = None
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.finished: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {'id': self.id,
+                'stack': self.stack,
+                'action': self.action,
+                'pid': self.pid,
+                'state': self.state.value,
+                'signals': list(self.signals),
+                'returncode': self.returncode,
+                'error': self.error,
+                'started': self.started,
+                'finished': self.finished}
+
+
+def process_alive(pid: int) -> bool:
+    # a zombie has exited even though its pid is still taken
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rpartition(')')[2].split()[0] not in ('Z', 'X')
+    except (OSError, IndexError):
+        return False
+
+
+class AdoptedProcess:
+    # a launch process started by a previous leader worker: it is not our child, so only liveness is observable
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None and not process_alive(self.pid):
+            # the exit status went to whoever reaped it; report it as abnormal
+            self.returncode = -1
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(str(self.pid), timeout)
+            time.sleep(0.1)
+        return self.returncode
+
+
+Process = Union[subprocess.Popen, AdoptedProcess]
+
+
+class Supervisor:
+    __executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='supervisor')
+    __transitions: 'OrderedDict[str, Transition]' = OrderedDict()
+    __lock = threading.Lock()
+
+    @classmethod
+    def stop(cls, stack: str, process: Process,
+             on_done: Optional[Callable[[Transition], None]] = None) -> Transition:
+        transition = Transition(stack, 'stop', process.pid)
+        with cls.__lock:
+            cls.__transitions[transition.id] = transition
+            while len(cls.__transitions) > MAX_TRANSITIONS:
+                oldest = next(iter(cls.__transitions.values()))
+                if oldest.state == TransitionState.PENDING:
+                    break
+                cls.__transitions.popitem(last=False)
+        cls.__executor.submit(cls.__escalate, transition, process, on_done)
+        return transition
+
+    @classmethod
+    def transition(cls, transition_id: str) -> Optional[Transition]:
+        with cls.__lock:
+            return cls.__transitions.get(transition_id)
+
+    @classmethod
+    def pending(cls, stack: str) -> Optional[Transition]:
+        with cls.__lock:
+            for transition in cls.__transitions.values():
+                if transition.stack == stack and transition.state == TransitionState.PENDING:
+                    return transition
+        return None
+
+    @staticmethod
+    def __signal_group(transition: Transition, process: Process, sig: signal.Signals) -> None:
+        # children are started in their own session, so the launch pid is also the process group id
+        try:
+            os.killpg(process.pid, sig)
+            transition.signals.append(sig.name)
+        except ProcessLookupError:
+            pass
+
+    @staticmethod
+    def __group_alive(pgid: int) -> bool:
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @classmethod
+    def __escalate(cls, transition: Transition, process: Process,
+                   on_done: Optional[Callable[[Transition], None]]) -> None:
+        sigint_timeout = float(config.get('stop_sigint_timeout', 15))
+        sigterm_timeout = float(config.get('stop_sigterm_timeout', 5))
+        try:
+            for sig, timeout in ((signal.SIGINT, sigint_timeout), (signal.SIGTERM, sigterm_timeout)):
+                if process.poll() is not None:
+                    break
+                cls.__signal_group(transition, process, sig)
+                try:
+                    process.wait(timeout=timeout)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+            if process.poll() is None:
+                cls.__signal_group(transition, process, signal.SIGKILL)
+                process.wait()
+            # ros2 launch can exit before the nodes it spawned; give stragglers in the group a grace period
+            if not transition.signals and cls.__group_alive(process.pid):
+                # the launch died on its own and its orphaned nodes were never asked to shut down
+                cls.__signal_group(transition, process, signal.SIGINT)
+            deadline = time.monotonic() + sigterm_timeout
+            while cls.__group_alive(process.pid) and time.monotonic() < deadline:
+                time.sleep(0.1)
+            if cls.__group_alive(process.pid):
+                cls.__signal_group(transition, process, signal.SIGKILL)
+            transition.returncode = process.returncode
+            transition.state = TransitionState.DONE
+        except Exception as e:
+            transition.error = str(e)
+            transition.state = TransitionState.FAILED
+        finally:
+            transition.finished = time.time()
+            if on_done is not None:
+                try:
+                    on_done(transition)
+                except Exception as e:
+                    transition.error = transition.error or str(e)
+            EventBus.publish('transition', transition.to_dict())
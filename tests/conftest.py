@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import pytest
+import yaml
+from aiohttp.test_utils import TestClient, TestServer
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+from load import PASSWORD, USER, basic, prepare  # noqa: E402
+
+# the app reads its appconfig, database and directories at import, so the scratch robot of the load benchmark
+# (synthetic maps, stub ros2 on PATH, own database, run and log directories) is set up before any test imports it
+ROOT = tempfile.mkdtemp(prefix='robot-api-tests-')
+ENV, MAPS = prepare(ROOT, argparse.Namespace(maps=3, seed=0, launch_service=False, launch_startup=0.1,
+                                             launch_shutdown=0.05, save_delay=0.1))
+with open(ENV['ROBOT_API_CONFIG']) as file:
+    APPCONFIG = yaml.safe_load(file)
+# stack resources are sampled often enough for a test to see a few samples
+APPCONFIG['resources_interval'] = 0.1
+with open(ENV['ROBOT_API_CONFIG'], 'w') as file:
+    yaml.safe_dump(APPCONFIG, file)
+os.environ.update(ENV)
+# registered before the app's own exit handlers (metrics flush), so it runs after them
+atexit.register(shutil.rmtree, ROOT, True)
+TIMEOUT = 15.0
+
+
+def pytest_configure(config):
+    # the app still uses the pydantic v1 API throughout
+    config.addinivalue_line('filterwarnings', 'ignore::pydantic.PydanticDeprecatedSince20')
+    # flask 2.2's test client on werkzeug 2.3
+    config.addinivalue_line('filterwarnings', "ignore:'werkzeug.urls.*:DeprecationWarning")
+
+
+def wait_for(condition, timeout: float = TIMEOUT, interval: float = 0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(interval)
+    raise AssertionError("timed out waiting for a condition")
+
+
+class AioClient:
+    # the aiohttp server on a loop of its own, called from the synchronous tests like the Flask test client
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.run(self.open())
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(TIMEOUT)
+
+    async def open(self) -> TestClient:
+        from aioserver import create_app
+        client = TestClient(TestServer(create_app()))
+        await client.start_server()
+        return client
+
+    async def fetch(self, method: str, path: str, **kwargs) -> tuple:
+        async with self.client.request(method, path, **kwargs) as response:
+            return response.status, response.headers, await response.read()
+
+    def open_url(self, method: str, path: str, **kwargs) -> tuple:
+        return self.run(self.fetch(method, path, **kwargs))
+
+    async def shutdown(self) -> None:
+        await self.client.close()
+        # streams whose client went away end on their next write, a heartbeat away
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self) -> None:
+        self.run(self.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+@pytest.fixture(scope='module')
+def aio(app):
+    aio_client = AioClient()
+    yield aio_client
+    aio_client.close()
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def headers():
+    return {'Authorization': basic(USER, PASSWORD)}
+
+
+@pytest.fixture(scope='session')
+def maps_dir():
+    return os.path.join(ROOT, 'maps')
+
+
+@pytest.fixture(scope='session')
+def maps():
+    return MAPS
+
+
+@pytest.fixture
+def stacks_off(app, client, headers):
+    # stops whatever a test started and waits until the stacks have exited
+    yield
+    from supervisor import Supervisor
+    transitions = client.post('/api/bringup/stop', headers=headers).get_json()['data']['transitions']
+    for transition in transitions:
+        wait_for(lambda: Supervisor.transition(transition['id']).state.value != 'PENDING')
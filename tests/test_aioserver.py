@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from aioserver import BRIDGE_THREADS
+from conftest import TIMEOUT, wait_for
+from control import Control
+from launcher import Launcher, LaunchState
+
+
+async def first_event(aio, path: str, headers: dict) -> str:
+    async with aio.client.get(path, headers=headers) as response:
+        assert response.status == 200
+        return (await response.content.readuntil(b'\n\n')).decode()
+
+
+def test_status_while_the_launcher_is_busy(aio, headers):
+    # a start waiting on the launch service holds the launcher lock
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with Launcher._Launcher__lock:
+            held.set()
+            release.wait(TIMEOUT)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        started = time.monotonic()
+        for path in ('/', '/api/bringup/state'):
+            assert aio.open_url('GET', path, headers=headers)[0] == 200
+        assert aio.run(first_event(aio, '/api/events', headers)).startswith('event: snapshot')
+        assert time.monotonic() - started < TIMEOUT / 5
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_log_followers_hold_no_thread(aio, client, headers, stacks_off):
+    assert client.post('/api/bringup/start', headers=headers).status_code == 200
+    wait_for(lambda: os.path.isfile(Launcher.log_file('bringup', 'output'))
+             and os.path.getsize(Launcher.log_file('bringup', 'output')) > 0)
+
+    async def follow_then_call() -> int:
+        followers = []
+        try:
+            for _ in range(BRIDGE_THREADS + 8):
+                response = await aio.client.get('/api/logs/bringup/output?follow=true&offset=0', headers=headers)
+                followers.append(response)
+                assert response.status == 200
+                assert (await response.content.readuntil(b'\n\n')).startswith(b'id: ')
+            # a route that runs the Flask app still gets a thread
+            status, _, _ = await aio.fetch('GET', '/api/logs/bringup/runs', headers=headers)
+            return status
+        finally:
+            for response in followers:
+                response.close()
+    assert aio.run(follow_then_call()) == 200
+
+
+def test_control_is_relayed_to_the_leader(aio, headers, monkeypatch, stacks_off):
+    # this worker as one that doesn't own the stacks; the Flask app behind the leader socket still does
+    monkeypatch.setattr(Control, 'is_leader', lambda: False)
+    remote = []
+    monkeypatch.setattr(Control, 'forwarded', lambda request: remote.append(request.remote_addr) and False)
+    status, _, _ = aio.open_url('POST', '/api/bringup/start', headers=headers)
+    assert status == 200 and Launcher.state == LaunchState.BRINGUP
+    assert remote == ['<local>']
+    assert aio.run(first_event(aio, '/api/events', headers)).startswith('event: snapshot')
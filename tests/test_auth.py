@@ -0,0 +1,30 @@
+import uuid
+from load import basic
+
+
+def test_recreated_user_is_cached_after_the_revocation(client, headers):
+    username, password = f"user_{uuid.uuid4().hex[:8]}", 'secret'
+    user_headers = {'Authorization': basic(username, password)}
+
+    def register() -> None:
+        response = client.post('/api/user/register', headers=headers,
+                               json={'username': username, 'password': password, 'role': 'admin'})
+        assert response.status_code == 201
+
+    def stats() -> dict:
+        return client.get('/api/user/authcache', headers=headers).get_json()['data']
+
+    register()
+    assert client.get('/', headers=user_headers).status_code == 200
+    response = client.delete('/api/user/delete', headers=headers, json={'username': username})
+    assert response.get_json()['message'] == 'deleted user'
+    assert client.get('/', headers=user_headers).status_code == 401
+
+    register()
+    assert client.get('/', headers=user_headers).status_code == 200
+    before = stats()
+    for _ in range(3):
+        assert client.get('/', headers=user_headers).status_code == 200
+    after = stats()
+    # the admin's own stats requests are hits too
+    assert after['misses'] == before['misses'] and after['hits'] - before['hits'] == 4
@@ -0,0 +1,32 @@
+import os
+import threading
+import time
+import uuid
+import mapimage
+from catalog import MapCatalog
+from conftest import TIMEOUT, wait_for
+from synthmaps import write_map
+
+
+def test_png_is_made_in_the_background(maps_dir, monkeypatch):
+    release = threading.Event()
+    convert_maps = mapimage.convert_maps
+
+    def held_convert_maps(pairs):
+        release.wait(TIMEOUT)
+        return convert_maps(pairs)
+
+    monkeypatch.setattr(mapimage, 'convert_maps', held_convert_maps)
+    name = f"imported_{uuid.uuid4().hex[:8]}"
+    write_map(os.path.join(maps_dir, name), 300, 200, seed=3, png=False)
+    MapCatalog.invalidate()
+
+    started = time.perf_counter()
+    entry = MapCatalog.get(name)
+    assert time.perf_counter() - started < TIMEOUT / 2
+    assert entry is not None and 'png' not in entry.mtimes
+    assert not os.path.exists(entry.png)
+
+    release.set()
+    entry = wait_for(lambda: (lambda entry: entry if 'png' in entry.mtimes else None)(MapCatalog.get(name)))
+    assert os.path.isfile(entry.png) and entry.sizes['png'] == os.path.getsize(entry.png)
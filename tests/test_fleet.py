@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import time
+from typing import List, Optional, Sequence
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from fleet import Fleet
+from utils import config
+
+# what each stand-in robot waits before answering; the fan-out answers in about one of these, not the sum
+DELAY = 0.3
+TIMEOUT = 1.0
+
+
+class StandIn:
+    # a robot API that echoes what it was sent in the usual envelope, or fails with `status`; credentials are the
+    # robot's own ones in appconfig 'fleet'
+    def __init__(self, name: str, status: int = 200, **credentials):
+        self.name = name
+        self.status = status
+        self.credentials = credentials
+        self.calls: List[dict] = []
+        self.server: Optional[TestServer] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        call = {'robot': self.name, 'method': request.method, 'path': request.path, 'query': dict(request.query),
+                'authorization': request.headers.get('Authorization'), 'body': await request.text()}
+        self.calls.append(call)
+        await asyncio.sleep(DELAY)
+        failed = self.status >= 400
+        return web.json_response({'error': failed, 'message': 'robot failed' if failed else None, 'data': call},
+                                 status=self.status)
+
+    async def start(self) -> dict:
+        application = web.Application()
+        application.router.add_route('*', '/{path:.*}', self.handle)
+        self.server = TestServer(application)
+        await self.server.start_server()
+        return {'name': self.name, 'url': str(self.server.make_url('')), **self.credentials}
+
+
+@contextlib.asynccontextmanager
+async def gateway(monkeypatch, robots: List[StandIn], others: Sequence[dict] = ()):
+    # the aiohttp server with appconfig 'fleet' set to the stand-in robots, then the others
+    monkeypatch.setitem(config, 'fleet', [await robot.start() for robot in robots] + list(others))
+    monkeypatch.setitem(config, 'fleet_timeout', TIMEOUT)
+    monkeypatch.setattr(Fleet, '_Fleet__robots', None)
+    from aioserver import create_app
+    client = TestClient(TestServer(create_app()))
+    await client.start_server()
+    try:
+        yield client
+    finally:
+        await client.close()
+        for robot in robots:
+            await robot.server.close()
+        monkeypatch.setattr(Fleet, '_Fleet__robots', None)
+
+
+async def call(client: TestClient, method: str, path: str, headers: dict, **kwargs) -> tuple:
+    started = time.perf_counter()
+    async with client.request(method, path, headers=headers, **kwargs) as response:
+        body = await response.json() if response.content_type == 'application/json' else await response.text()
+        return response.status, body, time.perf_counter() - started
+
+
+async def black_hole() -> tuple:
+    # accepts connections and never answers
+    connections = []
+    server = await asyncio.start_server(lambda reader, writer: connections.append(writer), '127.0.0.1', 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+async def unreachable() -> str:
+    server = await asyncio.start_server(lambda reader, writer: None, '127.0.0.1', 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    server.close()
+    await server.wait_closed()
+    return url
+
+
+def test_fan_out(monkeypatch, headers):
+    async def scenario():
+        robots = [StandIn(f"robot{index}") for index in range(4)]
+        async with gateway(monkeypatch, robots) as client:
+            status, body, _ = await call(client, 'GET', '/api/fleet', headers)
+            assert status == 200 and [robot['name'] for robot in body['data']['robots']] == \
+                [robot.name for robot in robots]
+
+            status, body, elapsed = await call(client, 'POST', '/api/fleet/mapping/start?slam_method=x&timeout=5',
+                                               headers, json={'slam_method': 'slam_toolbox'})
+            assert status == 200 and not body['error'] and body['data']['failed'] == []
+            assert elapsed < DELAY * 2
+            for robot in robots:
+                result = body['data']['robots'][robot.name]
+                assert result['status'] == 200 and result['data']['robot'] == robot.name
+                assert robot.calls == [result['data']]
+                # the fleet's own parameters stay with the gateway
+                assert result['data']['path'] == '/api/mapping/start' and result['data']['query'] == \
+                    {'slam_method': 'x'}
+                assert result['data']['body'] == '{"slam_method": "slam_toolbox"}'
+
+            status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state?robots=robot1,robot3', headers)
+            assert status == 200 and sorted(body['data']['robots']) == ['robot1', 'robot3']
+            assert [len(robot.calls) for robot in robots] == [1, 2, 1, 2]
+
+            status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state?robots=robot0,nobody', headers)
+            assert status == 404 and body['message'] == "robot 'nobody' isn't in the fleet"
+            assert [len(robot.calls) for robot in robots] == [1, 2, 1, 2]
+    asyncio.run(scenario())
+
+
+def test_partial_failure(monkeypatch, headers):
+    async def scenario():
+        robots = [StandIn('robot0'), StandIn('robot1'), StandIn('broken', status=500)]
+        hole, hole_url = await black_hole()
+        others = [{'name': 'unreachable', 'url': await unreachable()}, {'name': 'black_hole', 'url': hole_url}]
+        try:
+            async with gateway(monkeypatch, robots, others) as client:
+                status, body, elapsed = await call(client, 'GET', '/api/fleet/bringup/state', headers)
+                # one timeout for the whole fleet, and the robots that answered still count
+                assert status == 200 and body['error']
+                assert TIMEOUT <= elapsed < TIMEOUT + DELAY * 2
+                assert body['data']['failed'] == ['black_hole', 'broken', 'unreachable']
+                assert body['message'] == "3 of 5 robots failed"
+                results = body['data']['robots']
+                assert not results['robot0']['error'] and not results['robot1']['error']
+                assert results['broken']['status'] == 500 and results['broken']['message'] == 'robot failed'
+                assert results['black_hole']['status'] is None and \
+                    results['black_hole']['message'] == f"no response within {TIMEOUT}s"
+                assert results['unreachable']['status'] is None and results['unreachable']['message']
+
+                status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state?robots=broken,unreachable',
+                                             headers)
+                assert status == 502 and body['data']['failed'] == ['broken', 'unreachable']
+        finally:
+            hole.close()
+    asyncio.run(scenario())
+
+
+def test_authorization_pass_through(monkeypatch, headers):
+    async def scenario():
+        robots = [StandIn('caller'), StandIn('own_user', username='robot', password='secret'),
+                  StandIn('own_token', token='robot-token')]
+        async with gateway(monkeypatch, robots) as client:
+            status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state', headers)
+            assert status == 200
+            authorizations = {name: result['data']['authorization']
+                              for name, result in body['data']['robots'].items()}
+            assert authorizations == {'caller': headers['Authorization'],
+                                      'own_user': aiohttp.BasicAuth('robot', 'secret').encode(),
+                                      'own_token': 'Bearer robot-token'}
+
+            status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state', {})
+            assert status == 401
+            status, body, _ = await call(client, 'GET', '/api/fleet/bringup/state',
+                                         {'Authorization': aiohttp.BasicAuth('bench', 'wrong').encode()})
+            assert status == 401
+            assert [len(robot.calls) for robot in robots] == [1, 1, 1]
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('timeout', ['soon', '-'])
+def test_bad_timeout(monkeypatch, headers, timeout):
+    async def scenario():
+        robot = StandIn('robot0')
+        async with gateway(monkeypatch, [robot]) as client:
+            status, body, _ = await call(client, 'GET', f'/api/fleet/bringup/state?timeout={timeout}', headers)
+            assert status == 400 and body['message'] == 'wrong request'
+            assert robot.calls == []
+    asyncio.run(scenario())
@@ -0,0 +1,55 @@
+import threading
+from conftest import wait_for
+from supervisor import process_alive
+
+CONCURRENCY = 8
+
+
+def concurrently(app, method: str, path: str, headers: dict, json=None) -> list:
+    # like the threaded forwarding server of the leader: every request on its own thread, released at once
+    barrier = threading.Barrier(CONCURRENCY)
+    responses = []
+
+    def call():
+        client = app.test_client()
+        barrier.wait()
+        response = client.open(path, method=method, headers=headers, json=json)
+        responses.append((response.status_code, response.get_json()))
+
+    threads = [threading.Thread(target=call) for _ in range(CONCURRENCY)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_bringup_starts_one_stack(app, client, headers, stacks_off):
+    responses = concurrently(app, 'POST', '/api/bringup/start', headers)
+    assert all(status == 200 for status, _ in responses)
+    pids = {body['data']['pid'] for _, body in responses if 'pid' in body['data']}
+    assert len(pids) == 1
+    pid = pids.pop()
+
+    body = client.post('/api/bringup/stop', headers=headers).get_json()
+    assert [transition['pid'] for transition in body['data']['transitions']] == [pid]
+    wait_for(lambda: not process_alive(pid))
+
+
+def test_concurrent_mapping_starts_one_stack(app, client, headers, stacks_off):
+    assert client.post('/api/bringup/start', headers=headers).status_code == 200
+    responses = concurrently(app, 'POST', '/api/mapping/start', headers, json={'slam_method': 'slam_toolbox'})
+    started = [body for status, body in responses if status == 200]
+    assert len(started) == 1
+    assert all(status in (400, 409) for status, _ in responses if status != 200)
+    assert client.get('/api/mapping/state', headers=headers).get_json()['data']['state'] == 'RUNNING'
+
+
+def test_concurrent_navigation_starts_one_stack(app, client, headers, maps, stacks_off):
+    assert client.post('/api/bringup/start', headers=headers).status_code == 200
+    responses = concurrently(app, 'POST', '/api/navigation/start', headers, json={'map_name': maps[0]})
+    started = [body for status, body in responses if status == 200]
+    assert len(started) == 1
+    assert all(status in (400, 409) for status, _ in responses if status != 200)
+    assert client.get('/api/navigation/state', headers=headers).get_json()['data']['pid'] == \
+        started[0]['data']['pid']
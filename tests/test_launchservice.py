@@ -0,0 +1,66 @@
+import os
+import signal
+import pytest
+import launchservice
+from conftest import wait_for
+from launchservice import LaunchService, ServiceProcess
+
+
+@pytest.fixture
+def launch(tmp_path):
+    # stub launches of the warm helper (LAUNCH_SERVICE_RUNTIME=stub), interrupted after the test
+    processes = []
+
+    def start(name: str = 'bringup') -> ServiceProcess:
+        process = LaunchService.launch(name, 'amr_bench', 'bringup_launch.py', ['use_sim_time:=false'],
+                                       str(tmp_path / f"{name}.out"), str(tmp_path / f"{name}.err"))
+        processes.append(process)
+        return process
+
+    assert LaunchService.start() == 'stub'
+    yield start
+    for process in processes:
+        if process.poll() is None:
+            os.killpg(process.pid, signal.SIGKILL)
+            wait_for(lambda: process.poll() is not None)
+
+
+def test_start_status_stop(launch, tmp_path):
+    process = launch()
+    assert process.poll() is None
+    status = wait_for(lambda: (lambda status: status if status['first_node'] else None)(
+        LaunchService.status(process.pid)))
+    assert status['package'] == 'amr_bench' and status['arguments'] == ['use_sim_time:=false']
+    assert status['requested'] <= status['loaded'] <= status['first_node']
+    assert process.pid in [launch['pid'] for launch in LaunchService.info()['launches']]
+
+    os.killpg(process.pid, signal.SIGINT)
+    wait_for(lambda: process.poll() is not None)
+    assert process.returncode == 0
+    assert LaunchService.status(process.pid)['exited'] is not None
+    assert 'process has finished cleanly' in (tmp_path / 'bringup.out').read_text()
+
+
+def test_unknown_pid_has_exited(launch):
+    process = launch()
+    service = LaunchService.info()['pid']
+    status = LaunchService.status(os.getpid())
+    assert status['unknown'] and status['service'] == service
+    # what its own helper doesn't know has been reaped and dropped by it
+    assert ServiceProcess(os.getpid(), service).poll() == -1
+    # what an earlier helper started is only observable by its liveness
+    assert ServiceProcess(process.pid, -1).poll() is None
+
+
+def test_hung_helper_is_replaced(launch, monkeypatch):
+    process = launch()
+    service = LaunchService.info()['pid']
+    monkeypatch.setattr(launchservice, 'CALL_TIMEOUT', 0.5)
+    os.kill(service, signal.SIGSTOP)
+    assert LaunchService.status(process.pid) is None
+    wait_for(lambda: LaunchService.info()['pid'] not in (None, service))
+    # the launch outlived its helper and is still seen running, then exited
+    assert process.poll() is None
+    os.killpg(process.pid, signal.SIGINT)
+    wait_for(lambda: process.poll() is not None)
+    assert process.returncode == -1
@@ -0,0 +1,99 @@
+import io
+import os
+import uuid
+import zipfile
+import numpy as np
+import pytest
+import yaml
+from catalog import MapCatalog
+from mapimage import analyze_map, compact_map, crop_unknown, read_png, to_png_depth
+from synthmaps import write_map
+
+META = {'mode': 'trinary', 'resolution': 0.05, 'origin': [-1.5, -1.0, 0.0], 'negate': 0, 'occupied_thresh': 0.65,
+        'free_thresh': 0.196}
+
+
+def cell_position(origin: list, height: int, row: int, col: int) -> tuple:
+    # bottom-left corner of a cell in map coordinates; image row 0 is the top of the map
+    return origin[0] + col * META['resolution'], origin[1] + (height - 1 - row) * META['resolution']
+
+
+def known_area(maxval: int, shape=(40, 60)) -> np.ndarray:
+    # unknown around a free block with walls and one obstacle, in the value range of maxval
+    image = np.full(shape, round(maxval * 0.8) - 1, dtype=np.uint16 if maxval > 255 else np.uint8)
+    image[10:20, 30:45] = 0
+    image[11:19, 31:44] = maxval
+    image[14, 36] = 0
+    return image
+
+
+def write_pgm(map_path: str, image: np.ndarray, maxval: int) -> str:
+    with open(f"{map_path}.pgm", 'wb') as file:
+        file.write(b'P5\n# CREATOR: tests\n%d %d\n%d\n' % (image.shape[1], image.shape[0], maxval))
+        file.write(image.astype('>u2' if maxval > 255 else 'u1').tobytes())
+    with open(f"{map_path}.yaml", 'w') as file:
+        yaml.safe_dump({'image': f"{os.path.basename(map_path)}.pgm", **META}, file, sort_keys=False)
+    return f"{map_path}.yaml"
+
+
+def test_crop_unknown_keeps_cells_in_place():
+    image = known_area(255)
+    cropped, origin = crop_unknown(image, 255, META, margin=2)
+    assert cropped.shape == (14, 19)
+    assert cropped[14 - 8, 36 - 28] == 0
+    assert cell_position(origin, 14, 14 - 8, 36 - 28) == pytest.approx(cell_position(META['origin'], 40, 14, 36))
+    assert cell_position(origin, 14, 13, 0) == pytest.approx(cell_position(META['origin'], 40, 21, 28))
+
+
+def test_crop_unknown_margin_stops_at_the_edges():
+    image = known_area(255)
+    cropped, origin = crop_unknown(image, 255, META, margin=100)
+    assert cropped.shape == image.shape and origin == META['origin']
+    unknown = np.full((8, 8), 205, dtype=np.uint8)
+    cropped, origin = crop_unknown(unknown, 255, META, margin=0)
+    assert cropped is unknown and origin == META['origin']
+
+
+@pytest.mark.parametrize('maxval, depth', [(255, np.uint8), (100, np.uint8), (1000, np.uint16), (65535, np.uint16)])
+def test_compact_map_round_trip(tmp_path, maxval, depth):
+    image = known_area(maxval)
+    map_yaml = write_pgm(str(tmp_path / 'map'), image, maxval)
+    before = analyze_map(str(tmp_path / 'map.pgm'), dict(META))
+
+    result = compact_map(map_yaml, margin=3)
+    assert result == {'size': [40, 60], 'cropped': [16, 21],
+                      'origin': pytest.approx([-1.5 + 27 * 0.05, -1.0 + 17 * 0.05, 0.0])}
+    assert sorted(os.listdir(tmp_path)) == ['map.png', 'map.yaml']
+    with open(map_yaml) as file:
+        meta = yaml.safe_load(file)
+    assert meta['image'] == 'map.png' and meta['origin'] == result['origin']
+
+    png, png_maxval = read_png(str(tmp_path / 'map.png'))
+    assert png.dtype == depth and png_maxval == np.iinfo(depth).max
+    assert np.array_equal(png, to_png_depth(image[7:23, 27:48], maxval))
+    if maxval == 100:
+        assert png[14 - 7, 36 - 27] == 0 and png[12 - 7, 32 - 27] == 255 and png[0, 0] == (79 * 255 + 50) // 100
+    # the same cells are free, occupied and where they were
+    after = analyze_map(str(tmp_path / 'map.png'), meta)
+    assert after['cells']['free'] == before['cells']['free']
+    assert after['cells']['occupied'] == before['cells']['occupied']
+    for key in ('min_x', 'max_x', 'min_y', 'max_y'):
+        assert after['bounding_box'][key] == pytest.approx(before['bounding_box'][key])
+
+
+def test_compact_map_in_catalog_and_archive(client, headers, maps_dir):
+    name = f"compact_{uuid.uuid4().hex[:8]}"
+    write_map(os.path.join(maps_dir, name), 200, 160, seed=1, png=False)
+    compact_map(os.path.join(maps_dir, f"{name}.yaml"), margin=5)
+    MapCatalog.invalidate(name)
+
+    entry = MapCatalog.get(name)
+    assert entry.pgm == entry.png == os.path.join(maps_dir, f"{name}.png")
+    assert not os.path.exists(os.path.join(maps_dir, f"{name}.pgm"))
+    response = client.get(f'/api/mapping/getmap?map_name={name}', headers=headers)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert sorted(archive.namelist()) == [f"{name}.png", f"{name}.yaml"]
+        assert yaml.safe_load(archive.read(f"{name}.yaml"))['image'] == f"{name}.png"
+        with open(entry.png, 'rb') as file:
+            assert archive.read(f"{name}.png") == file.read()
@@ -0,0 +1,61 @@
+import pytest
+from utils import config
+
+# the map server is the ros2 stub on PATH: 'ros2 service call' answers LoadMap after BENCH_LOAD_DELAY with
+# BENCH_LOAD_RESULT, or with the result for whether the map file exists
+
+
+@pytest.fixture
+def navigating(client, headers, maps, stacks_off):
+    assert client.post('/api/bringup/start', headers=headers).status_code == 200
+    response = client.post('/api/navigation/start', headers=headers, json={'map_name': maps[0]})
+    assert response.status_code == 200
+    return maps[0]
+
+
+def switch(client, headers, map_name: str):
+    response = client.post('/api/navigation/switch_map', headers=headers, json={'map_name': map_name})
+    return response.status_code, response.get_json()
+
+
+def navigation_map(client, headers) -> str:
+    return client.get('/api/navigation/state', headers=headers).get_json()['data']['map']
+
+
+def test_switch(client, headers, maps, navigating):
+    status, body = switch(client, headers, maps[1])
+    assert status == 200
+    assert body['data']['map'] == maps[1] and body['data']['previous'] == navigating
+    assert body['data']['latency'] >= body['data']['load_latency'] > 0
+    assert navigation_map(client, headers) == maps[1]
+
+
+@pytest.mark.parametrize('result, message', [('3', "map server refused"), ('fail', "service call failed")])
+def test_service_failure_keeps_the_map(client, headers, maps, navigating, monkeypatch, result, message):
+    monkeypatch.setenv('BENCH_LOAD_RESULT', result)
+    status, body = switch(client, headers, maps[1])
+    assert status == 502
+    assert message in body['message'] and body['data']['map'] == navigating
+    assert navigation_map(client, headers) == navigating
+
+
+def test_timeout(client, headers, maps, navigating, monkeypatch):
+    monkeypatch.setenv('BENCH_LOAD_DELAY', '5')
+    monkeypatch.setitem(config, 'map_switch_timeout', 0.3)
+    status, body = switch(client, headers, maps[1])
+    assert status == 502
+    assert body['message'] == "map server didn't answer in time"
+    assert navigation_map(client, headers) == navigating
+
+
+def test_unknown_map(client, headers, maps, navigating):
+    status, body = switch(client, headers, 'nowhere')
+    assert status == 404
+    assert set(maps) <= set(body['data']['existing_maps'])
+    assert navigation_map(client, headers) == navigating
+
+
+def test_switch_needs_navigation(client, headers, maps, stacks_off):
+    status, body = switch(client, headers, maps[1])
+    assert status == 400
+    assert body['message'] == "first launch navigation on '/api/navigation/start'"
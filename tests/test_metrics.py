@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import pytest
+from control import Control
+from metrics import FAMILIES, REQUEST_SECONDS, metrics_dir
+from tokens import ACCESS_TOKEN, issue_token
+from utils import config
+
+SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+def scrape(client, headers) -> dict:
+    # {(name, labels): value}, after checking the exposition format
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 200
+    assert response.content_type == 'text/plain; version=0.0.4; charset=utf-8'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('#'):
+            assert re.match(r'^# (HELP \w+ .+|TYPE \w+ histogram)$', line)
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        samples[(name, labels)] = float(value)
+    return samples
+
+
+def series(samples: dict, name: str, route: str) -> dict:
+    return {key: value for key, value in samples.items() if key[0] == name and f'route="{route}"' in key[1]}
+
+
+def worker_file(pid: int, route: str, count: int) -> None:
+    counts = [0] * (len(FAMILIES[REQUEST_SECONDS][1]) + 1)
+    counts[-1] = count
+    with open(os.path.join(metrics_dir(), f"{pid}.json"), 'w') as file:
+        json.dump([[REQUEST_SECONDS, [['method', 'GET'], ['route', route], ['status', '200']], counts, 60.0 * count]],
+                  file)
+
+
+def test_request_histogram(client, headers):
+    count = (f'{REQUEST_SECONDS}_count', 'method="GET",route="/api/bringup/state",status="200"')
+    before = scrape(client, headers).get(count, 0)
+    for _ in range(3):
+        client.get('/api/bringup/state', headers=headers)
+    samples = scrape(client, headers)
+    assert samples[count] - before == 3
+    buckets = list(series(samples, f'{REQUEST_SECONDS}_bucket', '/api/bringup/state').values())
+    assert len(buckets) == len(FAMILIES[REQUEST_SECONDS][1]) + 1
+    assert buckets == sorted(buckets) and buckets[-1] == samples[count]
+
+
+def test_other_workers_are_summed(client, headers):
+    # a live worker is read from its file, an exited one is folded in once and kept
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    worker_file(os.getppid(), '/live-worker', 2)
+    worker_file(exited.pid, '/exited-worker', 5)
+    try:
+        for _ in range(2):
+            samples = scrape(client, headers)
+            assert list(series(samples, f'{REQUEST_SECONDS}_count', '/live-worker').values()) == [2]
+            assert list(series(samples, f'{REQUEST_SECONDS}_count', '/exited-worker').values()) == [5]
+        assert not os.path.exists(os.path.join(metrics_dir(), f"{exited.pid}.json"))
+    finally:
+        os.remove(os.path.join(metrics_dir(), f"{os.getppid()}.json"))
+
+
+def test_profile_of_a_request(client, headers, monkeypatch):
+    monkeypatch.setitem(config, 'profiling', True)
+    response = client.get('/api/bringup/state', headers={**headers, 'X-Profile': '1'})
+    profile = client.get(f"/api/profiles/{response.headers['X-Profile-Id']}", headers=headers)
+    assert profile.status_code == 200
+
+
+def test_profiler_stops_when_the_route_raises(client, headers, monkeypatch):
+    monkeypatch.setitem(config, 'profiling', True)
+    monkeypatch.setattr(Control, 'launcher', lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        client.get('/', headers={**headers, 'X-Profile': '1'})
+    assert not [thread for thread in threading.enumerate() if thread.name == 'profiler']
+
+
+def test_only_admins_are_profiled(app, client, headers, monkeypatch):
+    monkeypatch.setitem(config, 'profiling', True)
+    token = issue_token(app.config['SECRET_KEY'], 'bench', ['user'], ACCESS_TOKEN, app.config['ACCESS_TOKEN_LIFETIME'])
+    for caller, status in (({}, 401), ({'Authorization': f"Bearer {token}"}, 200)):
+        response = client.get('/', headers={**caller, 'X-Profile': '1'})
+        assert response.status_code == status and 'X-Profile-Id' not in response.headers
+    assert 'X-Profile-Id' in client.get('/', headers={**headers, 'X-Profile': '1'}).headers
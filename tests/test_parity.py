@@ -0,0 +1,69 @@
+import pytest
+from werkzeug.http import parse_options_header
+
+
+@pytest.fixture
+def both(client, aio):
+    # the same request on both servers: (status, headers, body) of Flask, then of aiohttp
+    def call(method: str, path: str, headers: dict = None, data=None):
+        flask = client.open(path, method=method, headers=headers, data=data)
+        return (flask.status_code, flask.headers, flask.data), aio.open_url(method, path, headers=headers, data=data)
+    return call
+
+
+def test_status_envelopes_match(both, headers):
+    for path in ('/', '/api/bringup/state', '/api/mapping/state', '/api/navigation/state'):
+        flask, aio = both('GET', path, headers)
+        assert flask[0] == aio[0] == 200
+        assert flask[2] == aio[2]
+
+
+def test_authentication_failures_match(both, headers):
+    for auth in ({}, {'Authorization': 'Basic Ym9ndXM6Ym9ndXM='}):
+        flask, aio = both('GET', '/api/bringup/state', auth)
+        assert flask[0] == aio[0] == 401
+        flask, aio = both('GET', '/api/mapping/getmap?map_name=x', auth)
+        assert flask[0] == aio[0] == 401
+
+
+def test_getmap_errors_match(both, headers):
+    json_headers = {**headers, 'Content-Type': 'application/json'}
+    for body in ('{"map_name": ', 'null', '{}', '[1, 2]'):
+        flask, aio = both('POST', '/api/mapping/getmap', json_headers, body)
+        assert flask[0] == aio[0] == 400
+        assert flask[2] == aio[2]
+    flask, aio = both('POST', '/api/mapping/getmap', {**headers, 'Content-Type': 'text/plain'}, '{"map_name": "x"}')
+    assert flask[0] == aio[0] == 400
+    assert flask[2] == aio[2]
+    flask, aio = both('POST', '/api/mapping/getmap', json_headers, '{"map_name": "nowhere"}')
+    assert flask[0] == aio[0] == 200
+    assert flask[2] == aio[2]
+
+
+def test_getmap_archive_matches(both, headers, maps):
+    path = f'/api/mapping/getmap?map_name={maps[0]}'
+    # the first request streams and caches the archive, the second one is served from the cache
+    for _ in range(2):
+        flask, aio = both('GET', path, headers)
+        assert flask[0] == aio[0] == 200
+        assert flask[2] == aio[2]
+        for header in ('ETag', 'Last-Modified', 'Content-Type'):
+            assert flask[1][header] == aio[1][header]
+        # send_file leaves a token filename unquoted
+        assert parse_options_header(flask[1]['Content-Disposition']) == \
+            parse_options_header(aio[1]['Content-Disposition'])
+    etag, archive = flask[1]['ETag'], flask[2]
+
+    flask, aio = both('GET', path, {**headers, 'If-None-Match': etag})
+    assert flask[0] == aio[0] == 304
+    assert flask[1]['ETag'] == aio[1]['ETag'] == etag
+
+    flask, aio = both('GET', path, {**headers, 'Range': 'bytes=0-99', 'If-Range': etag})
+    assert flask[0] == aio[0] == 206
+    assert flask[1]['Content-Range'] == aio[1]['Content-Range']
+    assert flask[2] == aio[2] == archive[:100]
+
+    for if_range in ('"an-older-archive"', 'Thu, 01 Jan 1970 00:00:00 GMT'):
+        flask, aio = both('GET', path, {**headers, 'Range': 'bytes=0-99', 'If-Range': if_range})
+        assert flask[0] == aio[0] == 200
+        assert flask[2] == aio[2] == archive
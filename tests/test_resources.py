@@ -0,0 +1,27 @@
+from conftest import wait_for
+from resources import children
+
+
+def bringup_nodes(client, headers) -> dict:
+    response = client.get('/api/robot/resources?stack=bringup&history=true', headers=headers)
+    assert response.status_code == 200
+    return response.get_json()['data']['stacks'].get('bringup', {})
+
+
+def test_stub_stack_is_sampled(client, headers, stacks_off):
+    pid = client.post('/api/bringup/start', headers=headers).get_json()['data']['pid']
+    # the stub launch runs one node, named by its __node:= remapping like a ROS node
+    node = wait_for(lambda: (lambda node: node if node and node['samples'] >= 3 else None)(
+        bringup_nodes(client, headers).get('stub_node')))
+    assert node['pid'] in children(pid)
+    assert node['latest']['rss'] > 0 and node['latest']['threads'] >= 1
+    assert 0 <= node['percentiles']['cpu']['p50'] <= node['percentiles']['cpu']['p99']
+    assert len(node['history']['time']) == node['samples'] == len(node['history']['rss'])
+    assert node['history']['time'] == sorted(node['history']['time'])
+
+
+def test_report_of_one_stack(client, headers):
+    report = client.get('/api/robot/resources?stack=mapping', headers=headers).get_json()['data']
+    assert set(report['stacks']) <= {'mapping'} and report['interval'] == 0.1
+    response = client.get('/api/robot/resources?stack=elsewhere', headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,32 @@
+import logging
+import os
+import uuid
+from conftest import wait_for
+from tiles import TileStore
+
+
+def save(client, headers, map_name: str) -> dict:
+    response = client.post('/api/mapping/savemap', headers=headers, json={'map_name': map_name})
+    assert response.status_code == 202
+    job_id = response.get_json()['data']['job']['id']
+    return wait_for(lambda: (lambda job: job if job['state'] in ('DONE', 'FAILED') else None)(
+        client.get(f'/api/jobs/{job_id}', headers=headers).get_json()['data']['job']))
+
+
+def test_tile_failure_does_not_fail_savemap(client, headers, maps_dir, stacks_off, caplog):
+    assert client.post('/api/bringup/start', headers=headers).status_code == 200
+    assert client.post('/api/mapping/start', headers=headers, json={'slam_method': 'slam_toolbox'}).status_code == 200
+    map_name = f"saved_{uuid.uuid4().hex[:8]}"
+    # a file where the pyramid directory goes, so its build fails
+    os.makedirs(os.path.dirname(TileStore.tiles_dir(map_name)), exist_ok=True)
+    open(TileStore.tiles_dir(map_name), 'w').close()
+
+    with caplog.at_level(logging.WARNING, logger='tiles'):
+        job = save(client, headers, map_name)
+        assert job['state'] == 'DONE'
+        assert [stage['name'] for stage in job['stages']] == ['map_saver', 'convert', 'catalog', 'archive']
+        assert os.path.isfile(os.path.join(maps_dir, f"{map_name}.zip"))
+        response = wait_for(lambda: (lambda response: response if response.status_code != 202 else None)(
+            client.get(f'/api/mapping/tiles/{map_name}', headers=headers)))
+    assert response.status_code == 400
+    assert f"tile pyramid of map {map_name} failed" in caplog.text
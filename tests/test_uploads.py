@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+from uploads import UploadStore
+
+
+def map_archive(maps_dir: str, source: str) -> tuple:
+    # a copy of a synthetic map under a new name
+    name = f"up_{uuid.uuid4().hex[:8]}"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.write(os.path.join(maps_dir, f"{source}.pgm"), f"{name}.pgm")
+        with open(os.path.join(maps_dir, f"{source}.yaml")) as file:
+            archive.writestr(f"{name}.yaml", file.read().replace(source, name))
+    return name, buffer.getvalue()
+
+
+def begin(client, headers, data: bytes, **fields) -> str:
+    response = client.post('/api/mapping/upload', headers=headers,
+                           json={'filename': 'map.zip', 'size': len(data), **fields})
+    assert response.status_code == 201
+    return response.get_json()['data']['upload']['id']
+
+
+class StalledStream(io.BytesIO):
+    # a client that sends nothing until released
+    def __init__(self, data: bytes, release: threading.Event):
+        super().__init__(data)
+        self.release = release
+
+    def read(self, size=-1) -> bytes:
+        self.release.wait()
+        return super().read(size)
+
+    def readinto(self, buffer) -> int:
+        self.release.wait()
+        return super().readinto(buffer)
+
+
+def test_chunked_upload_round_trip(client, headers, maps_dir, maps):
+    name, data = map_archive(maps_dir, maps[0])
+    upload_id = begin(client, headers, data, sha256=hashlib.sha256(data).hexdigest())
+    half = len(data) // 2
+    for offset, chunk in ((0, data[:half]), (half, data[half:])):
+        response = client.put(f'/api/mapping/upload/{upload_id}?offset={offset}', headers=headers, data=chunk)
+        assert response.status_code == 200
+    response = client.put(f'/api/mapping/upload/{upload_id}?offset=0', headers=headers, data=data[:half])
+    assert response.status_code == 409
+    assert response.get_json()['data']['upload']['received'] == len(data)
+
+    response = client.post(f'/api/mapping/upload/{upload_id}/commit', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['data']['maps'] == [name]
+    with open(os.path.join(maps_dir, f"{name}.pgm"), 'rb') as file, \
+            open(os.path.join(maps_dir, f"{maps[0]}.pgm"), 'rb') as source:
+        assert file.read() == source.read()
+    assert client.get(f'/api/mapping/upload/{upload_id}', headers=headers).status_code == 404
+
+
+def test_concurrent_chunks_at_one_offset(app, headers, maps_dir, maps):
+    _, data = map_archive(maps_dir, maps[0])
+    upload_id = begin(app.test_client(), headers, data)
+    barrier = threading.Barrier(6)
+    statuses = []
+
+    def put():
+        client = app.test_client()
+        barrier.wait()
+        statuses.append(client.put(f'/api/mapping/upload/{upload_id}?offset=0', headers=headers,
+                                   data=data).status_code)
+
+    threads = [threading.Thread(target=put) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(statuses) == [200] + [409] * 5
+    assert UploadStore.get(upload_id).received == len(data)
+
+
+def test_stalled_upload_does_not_block_others(app, headers, maps_dir, maps):
+    _, data = map_archive(maps_dir, maps[0])
+    client = app.test_client()
+    stalled_id, other_id = begin(client, headers, data), begin(client, headers, data)
+    release = threading.Event()
+    stalled = threading.Thread(target=lambda: app.test_client().put(
+        f'/api/mapping/upload/{stalled_id}?offset=0', headers=headers, input_stream=StalledStream(data, release)))
+    stalled.start()
+    try:
+        time.sleep(0.1)
+        statuses = []
+        other = threading.Thread(target=lambda: statuses.append(client.put(
+            f'/api/mapping/upload/{other_id}?offset=0', headers=headers, data=data).status_code))
+        other.start()
+        other.join(1.0)
+        assert statuses == [200]
+    finally:
+        release.set()
+        stalled.join()
+    assert UploadStore.get(stalled_id).received == len(data)
+
+
+def test_stale_uploads_expire_when_one_begins(app, client, headers):
+    stale_id = begin(client, headers, b'x' * 10)
+    old = time.time() - app.config['UPLOAD_TTL'].total_seconds() - 60
+    for filename in os.listdir(UploadStore.staging_dir()):
+        if filename.startswith(stale_id):
+            os.utime(os.path.join(UploadStore.staging_dir(), filename), (old, old))
+    begin(client, headers, b'y' * 10)
+    assert UploadStore.get(stale_id) is None
+    assert not [filename for filename in os.listdir(UploadStore.staging_dir()) if filename.startswith(stale_id)]
+
+
+def test_image_of_another_map_needs_overwrite(client, headers, maps_dir, maps):
+    name, _ = map_archive(maps_dir, maps[0])
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr(f"{name}.yaml", f"image: {name}.pgm\n")
+        archive.writestr(f"{maps[1]}.pgm", b'P5\n1 1\n255\n\0')
+    with open(os.path.join(maps_dir, f"{maps[1]}.pgm"), 'rb') as file:
+        image = file.read()
+
+    response = client.post('/api/mapping/loadmap', headers=headers,
+                           data={'map_file': (io.BytesIO(buffer.getvalue()), 'map.zip', 'application/zip')})
+    assert response.status_code == 409
+    assert response.get_json()['message'].startswith(f"maps already exist: {maps[1]},")
+    assert not os.path.exists(os.path.join(maps_dir, f"{name}.yaml"))
+    with open(os.path.join(maps_dir, f"{maps[1]}.pgm"), 'rb') as file:
+        assert file.read() == image
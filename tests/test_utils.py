@@ -0,0 +1,24 @@
+import sys
+import types
+import utils
+
+
+def test_package_share_found_after_a_failed_lookup(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, 'ROS_CACHE_FILE', str(tmp_path / 'ros_packages.json'))
+    monkeypatch.setattr(utils, '_package_shares', {})
+    shares = {}
+
+    def get_package_share_directory(package: str) -> str:
+        if package not in shares:
+            raise LookupError(package)
+        return shares[package]
+
+    monkeypatch.setitem(sys.modules, 'ament_index_python', types.ModuleType('ament_index_python'))
+    monkeypatch.setitem(sys.modules, 'ament_index_python.packages',
+                        types.SimpleNamespace(get_package_share_directory=get_package_share_directory))
+    # not sourced yet
+    assert utils.package_share_directory('late_package') is None
+    shares['late_package'] = str(tmp_path)
+    assert utils.package_share_directory('late_package') == str(tmp_path)
+    del shares['late_package']
+    assert utils.package_share_directory('late_package') == str(tmp_path)
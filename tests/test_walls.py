@@ -0,0 +1,72 @@
+import os
+import uuid
+import numpy as np
+import pytest
+from archive import stream_archive
+from catalog import MapCatalog
+from mapimage import read_pgm
+from synthmaps import write_map
+from walls import VirtualWalls, virtual_name, walls_file
+
+WALL = {'type': 'polyline', 'points': [[-2.0, -2.0], [2.0, 2.0]], 'width': 0.2}
+OTHER = {'type': 'polygon', 'points': [[3.0, -5.0], [5.0, -5.0], [4.0, -3.0]]}
+
+
+@pytest.fixture
+def entry(maps_dir):
+    name = f"walls_{uuid.uuid4().hex[:8]}"
+    write_map(os.path.join(maps_dir, name), 600, 500, seed=2, png=False)
+    MapCatalog.invalidate(name)
+    return MapCatalog.get(name)
+
+
+def virtual_image(entry) -> np.ndarray:
+    return read_pgm(os.path.join(os.path.dirname(entry.pgm), f"{virtual_name(entry.name)}.pgm"))[0]
+
+
+def test_edit_redraws_the_dirty_tiles(entry):
+    first = VirtualWalls.apply(entry, [dict(WALL, id='a')], [])
+    assert first['dirty_tiles'] == first['tiles']
+    virtual_pgm = os.path.join(os.path.dirname(entry.pgm), f"{virtual_name(entry.name)}.pgm")
+    with open(virtual_pgm, 'rb') as file:
+        before = file.read()
+
+    with open(virtual_pgm, 'rb') as registered:
+        second = VirtualWalls.apply(entry, [dict(OTHER, id='b')], [])
+        # whoever has the image open keeps reading the one from before the edit
+        assert registered.read() == before
+    assert second['dirty_tiles'] < second['tiles']
+    patched = virtual_image(entry)
+
+    # the same walls drawn from scratch
+    os.remove(walls_file(entry.name))
+    VirtualWalls.apply(entry, [dict(WALL, id='a'), dict(OTHER, id='b')], [])
+    assert np.array_equal(virtual_image(entry), patched)
+
+    VirtualWalls.apply(entry, [], ['a', 'b'])
+    assert np.array_equal(virtual_image(entry), read_pgm(entry.pgm)[0])
+
+
+def test_unfinished_edit_redraws_everything(entry):
+    VirtualWalls.apply(entry, [dict(WALL, id='a')], [])
+    # what an edit leaves behind when it stops while patching
+    with open(walls_file(entry.name), 'w') as file:
+        file.write('{"map": "%s", "source": null, "walls": []}' % entry.name)
+    result = VirtualWalls.apply(entry, [dict(OTHER, id='b')], [])
+    assert result['dirty_tiles'] == result['tiles']
+    assert [wall['id'] for wall in result['walls']] == ['b']
+
+
+def test_archive_of_a_patched_image_is_not_cached(entry, client, headers):
+    VirtualWalls.apply(entry, [dict(WALL, id='a')], [])
+    virtual = MapCatalog.get(virtual_name(entry.name))
+    map_zip = os.path.join(os.path.dirname(entry.pgm), f"{virtual.name}.zip")
+    for _ in stream_archive(virtual, map_zip):
+        # the image patched while the archive is read
+        stat = os.stat(virtual.pgm)
+        os.utime(virtual.pgm, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert not os.path.exists(map_zip)
+
+    response = client.get(f'/api/mapping/getmap?map_name={virtual.name}', headers=headers)
+    assert response.status_code == 200 and response.data
+    assert os.path.exists(map_zip)
@@ -0,0 +1,41 @@
+import os
+import signal
+import pytest
+from conftest import wait_for
+from launcher import Launcher
+from utils import config
+from watchdog import Watchdog
+
+
+@pytest.fixture
+def watchdog(monkeypatch):
+    monkeypatch.setitem(config, 'watchdog', True)
+    monkeypatch.setitem(config, 'watchdog_backoff', 0.1)
+    Watchdog.start()
+
+
+def bringup_pid(client, headers):
+    data = client.get('/api/bringup/state', headers=headers).get_json()['data']
+    return data['pid'] if data['state'] == 'RUNNING' else None
+
+
+def test_crashed_bringup_is_restarted(client, headers, watchdog, stacks_off):
+    pid = client.post('/api/bringup/start', headers=headers).get_json()['data']['pid']
+    os.kill(pid, signal.SIGKILL)
+    restarted = wait_for(lambda: (bringup_pid(client, headers) or pid) != pid and bringup_pid(client, headers))
+    incident = next(incident for incident in Watchdog.report()['incidents'] if incident['pid'] == pid)
+    assert incident['restarted_pid'] == restarted
+    assert incident['returncode'] == -signal.SIGKILL
+
+
+def test_restart_refused_once_started_again(client, headers, watchdog, stacks_off):
+    pid = client.post('/api/bringup/start', headers=headers).get_json()['data']['pid']
+    client.post('/api/bringup/stop', headers=headers)
+    wait_for(lambda: Launcher.stopping('bringup') is None)
+    newer = client.post('/api/bringup/start', headers=headers).get_json()['data']['pid']
+    client.post('/api/bringup/stop', headers=headers)
+    wait_for(lambda: Launcher.stopping('bringup') is None)
+    # the watchdog only ever restarts the start it saw exit
+    with pytest.raises(ValueError):
+        Launcher.restart('bringup', pid)
+    assert Launcher.restart('bringup', newer) is not None
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from catalog import MapEntry
+from utils import amr_robot_maps, config
+
+TILE_SIZE = 256
+
+
+class TileStore:
+    # a downsampled tile pyramid and thumbnail per map under <maps>/.tiles/<map>, rebuilt whenever the pgm's mtime
+    # or size no longer match the ones it was built from
+    __pool: Optional[ProcessPoolExecutor] = None
+    __builder = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tiles')
+    __building: Dict[str, Future] = {}
+    # map name -> (pgm stamp, error) of the last failed build, so a broken map isn't rebuilt on every request
+    __failed: Dict[str, Tuple[list, str]] = {}
+    __lock = threading.Lock()
+
+    @staticmethod
+    def tiles_dir(map_name: str) -> str:
+        return os.path.join(amr_robot_maps, '.tiles', map_name)
+
+    @staticmethod
+    def source(entry: MapEntry) -> list:
+        return [entry.mtimes.get('pgm'), entry.sizes.get('pgm')]
+
+    @classmethod
+    def pyramid(cls, entry: MapEntry) -> Optional[dict]:
+        try:
+            with open(os.path.join(cls.tiles_dir(entry.name), 'pyramid.json')) as file:
+                pyramid = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return pyramid if pyramid.get('source') == cls.source(entry) else None
+
+    @classmethod
+    def error(cls, entry: MapEntry) -> Optional[str]:
+        failed = cls.__failed.get(entry.name)
+        return failed[1] if failed is not None and failed[0] == cls.source(entry) else None
+
+    @classmethod
+    def schedule(cls, entry: MapEntry) -> Future:
+        with cls.__lock:
+            future = cls.__building.get(entry.name)
+            if future is None or future.done():
+                future = cls.__builder.submit(cls.__build, entry)
+                cls.__building[entry.name] = future
+            return future
+
+    @classmethod
+    def remove(cls, map_name: str) -> None:
+        shutil.rmtree(cls.tiles_dir(map_name), ignore_errors=True)
+
+    @classmethod
+    def __build(cls, entry: MapEntry) -> Optional[dict]:
+        # numpy and Pillow only run in the pool processes
+        from mapimage import build_pyramid
+        with cls.__lock:
+            if cls.__pool is None:
+                cls.__pool = ProcessPoolExecutor(max_workers=int(config.get('tile_workers', 2)))
+        final_dir = cls.tiles_dir(entry.name)
+        tmp_dir = os.path.join(os.path.dirname(final_dir), f".{entry.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            pyramid = cls.__pool.submit(build_pyramid, entry.pgm, tmp_dir, TILE_SIZE).result()
+            pyramid['source'] = cls.source(entry)
+            with open(os.path.join(tmp_dir, 'pyramid.json'), 'w') as file:
+                json.dump(pyramid, file)
+            # swap the whole directory so a tile request never mixes two builds
+            old_dir = f"{tmp_dir}.old"
+            if os.path.isdir(final_dir):
+                os.rename(final_dir, old_dir)
+            os.rename(tmp_dir, final_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            cls.__failed.pop(entry.name, None)
+            return pyramid
+        except (OSError, ValueError) as e:
+            logging.getLogger(__name__).warning("tile pyramid of map %s failed: %s", entry.name, e)
+            cls.__failed[entry.name] = (cls.source(entry), str(e))
+            return None
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
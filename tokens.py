@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+from typing import List, Optional
+import jwt
+from shared import SharedState
+
+ACCESS_TOKEN = 'access'
+REFRESH_TOKEN = 'refresh'
+ALGORITHM = 'HS256'
+
+
+
+def issue_token(secret: str, username: str, roles: List[str], kind: str, lifetime: timedelta) -> str:
+    now = time.time()
+    payload = {'sub': username,
+               'roles': roles,
+               'type': kind,
+               'iat': now,
+               'exp': int(now + lifetime.total_seconds())}
+    token = jwt.encode(payload, secret, algorithm=ALGORITHM)
+    return token.decode() if isinstance(token, bytes) else token
+
+
+def decode_token(secret: str, token: str, kind: str) -> Optional[dict]:
+    try:
+        payload = jwt.decode(token, secret, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    if payload.get('type') != kind or not isinstance(payload.get('sub'), str):
+        return None
+    revoked = revoked_at(payload['sub'])
+    if revoked is not None and payload.get('iat', 0) <= revoked:
+        return None
+    return payload
+
+
+def revoked_at(username: str) -> Optional[float]:
+    # username -> time of deletion, shared by all workers; tokens issued before it are rejected without a DB lookup
+    return SharedState.read().get('revoked', {}).get(username)
+
+
+def revoke_user(username: str) -> None:
+    now = time.time()
+    SharedState.update(lambda state: state.setdefault('revoked', {}).update({username: now}))
@@ -0,0 +1,273 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, Union
+from werkzeug.utils import secure_filename
+from utils import amr_robot_maps
+
+MAP_EXTENSIONS = ('.yaml', '.pgm', '.png')
+MAX_MEMBERS = 8
+COPY_CHUNK = 64 * 1024
+
+
+class MapArchiveError(ValueError):
+    pass
+
+
+class MapExistsError(MapArchiveError):
+    pass
+
+
+def extract_map_archive(source: Union[str, BinaryIO], existing_maps: List[str], overwrite: bool = False,
+                        max_member_size: int = 512 * 1024 * 1024, max_ratio: float = 2000.0) -> List[str]:
+    # validates every member, streams each one into a temp file next to the maps and renames them in at the end
+    with zipfile.ZipFile(source) as archive:
+        members = [info for info in archive.infolist() if not info.is_dir()]
+        if not members:
+            raise MapArchiveError("archive is empty")
+        if len(members) > MAX_MEMBERS:
+            raise MapArchiveError(f"archive has more than {MAX_MEMBERS} files")
+        targets: Dict[str, zipfile.ZipInfo] = {}
+        for info in members:
+            name = secure_filename(os.path.basename(info.filename.replace('\\', '/')))
+            if not name or os.path.splitext(name)[1].lower() not in MAP_EXTENSIONS:
+                raise MapArchiveError(f"unexpected file '{info.filename}' in archive")
+            if name in targets:
+                raise MapArchiveError(f"duplicate file '{name}' in archive")
+            if info.file_size > max_member_size:
+                raise MapArchiveError(f"'{info.filename}' is larger than {max_member_size} bytes")
+            if info.compress_size and info.file_size / info.compress_size > max_ratio:
+                raise MapArchiveError(f"'{info.filename}' compression ratio exceeds {max_ratio}")
+            targets[name] = info
+        map_names = [name.partition('.')[0] for name in targets if name.endswith('.yaml')]
+        if not map_names:
+            raise MapArchiveError("archive contains no map yaml")
+        # an image alone also replaces part of a map that is already there
+        duplicates = sorted({name.partition('.')[0] for name in targets if name.partition('.')[0] in existing_maps
+                             or os.path.exists(os.path.join(amr_robot_maps, name))})
+        if duplicates and not overwrite:
+            raise MapExistsError(f"maps already exist: {', '.join(duplicates)}")
+
+        staged = []
+        try:
+            for name, info in targets.items():
+                tmp_file = os.path.join(amr_robot_maps, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+                staged.append((tmp_file, os.path.join(amr_robot_maps, name)))
+                written = 0
+                with archive.open(info) as src, open(tmp_file, 'wb') as dst:
+                    for chunk in iter(lambda: src.read(COPY_CHUNK), b''):
+                        written += len(chunk)
+                        # never trust the sizes in the zip headers alone
+                        if written > info.file_size or written > max_member_size:
+                            raise MapArchiveError(f"'{info.filename}' inflates beyond its declared size")
+                        dst.write(chunk)
+            # images first, yaml last, so a map never appears before the image it references
+            for tmp_file, target in sorted(staged, key=lambda item: item[1].endswith('.yaml')):
+                os.replace(tmp_file, target)
+        finally:
+            for tmp_file, _ in staged:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+    return map_names
+
+
+class Upload:
+    def __init__(self, upload_id: str, filename: str, size: int, sha256: Optional[str], overwrite: bool,
+                 received: int = 0, created: Optional[float] = None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256.lower() if sha256 else None
+        self.overwrite = overwrite
+        self.received = received
+        self.created = created or time.time()
+
+    def to_dict(self) -> dict:
+        return {'id': self.id,
+                'filename': self.filename,
+                'size': self.size,
+                'sha256': self.sha256,
+                'overwrite': self.overwrite,
+                'received': self.received,
+                'created': self.created}
+
+
+class UploadStore:
+    # chunked uploads are staged on the maps filesystem so the final rename is atomic and survives restarts. Each
+    # upload is serialized with a flock on its .part file, which also covers the other gunicorn workers; the lock
+    # is only held to check the offset, append an already received chunk and save the metadata
+
+    @staticmethod
+    def staging_dir() -> str:
+        return os.path.join(amr_robot_maps, '.uploads')
+
+    @classmethod
+    def __data_file(cls, upload_id: str) -> str:
+        return os.path.join(cls.staging_dir(), f"{upload_id}.part")
+
+    @classmethod
+    def __commit_file(cls, upload_id: str) -> str:
+        return os.path.join(cls.staging_dir(), f"{upload_id}.commit")
+
+    @classmethod
+    def __meta_file(cls, upload_id: str) -> str:
+        return os.path.join(cls.staging_dir(), f"{upload_id}.json")
+
+    @classmethod
+    def __save(cls, upload: Upload) -> None:
+        tmp_file = cls.__meta_file(upload.id) + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(upload.to_dict(), file)
+        os.replace(tmp_file, cls.__meta_file(upload.id))
+
+    @classmethod
+    @contextmanager
+    def __locked(cls, upload_id: str) -> Iterator[BinaryIO]:
+        data_file = cls.__data_file(upload_id)
+        try:
+            file = open(data_file, 'r+b')
+        except FileNotFoundError:
+            raise MapArchiveError("upload is being committed")
+        with file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                # a commit may have claimed (renamed) the file while we waited for the lock
+                if not os.path.exists(data_file) or not os.path.samestat(os.fstat(file.fileno()), os.stat(data_file)):
+                    raise MapArchiveError("upload is being committed")
+                yield file
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    @classmethod
+    def create(cls, filename: str, size: int, sha256: Optional[str], overwrite: bool) -> Upload:
+        os.makedirs(cls.staging_dir(), exist_ok=True)
+        upload = Upload(uuid.uuid4().hex, secure_filename(filename), size, sha256, overwrite)
+        open(cls.__data_file(upload.id), 'wb').close()
+        cls.__save(upload)
+        return upload
+
+    @classmethod
+    def get(cls, upload_id: str) -> Optional[Upload]:
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(cls.__meta_file(upload_id)) as file:
+                upload = Upload(**{key: value for key, value in json.load(file).items() if key != 'id'},
+                                upload_id=upload_id)
+            # the data file is the source of truth for how much arrived, even after a crash mid-chunk
+            if os.path.exists(cls.__data_file(upload_id)):
+                upload.received = os.path.getsize(cls.__data_file(upload_id))
+            else:
+                upload.received = os.path.getsize(cls.__commit_file(upload_id))
+        except (OSError, ValueError, TypeError):
+            return None
+        return upload
+
+    @classmethod
+    def write_chunk(cls, upload: Upload, offset: int, stream: BinaryIO, length: Optional[int],
+                    sha256: Optional[str]) -> Upload:
+        if offset != upload.received:
+            raise MapArchiveError(f"expected chunk at offset {upload.received}")
+        # the chunk is received into its own file first, so a slow client doesn't hold the upload lock
+        digest = hashlib.sha256()
+        written = 0
+        with tempfile.TemporaryFile(dir=cls.staging_dir()) as spool:
+            while True:
+                chunk = stream.read(COPY_CHUNK if length is None else min(COPY_CHUNK, length - written))
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > upload.size:
+                    raise MapArchiveError(f"upload exceeds declared size {upload.size}")
+                digest.update(chunk)
+                spool.write(chunk)
+                written += len(chunk)
+            if sha256 and digest.hexdigest() != sha256.lower():
+                raise MapArchiveError("chunk checksum mismatch")
+            spool.seek(0)
+            with cls.__locked(upload.id) as dst:
+                upload = cls.get(upload.id)
+                if upload is None:
+                    raise MapArchiveError("upload is being committed")
+                if offset != upload.received:
+                    raise MapArchiveError(f"expected chunk at offset {upload.received}")
+                dst.seek(offset)
+                try:
+                    shutil.copyfileobj(spool, dst, COPY_CHUNK)
+                    dst.flush()
+                except Exception:
+                    # drop the partial chunk so the client can resend it from the same offset
+                    dst.truncate(offset)
+                    raise
+                upload.received = offset + written
+                cls.__save(upload)
+        return upload
+
+    @classmethod
+    def commit(cls, upload: Upload, existing_maps: List[str], max_member_size: int, max_ratio: float) -> List[str]:
+        # claimed under the lock by renaming the data file; checked and extracted without holding it
+        with cls.__locked(upload.id):
+            current = cls.get(upload.id)
+            if current is None:
+                raise MapArchiveError("upload is being committed")
+            upload = current
+            if upload.received != upload.size:
+                raise MapArchiveError(f"received {upload.received} of {upload.size} bytes")
+            os.replace(cls.__data_file(upload.id), cls.__commit_file(upload.id))
+        try:
+            if upload.sha256:
+                digest = hashlib.sha256()
+                with open(cls.__commit_file(upload.id), 'rb') as file:
+                    for chunk in iter(lambda: file.read(COPY_CHUNK), b''):
+                        digest.update(chunk)
+                if digest.hexdigest() != upload.sha256:
+                    raise MapArchiveError("upload checksum mismatch")
+            try:
+                map_names = extract_map_archive(cls.__commit_file(upload.id), existing_maps, upload.overwrite,
+                                                max_member_size, max_ratio)
+            except zipfile.BadZipFile as e:
+                raise MapArchiveError(f"not a zip archive: {e}")
+        except Exception:
+            # give it back, so the commit can be retried (e.g. with another name clash resolved)
+            os.replace(cls.__commit_file(upload.id), cls.__data_file(upload.id))
+            raise
+        cls.__remove(upload.id)
+        return map_names
+
+    @classmethod
+    def abort(cls, upload: Upload) -> None:
+        try:
+            with cls.__locked(upload.id):
+                cls.__remove(upload.id)
+        except MapArchiveError:
+            pass
+
+    @classmethod
+    def expire(cls, ttl: float) -> None:
+        staging_dir = cls.staging_dir()
+        if not os.path.isdir(staging_dir):
+            return
+        deadline = time.time() - ttl
+        for filename in os.listdir(staging_dir):
+            path = os.path.join(staging_dir, filename)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            except FileNotFoundError:
+                # expired by another worker in the meantime
+                pass
+
+    @classmethod
+    def __remove(cls, upload_id: str) -> None:
+        for path in (cls.__data_file(upload_id), cls.__commit_file(upload_id), cls.__meta_file(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
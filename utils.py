@@ -1,16 +1,21 @@
-import glob
-import rospkg
+import json
+import logging
 import re
-from typing import List, Union, Tuple
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import yaml
 import os
 from os import path
-import zipfile
 import getpass
-from ament_index_python.packages import get_package_share_directory
 
+BASE_DIR = path.abspath(path.dirname(__file__))
+ROS_CACHE_FILE = path.join(path.expanduser('~'), '.cache', 'robot_api', 'ros_packages.json')
+# another appconfig for a scratch environment, e.g. benchmarks/load.py
+APPCONFIG_FILE = os.environ.get('ROBOT_API_CONFIG', path.join(BASE_DIR, 'appconfig.yaml'))
 
 
+@lru_cache(maxsize=None)
 def get_config() -> dict:
     default_config = {
         "amr_ros_pkg_name": "navigationx_robot",
@@ -18,21 +23,95 @@ def get_config() -> dict:
         "slam_launch": "slam_toolbox.launch.py",
         "navigation_launch": "navigation2.launch.py"
         }
-    with open("appconfig.yaml", "r") as conf_file:
+    with open(APPCONFIG_FILE, "r") as conf_file:
         appconfig = yaml.load(conf_file, Loader=yaml.FullLoader)
-    if all(item in appconfig.keys() for item in default_config.keys()):
-        return appconfig
-    return default_config
+    # optional settings are read with config.get, so a partial appconfig must not drop them
+    return {**default_config, **(appconfig or {})}
 
 
 username = getpass.getuser()
-rospack = rospkg.RosPack()
 config = get_config()
-amr_robot_path = get_package_share_directory(config["amr_ros_pkg_name"])
-# amr_robot_path = rospack.get_path(config["amr_ros_pkg_name"])
-amr_robot_maps =  '/home/nvidia/maps/'
-slam_methods = os.listdir(os.path.join(amr_robot_path, 'launch'))
-slam_methods = [method.partition('.')[0] for method in slam_methods]
+# the routes build paths as amr_robot_maps + name, so it keeps its trailing slash
+amr_robot_maps = path.join(config.get('maps_dir', '/home/nvidia/maps'), '')
+# launch directory -> (mtime_ns, file names)
+_launch_files: Dict[str, Tuple[int, List[str]]] = {}
+# package -> share directory; a package that isn't found is looked up again, ROS may be sourced later
+_package_shares: Dict[str, str] = {}
+_ros_cache_lock = threading.Lock()
+
+
+def _load_ros_cache() -> dict:
+    try:
+        with open(ROS_CACHE_FILE) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    # sourcing another workspace can move every package
+    if cache.get('ament_prefix_path') != os.environ.get('AMENT_PREFIX_PATH', ''):
+        return {}
+    return cache
+
+
+def _update_ros_cache(section: str, key: str, value) -> None:
+    with _ros_cache_lock:
+        cache = _load_ros_cache()
+        cache['ament_prefix_path'] = os.environ.get('AMENT_PREFIX_PATH', '')
+        cache.setdefault(section, {})[key] = value
+        tmp_file = f"{ROS_CACHE_FILE}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(path.dirname(ROS_CACHE_FILE), exist_ok=True)
+            with open(tmp_file, 'w') as file:
+                json.dump(cache, file)
+            os.replace(tmp_file, ROS_CACHE_FILE)
+        except OSError:
+            # the cache only saves time, never fail over it
+            pass
+
+
+def package_share_directory(package: str) -> Optional[str]:
+    if package in _package_shares:
+        return _package_shares[package]
+    share = _load_ros_cache().get('packages', {}).get(package)
+    if share is not None and path.isdir(share):
+        _package_shares[package] = share
+        return share
+    try:
+        # imported here: ament_index_python is slow to import and missing when ROS isn't sourced
+        from ament_index_python.packages import get_package_share_directory
+        share = get_package_share_directory(package)
+    except Exception as e:
+        logging.getLogger(__name__).warning("ROS package '%s' not found: %s", package, e)
+        return None
+    _update_ros_cache('packages', package, share)
+    _package_shares[package] = share
+    return share
+
+
+def launch_files(package: str) -> List[str]:
+    # the listing is kept in memory and on disk, and only re-read when the launch directory's mtime changes
+    share = package_share_directory(package)
+    if share is None:
+        return []
+    launch_dir = path.join(share, 'launch')
+    try:
+        mtime = os.stat(launch_dir).st_mtime_ns
+    except OSError:
+        return []
+    cached = _launch_files.get(launch_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    stored = _load_ros_cache().get('launch', {}).get(launch_dir)
+    if stored is not None and stored['mtime_ns'] == mtime:
+        files = stored['files']
+    else:
+        files = sorted(os.listdir(launch_dir))
+        _update_ros_cache('launch', launch_dir, {'mtime_ns': mtime, 'files': files})
+    _launch_files[launch_dir] = (mtime, files)
+    return files
+
+
+def slam_methods() -> List[str]:
+    return [method.partition('.')[0] for method in launch_files(config["amr_ros_pkg_name"])]
 
 
 def check_filename_ex(filename: str, directory: str) -> bool:
@@ -53,37 +132,9 @@ def check_file_ex(filename: str, extension: str, directory: str) -> bool:
     return False
 
 
-def get_ext_maps() -> List[Tuple[str, Union[str, bytes], Union[str, bytes], str]]:
-    ext_maps = []
-    all_maps_yaml = glob.glob(amr_robot_maps + '*.yaml')
-    for map_yaml in all_maps_yaml:
-        with open(map_yaml) as file:
-            map_descr = yaml.load(file, Loader=yaml.FullLoader)
-            if map_descr is not None and 'image' in map_descr.keys():
-                map_pgm = path.join(amr_robot_maps, path.basename(map_descr['image']))
-                map_name = path.basename(map_yaml).partition('.')[0]
-                map_png = str(map_pgm.partition('.')[0]) + '.png'
-                if path.isfile(map_pgm):
-                    if not path.isfile(map_png):
-                        os.system("convert" + " " + map_pgm + " " + map_png)
-                    ext_maps.append((map_name, map_yaml, map_pgm, map_png))
-                file.close()
-    return ext_maps
-
-
-def compress_maps() -> None:
-    for map_name, map_yaml, map_pgm, map_png in get_ext_maps():
-        map_zip = os.path.join(amr_robot_maps, f'{map_name}.zip')
-        if os.path.isfile(map_zip):
-            pass
-        else:
-            with zipfile.ZipFile(map_zip, mode='w') as archive:
-                archive.write(filename=map_yaml, arcname=os.path.basename(map_yaml))
-                archive.write(filename=map_pgm, arcname=os.path.basename(map_pgm))
-                archive.write(filename=map_png, arcname=os.path.basename(map_png))
-                archive.close()
-
-
-def extract_map(filename: str) -> None:
-    with zipfile.ZipFile(filename) as file:
-        file.extractall(amr_robot_maps)
+def read_map_descr(map_yaml: str) -> Optional[dict]:
+    with open(map_yaml) as file:
+        map_descr = yaml.load(file, Loader=yaml.FullLoader)
+    if isinstance(map_descr, dict) and 'image' in map_descr.keys():
+        return map_descr
+    return None
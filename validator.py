@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Union, Optional
+from typing import List, Union, Optional
 
 
 class ValidateMapping(BaseModel):
@@ -12,6 +12,23 @@ class ValidateNavigation(BaseModel):
     local_planner_type: Optional[str] = "teb"
 
 
+class ValidateSwitchMap(BaseModel):
+    map_name: str
+
+
+class ValidateWall(BaseModel):
+    type: str
+    points: List[List[float]]
+    width: Optional[float] = None
+    id: Optional[str] = None
+
+
+class ValidateVirtualWalls(BaseModel):
+    add: List[ValidateWall] = []
+    remove: List[str] = []
+    replace: Optional[bool] = False
+
+
 class ValidateUserRegister(BaseModel):
     username: str
     password: str
@@ -22,6 +39,33 @@ class ValidateUserDelete(BaseModel):
     username: str
 
 
+class ValidateTokenRefresh(BaseModel):
+    refresh_token: str
+
+
+class ValidateLogTail(BaseModel):
+    offset: Optional[int] = None
+    max_bytes: Optional[int] = None
+    level: Optional[str] = None
+    regex: Optional[str] = None
+    since: Optional[float] = None
+    follow: Optional[bool] = False
+
+
+class ValidateUploadInit(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    overwrite: Optional[bool] = False
+
+
+class ValidateFleetMap(BaseModel):
+    map_name: str
+    robots: Optional[List[str]] = None
+    source: Optional[str] = None
+    overwrite: Optional[bool] = False
+
+
 class RespWrapper(BaseModel):
     error: Union[bool, None] = False
     message: Union[str, None] = None
@@ -0,0 +1,205 @@
+import fcntl
+import json
+import math
+import os
+import shutil
+import time
+import uuid
+from typing import Iterable, List, Optional, Set, Tuple
+import numpy as np
+import yaml
+from catalog import MapEntry
+from mapimage import open_map_image
+from shared import run_dir
+from utils import amr_robot_maps
+
+DIRTY_TILE = 256
+# a wall marks every cell it passes through, however thin
+MIN_HALF_WIDTH = math.sqrt(0.5)
+WALL_TYPES = ('polyline', 'polygon')
+
+
+class WallError(ValueError):
+    pass
+
+
+def virtual_name(map_name: str) -> str:
+    return f"{map_name}_virtual"
+
+
+def walls_file(map_name: str) -> str:
+    return os.path.join(amr_robot_maps, f"{virtual_name(map_name)}.walls.json")
+
+
+def read_walls(map_name: str) -> Optional[dict]:
+    try:
+        with open(walls_file(map_name)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def check_wall(wall: dict) -> None:
+    if wall['type'] not in WALL_TYPES:
+        raise WallError(f"wall type must be one of {', '.join(WALL_TYPES)}")
+    if any(len(point) != 2 for point in wall['points']):
+        raise WallError("wall points must be [x, y] pairs")
+    if len(wall['points']) < (3 if wall['type'] == 'polygon' else 2):
+        raise WallError(f"a {wall['type']} needs at least {3 if wall['type'] == 'polygon' else 2} points")
+    if wall.get('width') is not None and wall['width'] < 0:
+        raise WallError("wall width can't be negative")
+
+
+class Raster:
+    # map coordinates (meters, origin at the bottom-left corner) to continuous pixel coordinates
+    # (columns right, rows down from the top edge); pixel (row, col) has its center at (col + 0.5, row + 0.5)
+    def __init__(self, meta: dict, shape: Tuple[int, int]):
+        self.resolution = float(meta['resolution'])
+        self.origin = [float(value) for value in meta['origin'][:2]]
+        self.height, self.width = shape
+
+    def pixels(self, wall: dict) -> Tuple[np.ndarray, float]:
+        points = np.asarray(wall['points'], dtype=np.float64)
+        cols = (points[:, 0] - self.origin[0]) / self.resolution
+        rows = self.height - (points[:, 1] - self.origin[1]) / self.resolution
+        width = wall.get('width') or 0.0
+        return np.stack([cols, rows], axis=1), max(width / self.resolution / 2, MIN_HALF_WIDTH)
+
+    def tiles(self, wall: dict) -> Set[Tuple[int, int]]:
+        points, half = self.pixels(wall)
+        low = np.floor((points.min(axis=0) - half) / DIRTY_TILE).astype(int)
+        high = np.floor((points.max(axis=0) + half) / DIRTY_TILE).astype(int)
+        last_col, last_row = (self.width - 1) // DIRTY_TILE, (self.height - 1) // DIRTY_TILE
+        return {(row, col)
+                for row in range(max(low[1], 0), min(high[1], last_row) + 1)
+                for col in range(max(low[0], 0), min(high[0], last_col) + 1)}
+
+    def mask(self, wall: dict, rows: slice, cols: slice) -> np.ndarray:
+        # cells of the window within half the wall width of a segment; polygons are also filled (even-odd rule)
+        points, half = self.pixels(wall)
+        col_centers, row_centers = np.meshgrid(np.arange(cols.start, cols.stop) + 0.5,
+                                               np.arange(rows.start, rows.stop) + 0.5)
+        mask = np.zeros(col_centers.shape, dtype=bool)
+        inside = np.zeros(col_centers.shape, dtype=bool)
+        closed = wall['type'] == 'polygon'
+        ends = np.roll(points, -1, axis=0) if closed else points[1:]
+        for (col_a, row_a), (col_b, row_b) in zip(points, ends):
+            d_col, d_row = col_b - col_a, row_b - row_a
+            length = d_col * d_col + d_row * d_row
+            t = ((col_centers - col_a) * d_col + (row_centers - row_a) * d_row) / length if length else 0.0
+            t = np.clip(t, 0.0, 1.0)
+            distance = (col_centers - col_a - t * d_col) ** 2 + (row_centers - row_a - t * d_row) ** 2
+            mask |= distance <= half * half
+            if closed and row_a != row_b:
+                crosses = (row_a > row_centers) != (row_b > row_centers)
+                inside ^= crosses & (col_centers < col_a + d_col * (row_centers - row_a) / d_row)
+        return mask | inside
+
+
+class VirtualWalls:
+    # walls drawn over a copy of a map, registered as '<map>_virtual'. The walls are kept next to it, so an edit
+    # only re-rasterizes the tiles its walls touch, in a copy of the image; a first or full rebuild draws a new one.
+    # Either is swapped in, with the yaml last, which is what makes the catalog pick the map up
+    @staticmethod
+    def get(map_name: str) -> List[dict]:
+        state = read_walls(map_name)
+        return state['walls'] if state is not None else []
+
+    @classmethod
+    def apply(cls, entry: MapEntry, add: Iterable[dict], remove: Iterable[str], replace: bool = False) -> dict:
+        started = time.monotonic()
+        add = [dict(wall, id=wall.get('id') or uuid.uuid4().hex[:8]) for wall in add]
+        for wall in add:
+            check_wall(wall)
+        os.makedirs(run_dir(), exist_ok=True)
+        with open(os.path.join(run_dir(), 'virtualwalls.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return cls.__apply(entry, add, set(remove), replace, started)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @classmethod
+    def __apply(cls, entry: MapEntry, add: List[dict], remove: Set[str], replace: bool, started: float) -> dict:
+        name = virtual_name(entry.name)
+        map_pgm = os.path.join(amr_robot_maps, f"{name}.pgm")
+        map_yaml = os.path.join(amr_robot_maps, f"{name}.yaml")
+        base, maxval = open_map_image(entry.pgm)
+        raster = Raster(entry.meta, base.shape)
+        state = read_walls(entry.name)
+        source = [entry.mtimes.get('pgm'), entry.sizes.get('pgm'), entry.mtimes.get('yaml')]
+        full = state is None or state.get('source') != source or not os.path.isfile(map_pgm)
+        walls = [] if state is None or replace else state['walls']
+        missing = remove - {wall['id'] for wall in walls}
+        if missing:
+            raise WallError(f"unknown walls {', '.join(sorted(missing))}")
+        changed = [wall for wall in walls if wall['id'] in remove or replace] + add
+        walls = [wall for wall in walls if wall['id'] not in remove and not replace]
+        ids = {wall['id'] for wall in walls}
+        for wall in add:
+            if wall['id'] in ids:
+                raise WallError(f"wall '{wall['id']}' already exists")
+            ids.add(wall['id'])
+        walls += add
+
+        height, width = base.shape
+        dtype = np.dtype('>u2') if maxval > 255 else np.dtype('u1')
+        header = b'P5\n%d %d\n%d\n' % (width, height, maxval)
+        full = full or os.path.getsize(map_pgm) != len(header) + width * height * dtype.itemsize
+        if full:
+            dirty = {(row, col) for row in range(math.ceil(height / DIRTY_TILE))
+                     for col in range(math.ceil(width / DIRTY_TILE))}
+        else:
+            dirty = set().union(*(raster.tiles(wall) for wall in changed))
+
+        tmp_pgm = os.path.join(amr_robot_maps, f".{name}.pgm.{uuid.uuid4().hex}.tmp")
+        try:
+            if full:
+                with open(tmp_pgm, 'wb') as file:
+                    file.write(header)
+                    file.truncate(len(header) + width * height * dtype.itemsize)
+            else:
+                # only the dirty tiles are drawn again, into a copy, so a reader of the registered image never sees
+                # half an edit. Until the new walls are saved the state names no source, so an edit that doesn't
+                # finish makes the next one redraw everything
+                with open(walls_file(entry.name) + '.tmp', 'w') as file:
+                    json.dump({'map': entry.name, 'source': None, 'walls': state['walls']}, file)
+                os.replace(walls_file(entry.name) + '.tmp', walls_file(entry.name))
+                shutil.copyfile(map_pgm, tmp_pgm)
+            image = np.memmap(tmp_pgm, dtype=dtype, mode='r+', offset=len(header), shape=(height, width))
+            occupied = maxval if entry.meta.get('negate', 0) else 0
+            tile_walls = {}
+            for wall in walls:
+                for tile in raster.tiles(wall) & dirty:
+                    tile_walls.setdefault(tile, []).append(wall)
+            for row, col in dirty:
+                rows = slice(row * DIRTY_TILE, min((row + 1) * DIRTY_TILE, height))
+                cols = slice(col * DIRTY_TILE, min((col + 1) * DIRTY_TILE, width))
+                window = np.array(base[rows, cols], dtype=dtype)
+                for wall in tile_walls.get((row, col), []):
+                    window[raster.mask(wall, rows, cols)] = occupied
+                image[rows, cols] = window
+            image.flush()
+            del image
+
+            meta = dict(entry.meta, image=f"{name}.pgm")
+            tmp_yaml = os.path.join(amr_robot_maps, f".{name}.yaml.tmp")
+            with open(tmp_yaml, 'w') as file:
+                yaml.safe_dump(meta, file, sort_keys=False, default_flow_style=None)
+            tmp_walls = walls_file(entry.name) + '.tmp'
+            with open(tmp_walls, 'w') as file:
+                json.dump({'map': entry.name, 'source': source, 'walls': walls}, file)
+            # the png preview is derived again by the catalog
+            if os.path.exists(os.path.join(amr_robot_maps, f"{name}.png")):
+                os.remove(os.path.join(amr_robot_maps, f"{name}.png"))
+            os.replace(tmp_pgm, map_pgm)
+            os.replace(tmp_walls, walls_file(entry.name))
+            os.replace(tmp_yaml, map_yaml)
+        finally:
+            if os.path.exists(tmp_pgm):
+                os.remove(tmp_pgm)
+        return {'map': name,
+                'walls': walls,
+                'dirty_tiles': len(dirty),
+                'tiles': math.ceil(height / DIRTY_TILE) * math.ceil(width / DIRTY_TILE),
+                'latency': time.monotonic() - started}
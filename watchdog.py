@@ -0,0 +1,208 @@
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from events import EventBus
+from metrics import WATCHDOG_DOWNTIME_SECONDS, Metrics
+from utils import config
+
+MAX_INCIDENTS = 100
+# a pidfd turns readable when the process exits; without pidfd support the stacks are polled this often
+POLL_INTERVAL = 0.5
+# the launch service reaps its launches a moment after they exit
+REAP_TIMEOUT = 5.0
+STACKS = ('bringup', 'mapping', 'navigation')
+
+
+def open_pidfd(pid: int) -> Optional[int]:
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+class Watchdog:
+    # opt-in (appconfig 'watchdog'): restarts a stack that exited without being stopped, on the leader. Exits are
+    # noticed through pidfds rather than client polling; restarts back off exponentially and a stack that keeps
+    # crashing is left stopped once it used up watchdog_max_restarts within watchdog_window seconds
+    __thread: Optional[threading.Thread] = None
+    __wake = os.pipe()
+    # stack -> (process, pidfd)
+    __watched: Dict[str, Tuple[object, Optional[int]]] = {}
+    __closing: List[int] = []
+    # stack -> times of its recent restarts
+    __restarts: Dict[str, List[float]] = {}
+    __crash_loop: Set[str] = set()
+    # stack -> cancels its scheduled restart
+    __pending: Dict[str, threading.Event] = {}
+    __restarting: Set[str] = set()
+    __incidents: Deque[dict] = deque(maxlen=MAX_INCIDENTS)
+    __lock = threading.RLock()
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(config.get('watchdog', False))
+
+    @classmethod
+    def start(cls) -> None:
+        if not cls.enabled() or (cls.__thread is not None and cls.__thread.is_alive()):
+            return
+        cls.__thread = threading.Thread(target=cls.__run, name='watchdog', daemon=True)
+        cls.__thread.start()
+
+    @classmethod
+    def watch(cls, stack: str, process) -> None:
+        if not cls.enabled():
+            return
+        with cls.__lock:
+            cls.__forget(stack)
+            if stack not in cls.__restarting:
+                # started by an operator: a crash loop is over, and so is a restart still waiting
+                cls.__restarts.pop(stack, None)
+                cls.__crash_loop.discard(stack)
+                cancel = cls.__pending.pop(stack, None)
+                if cancel is not None:
+                    cancel.set()
+            cls.__watched[stack] = (process, open_pidfd(process.pid))
+        os.write(cls.__wake[1], b'\0')
+
+    @classmethod
+    def unwatch(cls, stack: str) -> None:
+        # an intended stop; stopping bringup also calls off the restarts of the stacks running on it
+        with cls.__lock:
+            cls.__forget(stack)
+            for pending in (STACKS if stack == 'bringup' else (stack,)):
+                cancel = cls.__pending.pop(pending, None)
+                if cancel is not None:
+                    cancel.set()
+        os.write(cls.__wake[1], b'\0')
+
+    @classmethod
+    def exited(cls, stack: str, pid: Optional[int], returncode: Optional[int]) -> None:
+        # the launcher found a stack gone that nobody stopped
+        if not cls.enabled():
+            return
+        window = float(config.get('watchdog_window', 300))
+        max_restarts = int(config.get('watchdog_max_restarts', 5))
+        with cls.__lock:
+            cls.__forget(stack)
+            now = time.time()
+            restarts = [stamp for stamp in cls.__restarts.get(stack, []) if stamp > now - window]
+            cls.__restarts[stack] = restarts
+            incident = {'id': uuid.uuid4().hex, 'stack': stack, 'pid': pid, 'returncode': returncode,
+                        'time': now, 'attempt': len(restarts) + 1, 'action': 'restart', 'backoff': None,
+                        'restarted': None, 'restarted_pid': None, 'downtime': None, 'error': None}
+            if len(restarts) >= max_restarts:
+                incident['action'] = 'crash_loop'
+                cls.__crash_loop.add(stack)
+            else:
+                incident['backoff'] = min(float(config.get('watchdog_backoff', 1.0)) * 2 ** len(restarts),
+                                          float(config.get('watchdog_backoff_max', 30)))
+                cancel = threading.Event()
+                cls.__pending[stack] = cancel
+                threading.Thread(target=cls.__restart, args=(stack, incident, cancel), name=f"watchdog-{stack}",
+                                 daemon=True).start()
+            cls.__incidents.append(incident)
+        logging.getLogger(__name__).warning("%s exited with %s, watchdog: %s", stack, returncode, incident['action'])
+        EventBus.publish('watchdog', dict(incident))
+
+    @classmethod
+    def report(cls) -> dict:
+        window = float(config.get('watchdog_window', 300))
+        with cls.__lock:
+            now = time.time()
+            stacks = {stack: {'watched': stack in cls.__watched,
+                              'restarts': len([stamp for stamp in cls.__restarts.get(stack, [])
+                                               if stamp > now - window]),
+                              'restart_pending': stack in cls.__pending,
+                              'crash_loop': stack in cls.__crash_loop}
+                      for stack in STACKS}
+            return {'enabled': cls.enabled(),
+                    'pidfd': hasattr(os, 'pidfd_open'),
+                    'stacks': stacks,
+                    'incidents': [dict(incident) for incident in reversed(cls.__incidents)]}
+
+    @classmethod
+    def __forget(cls, stack: str) -> None:
+        # pidfds are only closed by the watchdog thread, never while it selects on them
+        watched = cls.__watched.pop(stack, None)
+        if watched is not None and watched[1] is not None:
+            cls.__closing.append(watched[1])
+
+    @classmethod
+    def __restart(cls, stack: str, incident: dict, cancel: threading.Event) -> None:
+        from launcher import Launcher
+        # the supervisor is still clearing the stopped process group
+        while Launcher.stopping(stack) is not None and not cancel.wait(0.1):
+            pass
+        deadline = time.monotonic() + incident['backoff'] + float(config.get('watchdog_backoff_max', 30))
+        if not cancel.wait(incident['backoff']):
+            # mapping and navigation need bringup back first, which may have crashed along with them
+            while True:
+                with cls.__lock:
+                    cls.__restarting.add(stack)
+                try:
+                    pid = Launcher.restart(stack, incident['pid'])
+                except Exception as e:
+                    incident['error'] = str(e)
+                    break
+                finally:
+                    with cls.__lock:
+                        cls.__restarting.discard(stack)
+                if pid is not None:
+                    with cls.__lock:
+                        incident['restarted'] = time.time()
+                        incident['restarted_pid'] = pid
+                        incident['downtime'] = incident['restarted'] - incident['time']
+                    Metrics.observe(WATCHDOG_DOWNTIME_SECONDS, incident['downtime'], stack=stack)
+                    break
+                if time.monotonic() > deadline:
+                    incident['error'] = "the launcher isn't in a state to restart it"
+                    break
+                if cancel.wait(POLL_INTERVAL):
+                    break
+        with cls.__lock:
+            if cancel.is_set():
+                incident['action'] = 'cancelled'
+            elif incident['restarted'] is not None:
+                cls.__restarts.setdefault(stack, []).append(incident['restarted'])
+            if cls.__pending.get(stack) is cancel:
+                del cls.__pending[stack]
+        EventBus.publish('watchdog', dict(incident))
+
+    @classmethod
+    def __run(cls) -> None:
+        from launcher import Launcher, ProcessState
+        os.set_blocking(cls.__wake[0], False)
+        while True:
+            try:
+                with cls.__lock:
+                    for fd in cls.__closing:
+                        os.close(fd)
+                    cls.__closing.clear()
+                    descriptors = {fd: stack for stack, (_, fd) in cls.__watched.items() if fd is not None}
+                    polled = [stack for stack, (_, fd) in cls.__watched.items() if fd is None]
+                readable, _, _ = select.select([cls.__wake[0], *descriptors], [], [],
+                                               POLL_INTERVAL if polled else None)
+                if cls.__wake[0] in readable:
+                    os.read(cls.__wake[0], 4096)
+                exited = [descriptors[fd] for fd in readable if fd in descriptors]
+                with cls.__lock:
+                    exited += [stack for stack in polled
+                               if stack in cls.__watched and cls.__watched[stack][0].poll() is not None]
+                    processes = {stack: cls.__watched[stack][0] for stack in exited if stack in cls.__watched}
+                    for stack in processes:
+                        cls.__forget(stack)
+                for stack, process in processes.items():
+                    # the launcher's own exit handling stops the stack and reports it back through exited()
+                    deadline = time.monotonic() + REAP_TIMEOUT
+                    while Launcher.is_current(stack, process) and time.monotonic() < deadline \
+                            and Launcher.process_state(stack) == ProcessState.RUNNING:
+                        time.sleep(0.05)
+            except Exception:
+                logging.getLogger(__name__).exception("watchdog failed")
+                time.sleep(POLL_INTERVAL)
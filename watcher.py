@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from launcher import Launcher
+from catalog import MapCatalog
+from control import Control
+from events import EventBus
+
+
+class Watcher:
+    # single background poll shared by every event subscriber, instead of one poll per client
+    __thread: Optional[threading.Thread] = None
+    __processes: Dict[str, Tuple[str, Optional[int]]] = {}
+
+    @classmethod
+    def start(cls, interval: float = 0.5) -> None:
+        if cls.__thread is not None and cls.__thread.is_alive():
+            return
+        cls.__thread = threading.Thread(target=cls.__run, args=(interval,), name='watcher', daemon=True)
+        cls.__thread.start()
+
+    @classmethod
+    def processes(cls) -> Dict[str, dict]:
+        return {'bringup': {'state': Launcher.bringup_state().value, 'pid': Launcher.bringup_pid()},
+                'mapping': {'state': Launcher.mapping_state().value, 'pid': Launcher.mapping_pid()},
+                'navigation': {'state': Launcher.navigation_state().value, 'pid': Launcher.navigation_pid()}}
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        return {'launcher': Launcher.state.value, 'processes': cls.processes(), 'maps': MapCatalog.names()}
+
+    @staticmethod
+    def shared_snapshot() -> dict:
+        # the same, from the state the leader published, for callers that must not wait on the launcher lock
+        launcher = Control.shared_launcher()
+        return {'launcher': launcher['state'],
+                'processes': {stack: {'state': process['state'], 'pid': process['pid']}
+                              for stack, process in launcher['stacks'].items()},
+                'maps': MapCatalog.names()}
+
+    @classmethod
+    def __run(cls, interval: float) -> None:
+        while True:
+            try:
+                for stack, process in cls.processes().items():
+                    current = (process['state'], process['pid'])
+                    if cls.__processes.get(stack) != current:
+                        cls.__processes[stack] = current
+                        EventBus.publish('process', {'launcher': Launcher.state.value, 'stack': stack, **process})
+                MapCatalog.refresh()
+            except Exception:
+                logging.getLogger(__name__).exception("watcher poll failed")
+            time.sleep(interval)